@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready
+from banking.utils.web3_utils import close_async_web3_client
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI app, plus the lifespan events that close the worker's RPC session
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_web3_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -11,7 +11,11 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import copy
 import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +56,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'banking.db_router.ReplicaPinMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -79,13 +84,105 @@ TEMPLATES = [
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE=postgres for production; the default SQLite file suits a single node
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'banking'),
+            'USER': os.environ.get('POSTGRES_USER', 'banking'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DB_POOL', '1') == '1':
+        # psycopg pool shared by the threads of a worker; Django requires
+        # CONN_MAX_AGE=0 when pooling
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        # One persistent connection per thread, checked before reuse
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('CONN_MAX_AGE', 60))
+        DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', os.path.join(BASE_DIR, 'data', 'db.sqlite3')),
+            'OPTIONS': {
+                # WAL lets readers run alongside the writer, and IMMEDIATE
+                # transactions take the write lock up front instead of
+                # failing with "database is locked" when upgrading to it
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))};"
+                    f"PRAGMA mmap_size={int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))};"
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)) / 1000,
+            },
+            # Tests run on a file as well, so they get WAL and real write locking.
+            # The file is per process so concurrent test runs don't share it
+            'TEST': {
+                'NAME': os.environ.get(
+                    'SQLITE_TEST_PATH',
+                    os.path.join(tempfile.gettempdir(), f'banking-test-{os.getpid()}.sqlite3')
+                ),
+            },
+        }
+    }
+
+# Read replicas for the read-heavy banking pages, see banking/db_router.py.
+# Comma-separated PostgreSQL hosts, or SQLite files kept in sync locally by
+# `manage.py sync_sqlite_replicas`
+READ_REPLICAS_ENABLED = os.environ.get('READ_REPLICAS_ENABLED', '0') == '1'
+# Seconds a browser reads from the primary after it writes
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+if READ_REPLICAS_ENABLED:
+    if DATABASE_ENGINE == 'postgres':
+        replica_settings = [
+            {'HOST': host.strip()}
+            for host in os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',') if host.strip()
+        ]
+    else:
+        replica_settings = [
+            {'NAME': path.strip()}
+            for path in os.environ.get('SQLITE_REPLICA_PATHS', '').split(',') if path.strip()
+        ]
+    for index, replica in enumerate(replica_settings, start=1):
+        DATABASES[f'replica{index}'] = {
+            **copy.deepcopy(DATABASES['default']),
+            **replica,
+            'TEST': {'MIRROR': 'default'},
+        }
+    DATABASE_ROUTERS = ['banking.db_router.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Share the cache between workers when Redis is available
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -117,7 +214,137 @@ USE_I18N = True
 USE_TZ = True
 
 WEB3_PROVIDER_URL = 'https://mainnet.infura.io/v3/fb16afe2171643e4911a9ebfcab9f716'
-ENCRYPTION_KEY =b'QExnAcyYmacMQlhFlO_3gKvqPTR610VN2M5k4psVop8=' 
+# Comma separated list of RPC providers, routed by latency with failover
+WEB3_PROVIDER_URLS = [
+    url.strip()
+    for url in os.environ.get('WEB3_PROVIDER_URLS', WEB3_PROVIDER_URL).split(',')
+    if url.strip()
+]
+ENCRYPTION_KEY =b'QExnAcyYmacMQlhFlO_3gKvqPTR610VN2M5k4psVop8='
+
+# Pooled keep-alive RPC sessions (one per worker process)
+WEB3_HTTP_POOL_CONNECTIONS = int(os.environ.get('WEB3_HTTP_POOL_CONNECTIONS', 10))
+WEB3_HTTP_POOL_MAXSIZE = int(os.environ.get('WEB3_HTTP_POOL_MAXSIZE', 20))
+WEB3_HTTP_CONNECT_TIMEOUT = float(os.environ.get('WEB3_HTTP_CONNECT_TIMEOUT', 3.05))
+WEB3_HTTP_TIMEOUT = float(os.environ.get('WEB3_HTTP_TIMEOUT', 10))
+# Seconds of idle time before TCP keep-alive probes start, 0 to disable
+WEB3_HTTP_KEEPALIVE_IDLE = int(os.environ.get('WEB3_HTTP_KEEPALIVE_IDLE', 60))
+
+# Provider routing: read calls slower than WEB3_HEDGE_AFTER seconds are also
+# sent to the next provider (0 disables hedging); a provider is ejected after
+# WEB3_CIRCUIT_FAILURE_THRESHOLD failures in a row and probed every
+# WEB3_CIRCUIT_PROBE_INTERVAL seconds until it answers again
+WEB3_HEDGE_AFTER = float(os.environ.get('WEB3_HEDGE_AFTER', 0.5))
+WEB3_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('WEB3_CIRCUIT_FAILURE_THRESHOLD', 3))
+WEB3_CIRCUIT_PROBE_INTERVAL = float(os.environ.get('WEB3_CIRCUIT_PROBE_INTERVAL', 15))
+# Weight of the newest sample in the moving latency average
+WEB3_LATENCY_ALPHA = float(os.environ.get('WEB3_LATENCY_ALPHA', 0.2))
+
+# Route the dashboard, send and detail pages to the async views in
+# banking.async_views; only useful when served through auth_project.asgi
+ASYNC_VIEWS = bool(int(os.environ.get('ASYNC_VIEWS', 0)))
+
+# EIP-1559 fee oracle: polls for new blocks every FEE_ORACLE_POLL_INTERVAL
+# seconds and derives fees from the FEE_PRIORITY_PERCENTILE of tips paid over
+# the last FEE_HISTORY_BLOCKS blocks
+FEE_ORACLE_POLL_INTERVAL = float(os.environ.get('FEE_ORACLE_POLL_INTERVAL', 3))
+FEE_HISTORY_BLOCKS = int(os.environ.get('FEE_HISTORY_BLOCKS', 10))
+FEE_PRIORITY_PERCENTILE = float(os.environ.get('FEE_PRIORITY_PERCENTILE', 50))
+# Seconds an estimate may be served without a refresh
+FEE_ESTIMATE_MAX_AGE = int(os.environ.get('FEE_ESTIMATE_MAX_AGE', 60))
+
+# Bulk payouts: lists of at least PAYOUT_PROCESS_POOL_MIN_ROWS rows are signed
+# in a pool of PAYOUT_SIGNING_PROCESSES processes, PAYOUT_SIGNING_CHUNK_SIZE
+# rows per task, and broadcast PAYOUT_BROADCAST_BATCH_SIZE per RPC batch
+PAYOUT_MAX_ROWS = int(os.environ.get('PAYOUT_MAX_ROWS', 1000))
+PAYOUT_PROCESS_POOL_MIN_ROWS = int(os.environ.get('PAYOUT_PROCESS_POOL_MIN_ROWS', 50))
+PAYOUT_SIGNING_PROCESSES = int(os.environ.get('PAYOUT_SIGNING_PROCESSES', os.cpu_count() or 1))
+PAYOUT_SIGNING_CHUNK_SIZE = int(os.environ.get('PAYOUT_SIGNING_CHUNK_SIZE', 25))
+PAYOUT_BROADCAST_BATCH_SIZE = int(os.environ.get('PAYOUT_BROADCAST_BATCH_SIZE', 50))
+# Payouts run in the background, this many at a time per web worker
+PAYOUT_WORKERS = int(os.environ.get('PAYOUT_WORKERS', 2))
+
+# Identical in-flight reads (receipts, blocks, block number) share one upstream
+# call per worker; WEB3_COALESCE_SHARED also shares them across workers
+# through the cache for WEB3_COALESCE_SHARED_TTL seconds
+WEB3_COALESCE_SHARED = bool(int(os.environ.get('WEB3_COALESCE_SHARED', 0)))
+WEB3_COALESCE_SHARED_TTL = float(os.environ.get('WEB3_COALESCE_SHARED_TTL', 1))
+WEB3_COALESCE_WAIT = float(os.environ.get('WEB3_COALESCE_WAIT', 2))
+
+# ETH/USD price feed, sources are tried in order by a background refresher
+ETH_PRICE_SOURCES = [
+    path.strip()
+    for path in os.environ.get(
+        'ETH_PRICE_SOURCES', 'banking.utils.price_feed.CoinGeckoSource'
+    ).split(',')
+    if path.strip()
+]
+# Price returned by banking.utils.price_feed.StaticPriceSource
+ETH_PRICE_STATIC = os.environ.get('ETH_PRICE_STATIC', '2000')
+ETH_PRICE_TIMEOUT = float(os.environ.get('ETH_PRICE_TIMEOUT', 3))
+ETH_PRICE_REFRESH_INTERVAL = float(os.environ.get('ETH_PRICE_REFRESH_INTERVAL', 30))
+# Seconds a price may be served at all once refreshes keep failing
+ETH_PRICE_MAX_AGE = int(os.environ.get('ETH_PRICE_MAX_AGE', 3600))
+
+# Receipt monitor: seconds between new-head checks, receipts per batch request
+MONITOR_POLL_INTERVAL = float(os.environ.get('MONITOR_POLL_INTERVAL', 3))
+MONITOR_RECEIPT_BATCH_SIZE = int(os.environ.get('MONITOR_RECEIPT_BATCH_SIZE', 100))
+# Seconds a monitor worker's lease lasts without a heartbeat, rows leased at a
+# time, and the most rows one worker watches
+MONITOR_LEASE_TTL = int(os.environ.get('MONITOR_LEASE_TTL', 30))
+MONITOR_LEASE_BATCH_SIZE = int(os.environ.get('MONITOR_LEASE_BATCH_SIZE', 200))
+MONITOR_MAX_LEASED = int(os.environ.get('MONITOR_MAX_LEASED', 2000))
+# Incoming-transfer indexer: blocks fetched per checkpoint, blocks kept behind the head
+INDEXER_BLOCKS_PER_PASS = int(os.environ.get('INDEXER_BLOCKS_PER_PASS', 20))
+INDEXER_CONFIRMATIONS = int(os.environ.get('INDEXER_CONFIRMATIONS', 2))
+
+# Transactions per history page, and the most the JSON endpoint returns at once
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', 200))
+# Rows fetched per database round trip while streaming an export, also the
+# lines moved per thread hop when the export is served over ASGI
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Wallets per balance batch when the refresher sweeps every snapshot
+SNAPSHOT_BATCH_SIZE = int(os.environ.get('SNAPSHOT_BATCH_SIZE', 500))
+
+# Unix socket of the `manage.py run_signer` daemon; empty signs in-process.
+# The daemon keeps up to SIGNER_KEY_CACHE_SIZE decrypted keys for
+# SIGNER_KEY_TTL seconds each
+SIGNER_SOCKET = os.environ.get('SIGNER_SOCKET', '')
+SIGNER_TIMEOUT = float(os.environ.get('SIGNER_TIMEOUT', 5))
+SIGNER_KEY_CACHE_SIZE = int(os.environ.get('SIGNER_KEY_CACHE_SIZE', 1000))
+SIGNER_KEY_TTL = int(os.environ.get('SIGNER_KEY_TTL', 300))
+
+# Most multisigs listed in a signer's inbox
+MULTISIG_INBOX_SIZE = int(os.environ.get('MULTISIG_INBOX_SIZE', 100))
+# Expired multisigs marked per UPDATE by the expiry sweeper
+MULTISIG_SWEEP_BATCH_SIZE = int(os.environ.get('MULTISIG_SWEEP_BATCH_SIZE', 1000))
+# Multisig executor: queue rows per batch, attempts before giving up, retry
+# delay in seconds (doubled per attempt, capped), and how long a claim lasts
+MULTISIG_EXECUTOR_BATCH_SIZE = int(os.environ.get('MULTISIG_EXECUTOR_BATCH_SIZE', 50))
+MULTISIG_EXECUTOR_MAX_ATTEMPTS = int(os.environ.get('MULTISIG_EXECUTOR_MAX_ATTEMPTS', 5))
+MULTISIG_EXECUTOR_BACKOFF = int(os.environ.get('MULTISIG_EXECUTOR_BACKOFF', 10))
+MULTISIG_EXECUTOR_BACKOFF_MAX = int(os.environ.get('MULTISIG_EXECUTOR_BACKOFF_MAX', 600))
+MULTISIG_EXECUTOR_LEASE = int(os.environ.get('MULTISIG_EXECUTOR_LEASE', 60))
+# Multisig signatures checked per verifier batch; batches of at least
+# SIGNATURE_PROCESS_POOL_MIN_SIZE are recovered in a pool of
+# SIGNATURE_VERIFY_PROCESSES processes, SIGNATURE_VERIFY_CHUNK_SIZE per task
+SIGNATURE_VERIFY_BATCH_SIZE = int(os.environ.get('SIGNATURE_VERIFY_BATCH_SIZE', 1000))
+SIGNATURE_PROCESS_POOL_MIN_SIZE = int(os.environ.get('SIGNATURE_PROCESS_POOL_MIN_SIZE', 200))
+SIGNATURE_VERIFY_PROCESSES = int(os.environ.get('SIGNATURE_VERIFY_PROCESSES', os.cpu_count() or 1))
+SIGNATURE_VERIFY_CHUNK_SIZE = int(os.environ.get('SIGNATURE_VERIFY_CHUNK_SIZE', 100))
+
+# Seconds an allocated nonce may go unreported before its sender counts as gone
+NONCE_ALLOCATION_TIMEOUT = int(os.environ.get('NONCE_ALLOCATION_TIMEOUT', 900))
+# Seconds between checks of an idle wallet's nonce counter against the chain
+NONCE_RESYNC_INTERVAL = int(os.environ.get('NONCE_RESYNC_INTERVAL', 60))
+# Seconds the chain head is reused before asking the node again
+CHAIN_HEAD_TTL = float(os.environ.get('CHAIN_HEAD_TTL', 2))
+# Seconds the monitor's published head stays valid if the monitor stops
+LATEST_BLOCK_TTL = int(os.environ.get('LATEST_BLOCK_TTL', 60))
+# Upper bound on how long a balance read at the current head is kept
+BALANCE_CACHE_TTL = int(os.environ.get('BALANCE_CACHE_TTL', 30))
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
@@ -135,6 +362,11 @@ SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'your-secret-key-here')
 # Update debug mode
 DEBUG = bool(int(os.environ.get('DEBUG', 1)))
 
+# Per-process memory caches cannot invalidate balances or share the chain
+# head across workers, so production refuses to start without Redis
+if not DEBUG and not os.environ.get('REDIS_URL'):
+    raise ImproperlyConfigured('Set REDIS_URL when DEBUG is off')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -151,3 +383,26 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Update media files configuration
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Background workers log through the 'banking' loggers to stderr
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+        },
+    },
+    'loggers': {
+        'banking': {
+            'handlers': ['console'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -0,0 +1,246 @@
+"""
+Async versions of the RPC-heavy banking views
+
+They are routed instead of the sync views when ``ASYNC_VIEWS`` is enabled and
+the project is served through ``auth_project.asgi`` by uvicorn workers, so a
+worker keeps serving other requests while it waits on the node.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import Http404
+from django.shortcuts import render, redirect
+
+from .db_router import primary_reads, replica_reads
+from .forms import TransactionForm
+from .models import Transaction, MultiSigTransaction, Wallet, PortfolioSnapshot
+from .utils.price_feed import get_price_feed
+from .utils.snapshot_utils import SnapshotService
+from .utils.web3_utils import get_async_web3_client, get_web3_client
+
+
+async def aget_eth_price():
+    return await get_price_feed().aget_price()
+
+
+async def arender(request, template_name, context=None):
+    """
+    render() on a worker thread instead of the one sync thread every request shares
+
+    The user and the session are loaded here first, so the context
+    processors make no queries and rendering is safe on any thread.
+    """
+    if hasattr(request, 'auser'):
+        request.user = await request.auser()
+    return await sync_to_async(render, thread_sensitive=False)(request, template_name, context)
+
+
+@login_required
+@replica_reads
+async def wallet_dashboard(request):
+    try:
+        user = await request.auser()
+        # Wallets, their balance snapshots and the portfolio totals in one query
+        user_wallets = Wallet.objects.filter(user=user).select_related(
+            'balance_snapshot', 'user__portfolio_snapshot'
+        )
+        # Only the primary can tell that the user has no wallet yet, a
+        # lagging replica would have us create a second one
+        wallets = [wallet async for wallet in user_wallets]
+        if not wallets:
+            with primary_reads():
+                wallets = [wallet async for wallet in user_wallets.all()]
+        has_snapshots = bool(wallets)
+
+        # Initialize wallet if user has none
+        if not wallets:
+            try:
+                wallet = await sync_to_async(get_web3_client().create_wallet)(user)
+                messages.success(request, f"Created new wallet: {wallet.address}")
+                wallets = [wallet]
+            except Exception as e:
+                messages.error(request, f"Error creating wallet: {str(e)}")
+                return await arender(request, 'banking/dashboard.html', {'error': str(e)})
+
+        # Balances come from the snapshots, only wallets without one are read
+        # live, while the price is fetched
+        has_snapshots = has_snapshots and all(hasattr(wallet, 'balance_snapshot') for wallet in wallets)
+        eth_price, snapshots = await asyncio.gather(
+            aget_eth_price(),
+            SnapshotService(get_async_web3_client()).asnapshots_for(wallets),
+        )
+        wallet_balances = []
+        for wallet in wallets:
+            snapshot = snapshots.get(wallet.id)
+            if snapshot is not None:
+                wallet_balances.append({
+                    'wallet': wallet,
+                    'balance': snapshot.balance,
+                    'balance_formatted': f"{snapshot.balance:.4f}",
+                    'fiat_value': snapshot.fiat_value,
+                    'block_number': snapshot.block_number,
+                    'updated_at': snapshot.updated_at
+                })
+            else:
+                messages.warning(request, f"Could not fetch balance for wallet {wallet.address}")
+                wallet_balances.append({
+                    'wallet': wallet,
+                    'balance': 0,
+                    'balance_formatted': "0.0000",
+                    'error': "Balance not available yet"
+                })
+
+        if has_snapshots:
+            portfolio = getattr(wallets[0].user, 'portfolio_snapshot', None)
+        else:
+            # The totals changed when the missing snapshots were taken
+            portfolio = await PortfolioSnapshot.objects.filter(user=user).afirst()
+        addresses = [wallet.address for wallet in wallets]
+
+        recent_transactions = [
+            tx async for tx in Transaction.objects.filter(
+                Q(from_wallet__in=wallets) |
+                Q(to_address__in=addresses)
+            ).order_by('-created_at')[:5]
+        ]
+
+        context = {
+            'wallet_balances': wallet_balances,
+            'recent_transactions': recent_transactions,
+            'eth_price': eth_price,
+            'portfolio': portfolio
+        }
+        return await arender(request, 'banking/dashboard.html', context)
+
+    except Exception as e:
+        messages.error(request, f"Error loading dashboard: {str(e)}")
+        return await arender(request, 'banking/dashboard.html', {'error': str(e)})
+
+
+@login_required
+async def send_transaction(request):
+    try:
+        user = await request.auser()
+        web3_client = get_async_web3_client()
+
+        if request.method == 'POST':
+            form = TransactionForm(request.POST)
+            if form.is_valid():
+                try:
+                    from_wallet = await Wallet.objects.aget(
+                        user=user,
+                        address=request.POST.get('from_wallet')
+                    )
+                except Wallet.DoesNotExist:
+                    raise Http404("Wallet not found")
+
+                # Check wallet balance
+                balance = (await web3_client.get_balances([from_wallet.address]))[from_wallet.address]
+                if balance['error'] is not None:
+                    raise ValueError(balance['error'])
+                if balance['balance'] < form.cleaned_data['amount']:
+                    messages.error(request, "Insufficient balance")
+                    return redirect('banking:send_transaction')
+
+                # Signing and broadcasting stay on the sync client so the
+                # send path has a single implementation; it is thread-safe,
+                # so it doesn't have to queue for the shared sync thread
+                try:
+                    tx = await sync_to_async(get_web3_client().send_transaction, thread_sensitive=False)(
+                        from_wallet,
+                        form.cleaned_data['to_address'],
+                        form.cleaned_data['amount']
+                    )
+                    messages.success(request, f"Transaction sent: {tx.tx_hash}")
+                    return redirect('banking:transaction_detail', tx_hash=tx.tx_hash)
+                except Exception as e:
+                    messages.error(request, f"Transaction failed: {str(e)}")
+        else:
+            form = TransactionForm()
+
+        wallets = [wallet async for wallet in Wallet.objects.filter(user=user)]
+        balances = await web3_client.get_balances([wallet.address for wallet in wallets])
+
+        wallet_balances = []
+        for wallet in wallets:
+            result = balances[wallet.address]
+            if result['error'] is None:
+                wallet_balances.append({
+                    'address': wallet.address,
+                    'balance': f"{result['balance']:.6f}"
+                })
+            else:
+                wallet_balances.append({
+                    'address': wallet.address,
+                    'balance': "Error fetching balance"
+                })
+
+        context = {
+            'form': form,
+            'wallets': wallet_balances
+        }
+        return await arender(request, 'banking/send_transaction.html', context)
+
+    except Http404:
+        raise
+    except Exception as e:
+        messages.error(request, f"Error: {str(e)}")
+        return redirect('banking:wallet_dashboard')
+
+
+@login_required
+@replica_reads
+async def transaction_detail(request, tx_hash):
+    """
+    Display detailed information about a specific transaction
+    """
+    user = await request.auser()
+
+    try:
+        transaction = await Transaction.objects.filter(
+            Q(from_wallet__user=user) |
+            Q(to_address__in=Wallet.objects.filter(user=user).values('address'))
+        ).aget(tx_hash=tx_hash)
+    except Transaction.DoesNotExist:
+        raise Http404("Transaction not found")
+
+    # Check if this is a multisig transaction
+    reference = await MultiSigTransaction.objects.filter(
+        transaction=transaction
+    ).values_list('reference', flat=True).afirst()
+    if reference is not None:
+        return redirect('banking:multisig_detail', reference=reference)
+
+    # Settled transactions render from the database, only the ones the
+    # monitor hasn't settled yet ask the node for their receipt
+    web3_client = get_async_web3_client()
+
+    async def settle():
+        # The block is only known once the receipt is in
+        receipt = await web3_client.get_transaction_receipt(tx_hash)
+        block_info = await web3_client.get_block(receipt['blockNumber'])
+        transaction.apply_receipt(receipt, block_info['timestamp'])
+        await transaction.asave(update_fields=[
+            'status', 'gas_used', 'block_number', 'block_timestamp', 'updated_at'
+        ])
+
+    try:
+        if transaction.block_number is None:
+            _, block_number = await asyncio.gather(settle(), web3_client.get_latest_block_number())
+        else:
+            block_number = await web3_client.get_latest_block_number()
+        context = {
+            'transaction': transaction,
+            'receipt': transaction.receipt_summary(block_number)
+        }
+    except Exception as e:
+        context = {
+            'transaction': transaction,
+            'error': str(e)
+        }
+
+    return await arender(request, 'banking/transaction_detail.html', context)
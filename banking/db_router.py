@@ -0,0 +1,157 @@
+"""
+Read-replica routing for the read-heavy banking pages
+
+Views wrapped in ``replica_reads`` send their ORM reads to one replica, picked
+at random per request so every query of a page sees the same snapshot, and
+a streamed response keeps reading from it while its body is produced.
+Everything else, background workers included, reads from the primary, as do
+blocks wrapped in ``primary_reads()``. Writes always go to the primary, and a request that writes
+reads from the primary from then on. After any POST the ``ReplicaPinMiddleware``
+sets a short-lived cookie that keeps that browser on the primary for
+``REPLICA_PIN_SECONDS``, so users see their own writes despite replica lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = 'replica_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Replica alias the current request reads from, None for the primary
+_replica = ContextVar('banking_replica', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+class ReplicaRouter:
+    # Sessions, permissions and content types always come from the primary
+    replica_apps = {'banking', 'accounts'}
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias and model._meta.app_label in self.replica_apps:
+            return alias
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request
+        _replica.set(None)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def _pick_replica(request):
+    replicas = replica_aliases()
+    if (
+        replicas
+        and settings.READ_REPLICAS_ENABLED
+        and request.method in SAFE_METHODS
+        and PIN_COOKIE not in request.COOKIES
+    ):
+        return random.choice(replicas)
+    return None
+
+
+def _stream_from(alias, content):
+    # Each chunk is produced on the request's replica, whichever thread asks for it
+    content = iter(content)
+    while True:
+        token = _replica.set(alias)
+        try:
+            chunk = next(content)
+        except StopIteration:
+            return
+        finally:
+            _replica.reset(token)
+        yield chunk
+
+
+async def _astream_from(alias, content):
+    content = aiter(content)
+    while True:
+        token = _replica.set(alias)
+        try:
+            chunk = await anext(content)
+        except StopAsyncIteration:
+            return
+        finally:
+            _replica.reset(token)
+        yield chunk
+
+
+def _keep_replica(response, alias):
+    if alias and response.streaming:
+        if response.is_async:
+            response.streaming_content = _astream_from(alias, response.streaming_content)
+        else:
+            response.streaming_content = _stream_from(alias, response.streaming_content)
+    return response
+
+
+def replica_reads(view_func):
+    """
+    Serve the view's reads from a replica unless the browser is pinned to the primary
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            token = _replica.set(_pick_replica(request))
+            try:
+                response = await view_func(request, *args, **kwargs)
+                # Still the replica, unless the view wrote
+                alias = _replica.get()
+            finally:
+                _replica.reset(token)
+            return _keep_replica(response, alias)
+    else:
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            token = _replica.set(_pick_replica(request))
+            try:
+                response = view_func(request, *args, **kwargs)
+                # Still the replica, unless the view wrote
+                alias = _replica.get()
+            finally:
+                _replica.reset(token)
+            return _keep_replica(response, alias)
+    return _wrapped_view
+
+
+@contextmanager
+def primary_reads():
+    """
+    Read from the primary inside the block, for checks that decide on a write
+    """
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """
+    Pin a browser to the primary for REPLICA_PIN_SECONDS after it writes
+    """
+    def process_response(self, request, response):
+        if settings.READ_REPLICAS_ENABLED and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
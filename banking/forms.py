@@ -1,6 +1,10 @@
 from django import forms
+from django.conf import settings
 from web3 import Web3
 from decimal import Decimal
+import csv
+import io
+import json
 
 class TransactionForm(forms.Form):
     to_address = forms.CharField(
@@ -36,4 +40,91 @@ class TransactionForm(forms.Form):
     def clean(self):
         cleaned_data = super().clean()
         # Add any cross-field validation here if needed
+        return cleaned_data
+
+class BulkPayoutForm(forms.Form):
+    """
+    A payout list as a CSV/JSON upload or pasted text
+
+    CSV needs a ``from_wallet,to_address,amount`` header; JSON is a list of
+    objects with the same keys.
+    """
+    payout_file = forms.FileField(
+        required=False,
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.csv,.json'
+        })
+    )
+    payout_data = forms.CharField(
+        required=False,
+        widget=forms.Textarea(attrs={
+            'class': 'form-control',
+            'rows': 8,
+            'placeholder': 'from_wallet,to_address,amount'
+        })
+    )
+    job_id = forms.CharField(widget=forms.HiddenInput())
+
+    def _parse(self, text, name):
+        text = text.strip()
+        if name.endswith('.json') or text.startswith('['):
+            try:
+                rows = json.loads(text)
+            except ValueError as e:
+                raise forms.ValidationError(f"Invalid JSON: {e}")
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise forms.ValidationError("JSON payouts must be a list of objects")
+            return rows
+
+        reader = csv.DictReader(io.StringIO(text))
+        missing = {'from_wallet', 'to_address', 'amount'} - set(reader.fieldnames or [])
+        if missing:
+            raise forms.ValidationError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+        return [
+            {key: (value or '').strip() for key, value in row.items() if key}
+            for row in reader
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('payout_file')
+        if upload:
+            try:
+                text = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                raise forms.ValidationError("Payout file must be UTF-8 text")
+            rows = self._parse(text, upload.name.lower())
+        elif cleaned_data.get('payout_data'):
+            rows = self._parse(cleaned_data['payout_data'], '')
+        else:
+            raise forms.ValidationError("Upload a payout file or paste the payout list")
+
+        if not rows:
+            raise forms.ValidationError("The payout list is empty")
+        if len(rows) > settings.PAYOUT_MAX_ROWS:
+            raise forms.ValidationError(f"At most {settings.PAYOUT_MAX_ROWS} payouts per upload")
+        cleaned_data['rows'] = rows
+        return cleaned_data
+
+class TransactionExportForm(forms.Form):
+    """
+    Filters of a transaction history export, all optional
+    """
+    FORMAT_CHOICES = [('csv', 'CSV'), ('jsonl', 'JSON Lines')]
+
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    wallet = forms.CharField(max_length=42, required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+
+    def clean_format(self):
+        return self.cleaned_data['format'] or 'csv'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError("start_date must not be after end_date")
         return cleaned_data
\ No newline at end of file
@@ -0,0 +1,37 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class IntervalCommand(BaseCommand):
+    """
+    A command that runs ``sweep()`` once, or every ``--interval`` seconds
+
+    ``sweep()`` returns how much work it did and the line to report. In the
+    loop an idle sweep reports nothing, and a failed sweep is logged under
+    the command's module and retried at the next interval.
+    """
+    interval_help = 'Keep running, waiting this many seconds between sweeps'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help=self.interval_help)
+
+    def sweep(self, options):
+        raise NotImplementedError('subclasses of IntervalCommand must provide a sweep() method')
+
+    def handle(self, *args, **options):
+        if not options['interval']:
+            done, message = self.sweep(options)
+            self.stdout.write(message)
+            return
+
+        logger = logging.getLogger(self.__module__)
+        while True:
+            try:
+                done, message = self.sweep(options)
+                if done:
+                    self.stdout.write(message)
+            except Exception:
+                logger.exception('Sweep failed, retrying in %ss', options['interval'])
+            time.sleep(options['interval'])
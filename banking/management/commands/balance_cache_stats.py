@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from banking.utils.balance_cache import balance_cache
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counters of the wallet balance cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        stats = balance_cache.stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} hit_ratio={stats['hit_ratio']:.2%}"
+        )
+        if options['reset']:
+            balance_cache.reset_stats()
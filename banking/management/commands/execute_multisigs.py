@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from banking.tasks import MultiSigExecutor
+
+
+class Command(BaseCommand):
+    help = 'Sign and broadcast approved multisig transactions from the execution queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the due queue once, report the throughput and exit'
+        )
+
+    def handle(self, *args, **options):
+        executor = MultiSigExecutor()
+        if not options['once']:
+            self.stdout.write('Executing approved multisig transactions')
+            executor.run()
+            return
+
+        started = time.monotonic()
+        broadcast = executor.tick()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Broadcast {broadcast} multisig transaction(s) in {elapsed:.2f}s "
+            f"({broadcast / elapsed if elapsed else 0:.0f}/s)"
+        )
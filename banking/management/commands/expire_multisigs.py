@@ -0,0 +1,20 @@
+from django.conf import settings
+
+from banking.management.base import IntervalCommand
+from banking.utils.multisig_utils import expire_multisigs
+
+
+class Command(IntervalCommand):
+    help = 'Expire open multi-signature transactions that are past their expiry'
+    interval_help = 'Keep sweeping, waiting this many seconds between sweeps'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--purge-signatures', action='store_true',
+            help='Delete the signatures of the multisigs that expire'
+        )
+
+    def sweep(self, options):
+        expired = expire_multisigs(settings.MULTISIG_SWEEP_BATCH_SIZE, options['purge_signatures'])
+        return expired, f"Expired {expired} multisig transaction(s)"
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from banking.models import IndexerCheckpoint
+from banking.tasks import IncomingTransferIndexer
+
+
+class Command(BaseCommand):
+    help = 'Record transfers into owned wallets from new blocks, resuming from the last checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from-block', type=int,
+            help='Reset the checkpoint so indexing starts after this block'
+        )
+
+    def handle(self, *args, **options):
+        indexer = IncomingTransferIndexer()
+        if options['from_block'] is not None:
+            IndexerCheckpoint.objects.update_or_create(
+                name=indexer.CHECKPOINT,
+                defaults={'block_number': options['from_block']}
+            )
+        self.stdout.write('Indexing incoming transfers')
+        indexer.run()
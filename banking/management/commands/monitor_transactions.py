@@ -0,0 +1,53 @@
+import multiprocessing
+import signal
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from banking.tasks import ReceiptMonitor
+
+
+def _run_worker():
+    # SIGTERM unwinds run() so the worker releases its leases on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    ReceiptMonitor().run()
+
+
+class Command(BaseCommand):
+    help = 'Settle pending transactions from new blocks, optionally as several leasing workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of worker processes; more can be started on other hosts'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers <= 1:
+            self.stdout.write('Monitoring transactions with 1 worker')
+            _run_worker()
+            return
+
+        # Children must open their own database connections
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_run_worker, name=f"monitor-{index}")
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Monitoring transactions with {workers} workers")
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
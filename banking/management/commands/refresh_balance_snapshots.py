@@ -0,0 +1,17 @@
+import time
+
+from django.conf import settings
+
+from banking.management.base import IntervalCommand
+from banking.utils.snapshot_utils import SnapshotService
+from banking.utils.web3_utils import get_web3_client
+
+
+class Command(IntervalCommand):
+    help = 'Refresh the balance and portfolio snapshots of every wallet'
+    interval_help = 'Keep refreshing, waiting this many seconds between sweeps'
+
+    def sweep(self, options):
+        started = time.monotonic()
+        SnapshotService(get_web3_client()).refresh_all(settings.SNAPSHOT_BATCH_SIZE)
+        return True, f"Refreshed balance snapshots in {time.monotonic() - started:.1f}s"
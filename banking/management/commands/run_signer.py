@@ -0,0 +1,39 @@
+import signal
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.utils.signer_service import KeyCache, SigningServer
+
+
+class Command(BaseCommand):
+    help = 'Run the local signing daemon that holds decrypted wallet keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--socket',
+            help='Unix socket path to listen on, defaults to SIGNER_SOCKET'
+        )
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or settings.SIGNER_SOCKET
+        if not socket_path:
+            raise CommandError('Set SIGNER_SOCKET or pass --socket')
+
+        keys = KeyCache(
+            settings.ENCRYPTION_KEY,
+            max_size=settings.SIGNER_KEY_CACHE_SIZE,
+            ttl=settings.SIGNER_KEY_TTL
+        )
+        server = SigningServer(socket_path, keys)
+        # SIGTERM unwinds serve_forever so the keys are wiped on the way out
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        self.stdout.write(f"Signing on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Wipes every cached key
+            server.server_close()
@@ -0,0 +1,41 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from banking.db_router import replica_aliases
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary into the SQLite replica files, for trying read replicas locally'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Keep copying, waiting this many seconds between copies to mimic replication lag'
+        )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        replicas = [settings.DATABASES[alias]['NAME'] for alias in replica_aliases()]
+        if 'sqlite3' not in primary['ENGINE']:
+            raise CommandError('Only SQLite databases can be synced by this command')
+        if not replicas:
+            raise CommandError('No replicas configured, set READ_REPLICAS_ENABLED=1 and SQLITE_REPLICA_PATHS')
+
+        while True:
+            source = sqlite3.connect(primary['NAME'])
+            try:
+                for path in replicas:
+                    target = sqlite3.connect(path)
+                    try:
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write(f"Synced {len(replicas)} replica(s)")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
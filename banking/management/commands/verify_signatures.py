@@ -0,0 +1,19 @@
+import time
+
+from django.conf import settings
+
+from banking.management.base import IntervalCommand
+from banking.utils.multisig_utils import verify_pending_signatures
+
+
+class Command(IntervalCommand):
+    help = 'Recover and store the signer of every multisig signature not verified yet'
+    interval_help = 'Keep verifying, waiting this many seconds between passes'
+
+    def sweep(self, options):
+        started = time.monotonic()
+        verified, invalid = verify_pending_signatures(settings.SIGNATURE_VERIFY_BATCH_SIZE)
+        return verified or invalid, (
+            f"Verified {verified} signature(s), {invalid} invalid, "
+            f"in {time.monotonic() - started:.1f}s"
+        )
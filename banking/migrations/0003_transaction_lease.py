@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0002_wallet_nonce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='banking_tra_status_e176d2_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_from_address(apps, schema_editor):
+    Transaction = apps.get_model('banking', 'Transaction')
+    Wallet = apps.get_model('banking', 'Wallet')
+    Transaction.objects.update(
+        from_address=Subquery(
+            Wallet.objects.filter(pk=OuterRef('from_wallet_id')).values('address')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0003_transaction_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('block_number', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='from_address',
+            field=models.CharField(default='', max_length=42),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_from_address, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='from_wallet',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sent_transactions', to='banking.wallet'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0004_incoming_transfers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='block_number',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='block_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0005_transaction_block'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['from_wallet', 'created_at', 'id'], name='banking_tra_from_wa_a620e6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['to_address', 'created_at', 'id'], name='banking_tra_to_addr_698bd8_idx'),
+        ),
+    ]
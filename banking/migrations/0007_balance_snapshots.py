@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0006_history_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_balance', models.DecimalField(decimal_places=18, max_digits=24)),
+                ('total_fiat_value', models.DecimalField(blank=True, decimal_places=2, max_digits=24, null=True)),
+                ('wallet_count', models.IntegerField()),
+                ('updated_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='portfolio_snapshot', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WalletBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=18, max_digits=24)),
+                ('block_number', models.BigIntegerField()),
+                ('fiat_value', models.DecimalField(blank=True, decimal_places=2, max_digits=24, null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('wallet', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshot', to='banking.wallet')),
+            ],
+        ),
+    ]
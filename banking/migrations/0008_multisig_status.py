@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:41
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_approved(apps, schema_editor):
+    # Expired rows are left open for the sweeper to expire in batches
+    MultiSigTransaction = apps.get_model('banking', 'MultiSigTransaction')
+    MultiSigTransaction.objects.filter(
+        current_signatures__gte=F('required_signatures')
+    ).update(status='approved')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0007_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multisigtransaction',
+            name='status',
+            field=models.CharField(choices=[('open', 'Open'), ('approved', 'Approved'), ('expired', 'Expired')], default='open', max_length=10),
+        ),
+        migrations.RunPython(mark_approved, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='multisigtransaction',
+            index=models.Index(condition=models.Q(('status', 'open')), fields=['expires_at'], name='multisig_open_expires_idx'),
+        ),
+    ]
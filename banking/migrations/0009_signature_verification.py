@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0008_multisig_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionsignature',
+            name='recovered_address',
+            field=models.CharField(blank=True, max_length=42, null=True),
+        ),
+        migrations.AddField(
+            model_name='transactionsignature',
+            name='verified',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transactionsignature',
+            index=models.Index(condition=models.Q(('verified__isnull', True)), fields=['id'], name='signature_unverified_idx'),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+import banking.models
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def fill_reference(apps, schema_editor):
+    # Existing signatures were made over the transaction hash, so it becomes the reference
+    MultiSigTransaction = apps.get_model('banking', 'MultiSigTransaction')
+    Transaction = apps.get_model('banking', 'Transaction')
+    MultiSigTransaction.objects.update(
+        reference=Subquery(
+            Transaction.objects.filter(pk=OuterRef('transaction_id')).values('tx_hash')[:1]
+        )
+    )
+
+
+def mark_broadcast(apps, schema_editor):
+    # Multisigs created before the queue were signed and sent up front, record
+    # them as executed so the executor never sends them a second time
+    MultiSigExecution = apps.get_model('banking', 'MultiSigExecution')
+    MultiSigTransaction = apps.get_model('banking', 'MultiSigTransaction')
+    now = timezone.now()
+    MultiSigExecution.objects.bulk_create(
+        [
+            MultiSigExecution(
+                multisig_id=multisig_id,
+                status='broadcast',
+                next_attempt_at=now
+            )
+            for multisig_id in MultiSigTransaction.objects.filter(
+                transaction__tx_hash__isnull=False
+            ).values_list('id', flat=True).iterator()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0009_signature_verification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multisigtransaction',
+            name='reference',
+            field=models.CharField(max_length=66, null=True),
+        ),
+        migrations.RunPython(fill_reference, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='multisigtransaction',
+            name='reference',
+            field=models.CharField(default=banking.models.multisig_reference, max_length=66, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='gas_price',
+            field=models.DecimalField(blank=True, decimal_places=18, max_digits=24, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='nonce',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='tx_hash',
+            field=models.CharField(blank=True, max_length=66, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='MultiSigExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('broadcast', 'Broadcast'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField()),
+                ('raw_transaction', models.TextField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('multisig', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='execution', to='banking.multisigtransaction')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'queued')), fields=['next_attempt_at'], name='multisig_execution_due_idx')],
+            },
+        ),
+        migrations.RunPython(mark_broadcast, migrations.RunPython.noop),
+    ]
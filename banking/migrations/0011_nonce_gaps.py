@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0010_multisig_execution_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='walletnonce',
+            name='allocated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='walletnonce',
+            name='in_flight',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='walletnonce',
+            name='released',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banking', '0011_nonce_gaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multisigtransaction',
+            name='designated_signers',
+            field=models.ManyToManyField(blank=True, related_name='designated_multisigs', to='banking.wallet'),
+        ),
+    ]
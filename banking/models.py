@@ -1,6 +1,7 @@
 from django.db import models
 from django.conf import settings
 from eth_account.account import Account
+from datetime import datetime, timezone as dt_timezone
 import secrets
 
 class Wallet(models.Model):
@@ -15,46 +16,208 @@ class Wallet(models.Model):
             models.Index(fields=['user', 'is_primary']),
         ]
 
+class WalletNonce(models.Model):
+    """
+    Next nonce to hand out for a wallet, so concurrent sends never reuse one
+    """
+    wallet = models.OneToOneField(Wallet, on_delete=models.CASCADE, related_name='nonce_counter')
+    next_nonce = models.IntegerField()
+    # Allocations not reported sent or released yet, and when the last one was made
+    in_flight = models.IntegerField(default=0)
+    allocated_at = models.DateTimeField(null=True, blank=True)
+    # Nonces given back below next_nonce, handed out again before new ones
+    released = models.JSONField(default=list, blank=True)
+    synced_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+class WalletBalanceSnapshot(models.Model):
+    """
+    Last known balance of a wallet, so the dashboard doesn't read it from the node
+    """
+    wallet = models.OneToOneField(Wallet, on_delete=models.CASCADE, related_name='balance_snapshot')
+    balance = models.DecimalField(max_digits=24, decimal_places=18)
+    block_number = models.BigIntegerField()
+    fiat_value = models.DecimalField(max_digits=24, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField()
+
+class PortfolioSnapshot(models.Model):
+    """
+    Totals of a user's wallet snapshots; updated_at is that of the oldest one
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='portfolio_snapshot'
+    )
+    total_balance = models.DecimalField(max_digits=24, decimal_places=18)
+    total_fiat_value = models.DecimalField(max_digits=24, decimal_places=2, null=True, blank=True)
+    wallet_count = models.IntegerField()
+    updated_at = models.DateTimeField()
+
 class Transaction(models.Model):
+    QUEUED = 'queued'
     PENDING = 'pending'
     COMPLETED = 'completed'
     FAILED = 'failed'
     
     STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
         (PENDING, 'Pending'),
         (COMPLETED, 'Completed'),
         (FAILED, 'Failed'),
     ]
     
-    from_wallet = models.ForeignKey(Wallet, on_delete=models.PROTECT, related_name='sent_transactions')
+    # Empty for incoming transfers sent from addresses we don't hold keys for
+    from_wallet = models.ForeignKey(
+        Wallet, on_delete=models.PROTECT, related_name='sent_transactions', null=True, blank=True
+    )
+    from_address = models.CharField(max_length=42)
     to_address = models.CharField(max_length=42)
     amount = models.DecimalField(max_digits=24, decimal_places=18)
-    gas_price = models.DecimalField(max_digits=24, decimal_places=18)
+    # Gas price, hash and nonce stay empty while a multisig transfer is
+    # queued, until the executor signs it
+    gas_price = models.DecimalField(max_digits=24, decimal_places=18, null=True, blank=True)
     gas_used = models.DecimalField(max_digits=24, decimal_places=18, null=True)
-    tx_hash = models.CharField(max_length=66, unique=True)
+    tx_hash = models.CharField(max_length=66, unique=True, null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    nonce = models.IntegerField()
+    nonce = models.IntegerField(null=True, blank=True)
+    # Filled in from the receipt once the transaction is mined
+    block_number = models.BigIntegerField(null=True, blank=True)
+    block_timestamp = models.DateTimeField(null=True, blank=True)
+    # Monitor worker currently watching this row, and when its lease runs out
+    lease_owner = models.CharField(max_length=64, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         indexes = [
             models.Index(fields=['from_wallet', 'status']),
             models.Index(fields=['tx_hash']),
+            models.Index(fields=['status', 'lease_expires_at']),
+            # Keyset pagination of the sent and received sides of the history
+            models.Index(fields=['from_wallet', 'created_at', 'id']),
+            models.Index(fields=['to_address', 'created_at', 'id']),
         ]
+    
+    def apply_receipt(self, receipt, block_timestamp):
+        """
+        Copy the outcome of a mined transaction onto the row, without saving
+        """
+        self.status = self.COMPLETED if receipt['status'] == 1 else self.FAILED
+        self.gas_used = receipt['gasUsed']
+        self.block_number = receipt['blockNumber']
+        self.block_timestamp = datetime.fromtimestamp(block_timestamp, tz=dt_timezone.utc)
+    
+    def receipt_summary(self, head_block_number):
+        """
+        Stored receipt details as shown on the transaction page
+        """
+        return {
+            'block_number': self.block_number,
+            'gas_used': self.gas_used,
+            'status': 'Success' if self.status == self.COMPLETED else 'Failed',
+            'timestamp': self.block_timestamp,
+            'confirmations': head_block_number - self.block_number
+        }
+
+class IndexerCheckpoint(models.Model):
+    """
+    Last block a chain indexer has fully processed, so it resumes where it stopped
+    """
+    name = models.CharField(max_length=64, unique=True)
+    block_number = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+def multisig_reference():
+    return '0x' + secrets.token_hex(32)
 
 class MultiSigTransaction(models.Model):
+    OPEN = 'open'
+    APPROVED = 'approved'
+    EXPIRED = 'expired'
+    
+    STATUS_CHOICES = [
+        (OPEN, 'Open'),
+        (APPROVED, 'Approved'),
+        (EXPIRED, 'Expired'),
+    ]
+    
     transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE)
+    # What signers sign and the pages link to, since the transfer has no
+    # hash until it is executed
+    reference = models.CharField(max_length=66, unique=True, default=multisig_reference)
     required_signatures = models.IntegerField(default=2)
     current_signatures = models.IntegerField(default=0)
     signers = models.ManyToManyField(Wallet, through='TransactionSignature')
+    # Other users' wallets asked to approve; only they and the owner see and sign it
+    designated_signers = models.ManyToManyField(Wallet, blank=True, related_name='designated_multisigs')
     expires_at = models.DateTimeField()
+    # Approved once the last signature lands, expired by the sweeper
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN)
+    
+    class Meta:
+        indexes = [
+            # Only multisigs still collecting signatures, for the signing
+            # inbox and the expiry sweeper
+            models.Index(
+                fields=['expires_at'],
+                name='multisig_open_expires_idx',
+                condition=models.Q(status='open'),
+            ),
+        ]
+
+class MultiSigExecution(models.Model):
+    """
+    Queue entry for an approved multisig transfer waiting to be signed and broadcast
+    """
+    QUEUED = 'queued'
+    BROADCAST = 'broadcast'
+    FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (BROADCAST, 'Broadcast'),
+        (FAILED, 'Failed'),
+    ]
+    
+    multisig = models.OneToOneField(
+        MultiSigTransaction, on_delete=models.CASCADE, related_name='execution'
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    # Due time of the next attempt, pushed out while an executor works on the row
+    next_attempt_at = models.DateTimeField()
+    # Kept once signed so a retry rebroadcasts the same nonce instead of signing twice
+    raw_transaction = models.TextField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                name='multisig_execution_due_idx',
+                condition=models.Q(status='queued'),
+            ),
+        ]
 
 class TransactionSignature(models.Model):
     multi_sig_transaction = models.ForeignKey(MultiSigTransaction, on_delete=models.CASCADE)
     signer = models.ForeignKey(Wallet, on_delete=models.CASCADE)
     signature = models.TextField()
     signed_at = models.DateTimeField(auto_now_add=True)
+    # Address recovered from the signature, and whether it matches the signer;
+    # null until the verifier has checked it
+    recovered_address = models.CharField(max_length=42, null=True, blank=True)
+    verified = models.BooleanField(null=True)
     
     class Meta:
-        unique_together = ['multi_sig_transaction', 'signer']
\ No newline at end of file
+        unique_together = ['multi_sig_transaction', 'signer']
+        indexes = [
+            # Signatures still waiting for the verifier
+            models.Index(
+                fields=['id'],
+                name='signature_unverified_idx',
+                condition=models.Q(verified__isnull=True),
+            ),
+        ]
\ No newline at end of file
@@ -1,27 +1,575 @@
 # banking/tasks.py
+import logging
+from collections import defaultdict
+from datetime import timedelta
 from django.conf import settings
-from .models import Transaction
-from .utils.web3_utils import Web3Client
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from web3 import Web3
+from .models import (
+    IndexerCheckpoint, MultiSigExecution, Transaction, TransactionSignature, Wallet
+)
+from .utils.web3_utils import Web3Client, get_web3_client
+from .utils.balance_cache import balance_cache
+from .utils.multisig_utils import verify_signatures
+from .utils.nonce_utils import NonceManager, is_nonce_too_low
+from .utils.snapshot_utils import SnapshotService
+import os
+import socket
 import time
+import uuid
 
-def monitor_transactions():
-    web3_client = Web3Client()
-    
-    while True:
-        pending_txs = Transaction.objects.filter(status=Transaction.PENDING)
-        
-        for tx in pending_txs:
+logger = logging.getLogger(__name__)
+
+
+def refresh_snapshots(snapshots, addresses, block_number):
+    # A failed refresh must not undo the settling, the refresher catches up
+    try:
+        snapshots.refresh_addresses(addresses, block_number)
+    except Exception as e:
+        logger.warning("Error refreshing balance snapshots: %s", e)
+
+
+class ReceiptMonitor:
+    """
+    Settle pending transactions by following new block heads
+
+    Several monitors can run side by side. Each one leases batches of
+    pending rows with SELECT ... FOR UPDATE SKIP LOCKED and keeps only its
+    own leased hashes in an in-memory index. Each new block's transaction
+    hashes are fetched once and matched against that index, and only the
+    matches get their receipts fetched, in one batch request. Settled rows
+    keep their block number, block time, gas used and status, and the head
+    the monitor has reached is published once per block, so transaction
+    pages render without asking the node.
+
+    Leases are renewed every ``lease_ttl / 3`` seconds as the worker's
+    heartbeat. Rows whose lease ran out, because their worker died or
+    stalled, are leased again by whichever worker asks next. Newly leased
+    rows are checked once directly, since they may already be in a block
+    that was processed before they were leased.
+    """
+    def __init__(self, web3_client=None, poll_interval=None, batch_size=None,
+                 lease_ttl=None, lease_batch_size=None, max_leased=None):
+        self.web3_client = web3_client or get_web3_client()
+        self.poll_interval = poll_interval or settings.MONITOR_POLL_INTERVAL
+        self.batch_size = batch_size or settings.MONITOR_RECEIPT_BATCH_SIZE
+        self.lease_ttl = timedelta(seconds=lease_ttl or settings.MONITOR_LEASE_TTL)
+        self.lease_batch_size = lease_batch_size or settings.MONITOR_LEASE_BATCH_SIZE
+        self.max_leased = max_leased or settings.MONITOR_MAX_LEASED
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pending = {}
+        self.retry = []
+        self.last_block = None
+        self.last_heartbeat = None
+        self.block_timestamps = {}
+        self.snapshots = SnapshotService(self.web3_client)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    self.tick()
+                except Exception:
+                    logger.exception("Error monitoring transactions")
+                time.sleep(self.poll_interval)
+        finally:
+            self.release()
+
+    def tick(self):
+        if self.last_block is None:
+            # Start from the current head, the first index load checks
+            # everything that is already pending
+            self.last_block = self.web3_client.get_block_number()
+
+        self.heartbeat()
+
+        # Newly leased rows get one direct lookup, matches whose receipt
+        # lookup failed last time are tried again
+        new_hashes = self.lease_transactions()
+        retry, self.retry = self.retry, []
+        try:
+            self.retry.extend(self.settle(retry))
+            self.settle(new_hashes)
+        except Exception:
+            self.retry.extend(retry + new_hashes)
+            raise
+
+        head = self.web3_client.get_block_number()
+        while self.last_block < head:
+            block = self.web3_client.get_block(self.last_block + 1)
+            if block is None:
+                break
+            matches = [
+                tx_hash for tx_hash in map(Web3.to_hex, block['transactions'])
+                if tx_hash.lower() in self.pending
+            ]
+            self.block_timestamps[block['number']] = block['timestamp']
+            self.retry.extend(self.settle(matches))
+            self.last_block += 1
+
+        cache.set(Web3Client.LATEST_BLOCK_KEY, self.last_block, settings.LATEST_BLOCK_TTL)
+        for block_number in [n for n in self.block_timestamps if n < self.last_block - 64]:
+            del self.block_timestamps[block_number]
+
+    def lease_transactions(self):
+        """
+        Lease free or expired pending rows up to ``max_leased``, returning their hashes
+        """
+        wanted = min(self.lease_batch_size, self.max_leased - len(self.pending))
+        if wanted <= 0:
+            return []
+
+        now = timezone.now()
+        leasable = Q(status=Transaction.PENDING) & (
+            Q(lease_owner__isnull=True) | Q(lease_expires_at__lt=now)
+        )
+        with db_transaction.atomic():
+            ids = list(
+                Transaction.objects.select_for_update(skip_locked=True)
+                .filter(leasable)
+                .order_by('id')
+                .values_list('id', flat=True)[:wanted]
+            )
+            # Re-checking the condition keeps backends without row locks
+            # from handing the same row to two workers
+            Transaction.objects.filter(leasable, id__in=ids).update(
+                lease_owner=self.worker_id,
+                lease_expires_at=now + self.lease_ttl
+            )
+
+        new_hashes = []
+        leased = Transaction.objects.filter(
+            id__in=ids,
+            lease_owner=self.worker_id
+        )
+        for tx in leased:
+            self.pending[tx.tx_hash.lower()] = tx
+            new_hashes.append(tx.tx_hash)
+        return new_hashes
+
+    def heartbeat(self):
+        """
+        Extend this worker's leases and forget rows another worker took over
+        """
+        now = timezone.now()
+        if self.last_heartbeat and now - self.last_heartbeat < self.lease_ttl / 3:
+            return
+        owned = Transaction.objects.filter(
+            lease_owner=self.worker_id,
+            status=Transaction.PENDING
+        )
+        owned.update(lease_expires_at=now + self.lease_ttl)
+        self.last_heartbeat = now
+
+        if len(self.pending) != owned.count():
+            kept = {tx_hash.lower() for tx_hash in owned.values_list('tx_hash', flat=True)}
+            self.pending = {
+                tx_hash: tx for tx_hash, tx in self.pending.items() if tx_hash in kept
+            }
+            self.retry = [tx_hash for tx_hash in self.retry if tx_hash.lower() in kept]
+
+    def release(self):
+        """
+        Hand this worker's leases back so others pick them up right away
+        """
+        Transaction.objects.filter(
+            lease_owner=self.worker_id,
+            status=Transaction.PENDING
+        ).update(lease_owner=None, lease_expires_at=None)
+        self.pending = {}
+
+    def settle(self, tx_hashes):
+        """
+        Fetch receipts for ``tx_hashes`` in batches and store the outcomes,
+        returning the hashes that got no receipt
+        """
+        unresolved = []
+        for start in range(0, len(tx_hashes), self.batch_size):
+            receipts = self.web3_client.get_transaction_receipts(
+                tx_hashes[start:start + self.batch_size]
+            )
+            self.apply(receipts)
+            unresolved.extend(
+                tx_hash for tx_hash, receipt in receipts.items() if receipt is None
+            )
+        return unresolved
+
+    def block_timestamp(self, block_number):
+        timestamp = self.block_timestamps.get(block_number)
+        if timestamp is None:
+            block = self.web3_client.get_block(block_number)
+            timestamp = self.block_timestamps[block_number] = block['timestamp']
+        return timestamp
+
+    def apply(self, receipts):
+        receipts = {
+            tx_hash: receipt for tx_hash, receipt in receipts.items()
+            if receipt is not None and tx_hash.lower() in self.pending
+        }
+        # Look blocks up before touching the index so a failure loses nothing
+        block_times = {
+            receipt['blockNumber']: self.block_timestamp(receipt['blockNumber'])
+            for receipt in receipts.values()
+        }
+
+        settled = []
+        now = timezone.now()
+        for tx_hash, receipt in receipts.items():
+            tx = self.pending.pop(tx_hash.lower())
+            tx.apply_receipt(receipt, block_times[receipt['blockNumber']])
+            tx.lease_owner = None
+            tx.lease_expires_at = None
+            tx.updated_at = now
+            settled.append(tx)
+
+        if not settled:
+            return
+        Transaction.objects.bulk_update(
+            settled,
+            ['status', 'gas_used', 'block_number', 'block_timestamp',
+             'lease_owner', 'lease_expires_at', 'updated_at']
+        )
+        addresses = set()
+        for tx in settled:
+            addresses.update([tx.from_address, tx.to_address])
+        balance_cache.invalidate(*addresses)
+        # The cached head may be older than the blocks these settled in
+        refresh_snapshots(self.snapshots, addresses, max(tx.block_number for tx in settled))
+
+
+class IncomingTransferIndexer:
+    """
+    Record transfers into our wallets that were sent from anywhere
+
+    Every wallet address is held in an in-memory set, extended by id as
+    wallets are created. Each new block is fetched once with full
+    transactions and its recipients are matched against the set; matches
+    get their receipts in one batch request and are stored with a single
+    bulk insert. Blocks are processed ``confirmations`` behind the head,
+    and the last finished block is saved in the same database transaction
+    as the rows, so a restart resumes exactly where the indexer stopped.
+    """
+    CHECKPOINT = 'incoming-transfers'
+
+    def __init__(self, web3_client=None, poll_interval=None, blocks_per_pass=None,
+                 confirmations=None):
+        self.web3_client = web3_client or get_web3_client()
+        self.poll_interval = poll_interval or settings.MONITOR_POLL_INTERVAL
+        self.blocks_per_pass = blocks_per_pass or settings.INDEXER_BLOCKS_PER_PASS
+        self.confirmations = (
+            settings.INDEXER_CONFIRMATIONS if confirmations is None else confirmations
+        )
+        self.addresses = set()
+        self.last_wallet_id = 0
+        self.snapshots = SnapshotService(self.web3_client)
+
+    def run(self):
+        while True:
             try:
-                receipt = web3_client.w3.eth.get_transaction_receipt(tx.tx_hash)
-                if receipt:
-                    tx.status = (
-                        Transaction.COMPLETED 
-                        if receipt['status'] == 1 
-                        else Transaction.FAILED
+                self.tick()
+            except Exception:
+                logger.exception("Error indexing incoming transfers")
+            time.sleep(self.poll_interval)
+
+    def tick(self):
+        self.load_addresses()
+        target = self.web3_client.get_block_number() - self.confirmations
+        checkpoint, _ = IndexerCheckpoint.objects.get_or_create(
+            name=self.CHECKPOINT,
+            defaults={'block_number': target}
+        )
+
+        while checkpoint.block_number < target:
+            last = min(target, checkpoint.block_number + self.blocks_per_pass)
+            self.index_blocks(checkpoint, range(checkpoint.block_number + 1, last + 1))
+
+    def load_addresses(self):
+        new_wallets = Wallet.objects.filter(id__gt=self.last_wallet_id).order_by('id')
+        for wallet_id, address in new_wallets.values_list('id', 'address'):
+            self.addresses.add(address.lower())
+            self.last_wallet_id = wallet_id
+
+    def index_blocks(self, checkpoint, block_numbers):
+        matches = []
+        for block_number in block_numbers:
+            block = self.web3_client.get_block(block_number, full_transactions=True)
+            matches.extend(
+                (tx, block['timestamp']) for tx in block['transactions']
+                if tx['to'] and tx['to'].lower() in self.addresses
+            )
+
+        receipts = self.web3_client.get_transaction_receipts(
+            [Web3.to_hex(tx['hash']) for tx, _ in matches]
+        )
+        transfers = []
+        for tx, block_timestamp in matches:
+            tx_hash = Web3.to_hex(tx['hash'])
+            transfer = Transaction(
+                from_address=tx['from'],
+                to_address=tx['to'],
+                amount=Web3.from_wei(tx['value'], 'ether'),
+                gas_price=Web3.from_wei(tx.get('gasPrice', tx.get('maxFeePerGas', 0)), 'gwei'),
+                tx_hash=tx_hash,
+                nonce=tx['nonce'],
+            )
+            # Without a receipt it stays pending and the receipt monitor settles it
+            if receipts.get(tx_hash) is not None:
+                transfer.apply_receipt(receipts[tx_hash], block_timestamp)
+            transfers.append(transfer)
+
+        with db_transaction.atomic():
+            # Transfers between our own wallets already have a row
+            Transaction.objects.bulk_create(transfers, ignore_conflicts=True)
+            checkpoint.block_number = block_numbers[-1]
+            checkpoint.save(update_fields=['block_number', 'updated_at'])
+
+        if transfers:
+            addresses = {transfer.to_address for transfer in transfers}
+            balance_cache.invalidate(*addresses)
+            refresh_snapshots(self.snapshots, addresses, block_numbers[-1])
+
+
+class MultiSigExecutor:
+    """
+    Sign and broadcast the multisig transfers that collected every approval
+
+    Due queue rows are claimed in batches with SELECT ... FOR UPDATE SKIP
+    LOCKED, and their next attempt is pushed out by ``lease`` seconds so
+    executors never share a row. A row with a signature that does not
+    verify fails straight away. The rest are signed per wallet, decrypting
+    each key once, with nonces from the wallet's counter. The signed transactions are
+    saved before anything is sent, so a retry rebroadcasts the same
+    transaction instead of signing a second one. Each batch is sent in one
+    RPC batch request. Accepted transfers become pending and the receipt
+    monitor settles them. Rejected ones are retried with exponential
+    backoff, up to ``max_attempts`` attempts.
+    """
+    def __init__(self, web3_client=None, poll_interval=None, batch_size=None,
+                 max_attempts=None, backoff=None, backoff_max=None, lease=None):
+        self.web3_client = web3_client or get_web3_client()
+        self.poll_interval = poll_interval or settings.MONITOR_POLL_INTERVAL
+        self.batch_size = batch_size or settings.MULTISIG_EXECUTOR_BATCH_SIZE
+        self.max_attempts = max_attempts or settings.MULTISIG_EXECUTOR_MAX_ATTEMPTS
+        self.backoff = backoff or settings.MULTISIG_EXECUTOR_BACKOFF
+        self.backoff_max = backoff_max or settings.MULTISIG_EXECUTOR_BACKOFF_MAX
+        self.lease = timedelta(seconds=lease or settings.MULTISIG_EXECUTOR_LEASE)
+        self.nonce_manager = NonceManager(self.web3_client)
+
+    def run(self):
+        while True:
+            try:
+                started = time.monotonic()
+                broadcast = self.tick()
+                if broadcast:
+                    elapsed = time.monotonic() - started
+                    logger.info(
+                        "Broadcast %d multisig transaction(s) in %.2fs (%.0f/s)",
+                        broadcast, elapsed, broadcast / elapsed
                     )
-                    tx.gas_used = receipt['gasUsed']
-                    tx.save()
+            except Exception:
+                logger.exception("Error executing multisig transactions")
+            time.sleep(self.poll_interval)
+
+    def tick(self):
+        """
+        Work through every due queue row, returning how many were broadcast
+        """
+        broadcast = 0
+        while True:
+            executions = self.claim()
+            if not executions:
+                return broadcast
+            broadcast += self.execute(executions)
+
+    def claim(self):
+        """
+        Claim up to ``batch_size`` due queue rows and count the attempt
+        """
+        now = timezone.now()
+        claimed_until = now + self.lease
+        # A transfer that already left (or failed) is never signed again
+        due = Q(
+            status=MultiSigExecution.QUEUED,
+            next_attempt_at__lte=now,
+            multisig__transaction__status=Transaction.QUEUED
+        )
+        with db_transaction.atomic():
+            ids = list(
+                MultiSigExecution.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(due)
+                .order_by('next_attempt_at')
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            # Re-checking the condition keeps backends without row locks
+            # from handing the same row to two executors
+            MultiSigExecution.objects.filter(due, id__in=ids).update(
+                next_attempt_at=claimed_until,
+                attempts=F('attempts') + 1
+            )
+        return list(
+            MultiSigExecution.objects.filter(
+                id__in=ids,
+                next_attempt_at=claimed_until
+            ).select_related('multisig__transaction__from_wallet')
+        )
+
+    def execute(self, executions):
+        """
+        Verify, sign and broadcast claimed rows, returning how many went out
+        """
+        # Stored verification results, recovering only never-checked signatures
+        signatures = list(
+            TransactionSignature.objects.filter(
+                multi_sig_transaction__in=[execution.multisig for execution in executions]
+            ).select_related('signer', 'multi_sig_transaction')
+        )
+        verify_signatures([sig for sig in signatures if sig.verified is None])
+        unverified = {sig.multi_sig_transaction_id for sig in signatures if not sig.verified}
+
+        ready = []
+        for execution in executions:
+            if execution.multisig_id in unverified:
+                self.finish(execution, "Signature verification failed", retry=False)
+            else:
+                ready.append(execution)
+        self.sign([execution for execution in ready if execution.raw_transaction is None])
+        # Rows whose signing failed were rescheduled
+        return self.broadcast([execution for execution in ready if execution.raw_transaction is not None])
+
+    def sign(self, executions):
+        if not executions:
+            return
+        fees = self.web3_client.fee_oracle.get_fees()
+        by_wallet = defaultdict(list)
+        for execution in executions:
+            by_wallet[execution.multisig.transaction.from_wallet].append(execution)
+
+        for wallet, group in by_wallet.items():
+            nonces = self.nonce_manager.allocate_many(wallet, len(group))
+            try:
+                signed = self.web3_client.sign_transactions(
+                    wallet,
+                    [
+                        self.web3_client.build_transfer(
+                            nonce,
+                            execution.multisig.transaction.to_address,
+                            execution.multisig.transaction.amount,
+                            fees
+                        )
+                        for nonce, execution in zip(nonces, group)
+                    ]
+                )
             except Exception as e:
-                print(f"Error monitoring transaction {tx.tx_hash}: {str(e)}")
-        
-        time.sleep(15)  # Wait 15 seconds between checks
\ No newline at end of file
+                # The nonces never reached the node, the next sends get them
+                logger.exception("Error signing multisig transfers from %s", wallet.address)
+                for nonce in nonces:
+                    self.nonce_manager.release(wallet, nonce)
+                for execution in group:
+                    self.finish(execution, f"Signing failed: {e}")
+                continue
+            for nonce, execution, (raw_tx, tx_hash) in zip(nonces, group, signed):
+                tx = execution.multisig.transaction
+                tx.tx_hash = tx_hash
+                tx.nonce = nonce
+                tx.gas_price = Web3.from_wei(fees['max_fee_per_gas'], 'gwei')
+                execution.raw_transaction = raw_tx
+
+        signed = [execution for execution in executions if execution.raw_transaction is not None]
+        with db_transaction.atomic():
+            Transaction.objects.bulk_update(
+                [execution.multisig.transaction for execution in signed],
+                ['tx_hash', 'nonce', 'gas_price']
+            )
+            MultiSigExecution.objects.bulk_update(signed, ['raw_transaction'])
+
+    def broadcast(self, executions):
+        if not executions:
+            return 0
+        try:
+            responses = self.web3_client.w3.provider.make_batch_request([
+                ('eth_sendRawTransaction', [execution.raw_transaction]) for execution in executions
+            ])
+        except Exception as e:
+            responses = [{'error': {'message': str(e)}}] * len(executions)
+
+        sent, nonce_taken = [], []
+        for execution, response in zip(executions, responses):
+            error = response.get('error')
+            message = error.get('message', str(error)) if error else ''
+            if not error or 'already known' in message.lower():
+                sent.append(execution)
+            elif is_nonce_too_low(message):
+                nonce_taken.append(execution)
+            else:
+                self.finish(execution, message)
+
+        # "Nonce too low" is our own transaction if it was already mined,
+        # otherwise the nonce went elsewhere and the transfer is signed again
+        if nonce_taken:
+            receipts = self.web3_client.get_transaction_receipts(
+                [execution.multisig.transaction.tx_hash for execution in nonce_taken]
+            )
+            for execution in nonce_taken:
+                if receipts.get(execution.multisig.transaction.tx_hash) is not None:
+                    sent.append(execution)
+                else:
+                    wallet = execution.multisig.transaction.from_wallet
+                    self.nonce_manager.sent(wallet)
+                    self.nonce_manager.resync(wallet)
+                    self.finish(execution, "Nonce already used", resign=True)
+
+        sent_by_wallet = defaultdict(int)
+        for execution in sent:
+            sent_by_wallet[execution.multisig.transaction.from_wallet] += 1
+        for wallet, count in sent_by_wallet.items():
+            self.nonce_manager.sent(wallet, count)
+
+        now = timezone.now()
+        for execution in sent:
+            execution.status = MultiSigExecution.BROADCAST
+            execution.last_error = ''
+            execution.updated_at = now
+            execution.multisig.transaction.status = Transaction.PENDING
+            execution.multisig.transaction.updated_at = now
+        with db_transaction.atomic():
+            MultiSigExecution.objects.bulk_update(sent, ['status', 'last_error', 'updated_at'])
+            Transaction.objects.bulk_update(
+                [execution.multisig.transaction for execution in sent],
+                ['status', 'updated_at']
+            )
+        addresses = set()
+        for execution in sent:
+            addresses.update([execution.multisig.transaction.from_address, execution.multisig.transaction.to_address])
+        if addresses:
+            balance_cache.invalidate(*addresses)
+        return len(sent)
+
+    def finish(self, execution, error, retry=True, resign=False):
+        """
+        Schedule a retry with backoff, or fail the row once it is out of attempts
+        """
+        tx = execution.multisig.transaction
+        if resign:
+            tx.tx_hash = tx.nonce = execution.raw_transaction = None
+        execution.last_error = error
+        if not retry or execution.attempts >= self.max_attempts:
+            execution.status = MultiSigExecution.FAILED
+            tx.status = Transaction.FAILED
+            if tx.nonce is not None:
+                # Its nonce goes to the next send instead of leaving a gap
+                self.nonce_manager.release(tx.from_wallet, tx.nonce)
+        else:
+            delay = min(self.backoff * 2 ** (execution.attempts - 1), self.backoff_max)
+            execution.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        with db_transaction.atomic():
+            execution.save(update_fields=[
+                'status', 'last_error', 'next_attempt_at', 'raw_transaction', 'updated_at'
+            ])
+            tx.save(update_fields=['status', 'tx_hash', 'nonce', 'updated_at'])
+
+
+def monitor_transactions():
+    ReceiptMonitor().run()
@@ -1,3 +1,2448 @@
-from django.test import TestCase
+import asyncio
+import base64
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import requests
+import rlp
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections, transaction as db_transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Min
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from web3 import Web3
+from web3.providers.base import BaseProvider
+
+from accounts.models import CustomUser
+from . import async_views
+from .db_router import PIN_COOKIE, ReplicaRouter, primary_reads, replica_reads
+from .models import (
+    IndexerCheckpoint, MultiSigExecution, MultiSigTransaction, PortfolioSnapshot, Transaction, TransactionSignature,
+    Wallet, WalletBalanceSnapshot, WalletNonce
+)
+from .tasks import IncomingTransferIndexer, MultiSigExecutor, ReceiptMonitor, refresh_snapshots
+from .utils.fee_oracle import FeeOracle
+from .utils.history_utils import decode_cursor, encode_cursor, history_page
+from .utils.multisig_utils import (
+    MultiSigManager, expire_multisigs, signable_multisigs, signature_message, verify_pending_signatures, verify_signatures
+)
+from .utils.nonce_utils import NonceManager
+from .utils.payout_utils import BulkPayoutService, get_signing_pool
+from .utils.price_feed import PriceFeed, StaticPriceSource
+from .utils.rpc_router import AsyncRoutingHTTPProvider, RoutingHTTPProvider
+from .utils.signer_service import KeyCache, SigningClient, SigningError, SigningServer
+from .utils.signing_utils import sign_transfers
+from .utils.singleflight import SingleFlight
+from .utils.snapshot_utils import SnapshotService
+from .utils import web3_utils
+from .utils.web3_utils import AsyncWeb3Client, Web3Client, get_async_web3_client
+from .views import transaction_detail, wallet_dashboard
+
+
+class StubNode(BaseProvider):
+    """
+    In-process JSON-RPC node keeping per-sender nonces, a mempool and receipts
+
+    Sends are validated like a real node: a nonce below the mined count is
+    "nonce too low" and a resend of a pooled transaction is "already known".
+    ``reject`` is called with (sender, nonce) and may return an error
+    message to refuse a send. Every call is recorded in ``calls`` and every
+    round trip waits ``latency`` seconds, then raises ConnectionError while
+    ``down`` is set. ``balances`` overrides ``balance`` per address; a
+    string there is returned as the lookup's error. ``receipts`` maps mined
+    hashes to their block, and the hashes in ``failed`` were reverted.
+    ``transactions`` holds every transaction's fields for full blocks.
+    Fee history reports ``base_fee`` (``next_base_fee`` for the pending
+    block) and one tip per block from ``rewards``.
+    """
+    def __init__(self, block_number=100, balance=10 ** 18):
+        self.block_number = block_number
+        self.balance = balance
+        self.mined = {}
+        self.pool = {}
+        self.receipts = {}
+        self.failed = set()
+        self.transactions = {}
+        self.base_fee = 10 ** 10
+        self.next_base_fee = None
+        self.rewards = None
+        self.calls = []
+        self.batches = []
+        self.reject = None
+        self.balances = {}
+        self.latency = 0
+        self.down = False
+        self.endpoint_uri = 'stub://node'
+        self.lock = threading.Lock()
+
+    def is_connected(self, show_traceback=False):
+        return True
+
+    def make_request(self, method, params):
+        time.sleep(self.latency)
+        return self.answer(method, params)
+
+    def make_batch_request(self, calls):
+        time.sleep(self.latency)
+        return self.answer_batch(calls)
+
+    def answer(self, method, params):
+        if self.down:
+            raise ConnectionError(f"{self.endpoint_uri} is down")
+        with self.lock:
+            self.calls.append(method)
+            return self.handle(method, params)
+
+    def answer_batch(self, calls):
+        if self.down:
+            raise ConnectionError(f"{self.endpoint_uri} is down")
+        with self.lock:
+            self.batches.append([method for method, _ in calls])
+            return [self.handle(method, params) for method, params in calls]
+
+    def handle(self, method, params):
+        try:
+            result = getattr(self, method)(*params)
+        except ValueError as e:
+            return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+    def pending_count(self, address):
+        nonce = self.mined.get(address, 0)
+        while nonce in self.pool.get(address, {}):
+            nonce += 1
+        return nonce
+
+    def mine(self):
+        """
+        Mine every transaction that has no nonce gap before it into a new block
+        """
+        with self.lock:
+            self.block_number += 1
+            for address, pool in self.pool.items():
+                nonce = self.mined.get(address, 0)
+                while nonce in pool:
+                    self.receipts[pool.pop(nonce)] = self.block_number
+                    nonce += 1
+                self.mined[address] = nonce
+
+    def eth_chainId(self):
+        return hex(1337)
+
+    def eth_blockNumber(self):
+        return hex(self.block_number)
+
+    def eth_getBalance(self, address, block_identifier):
+        balance = self.balances.get(address, self.balance)
+        if isinstance(balance, str):
+            raise ValueError(balance)
+        return hex(balance)
+
+    def eth_getTransactionCount(self, address, block_identifier):
+        if block_identifier == 'pending':
+            return hex(self.pending_count(address))
+        return hex(self.mined.get(address, 0))
+
+    def eth_feeHistory(self, block_count, newest_block, percentiles):
+        count = int(block_count, 16) if isinstance(block_count, str) else block_count
+        rewards = self.rewards[-count:] if self.rewards is not None else [10 ** 9] * count
+        return {
+            'oldestBlock': hex(self.block_number - count + 1),
+            'baseFeePerGas': [hex(self.base_fee)] * count + [hex(self.next_base_fee or self.base_fee)],
+            'gasUsedRatio': [0.5] * count,
+            'reward': [[hex(reward)] for reward in rewards],
+        }
+
+    def eth_sendRawTransaction(self, raw_transaction):
+        raw = bytes.fromhex(raw_transaction[2:])
+        sender = Account.recover_transaction(raw)
+        # EIP-1559 payload: [chain_id, nonce, tip, max_fee, gas, to, value, ...]
+        fields = rlp.decode(raw[1:])
+        nonce = int.from_bytes(fields[1], 'big')
+        tx_hash = Web3.keccak(raw).hex()
+        pool = self.pool.setdefault(sender, {})
+        if self.reject:
+            error = self.reject(sender, nonce)
+            if error:
+                raise ValueError(error)
+        if nonce < self.mined.get(sender, 0):
+            raise ValueError('nonce too low')
+        if nonce in pool:
+            raise ValueError('already known' if pool[nonce] == tx_hash else 'replacement transaction underpriced')
+        pool[nonce] = tx_hash
+        self.transactions[tx_hash] = self.transaction_fields(
+            tx_hash, sender, nonce, Web3.to_checksum_address(fields[5]), int.from_bytes(fields[6], 'big')
+        )
+        return tx_hash
+
+    def eth_getBlockByNumber(self, block_identifier, full_transactions):
+        number = self.block_number if block_identifier == 'latest' else int(block_identifier, 16)
+        return {
+            'number': hex(number),
+            'hash': '0x' + '%064x' % number,
+            'timestamp': hex(self.block_time(number)),
+            'transactions': [
+                self.transactions[tx_hash] if full_transactions else tx_hash
+                for tx_hash, block in self.receipts.items() if block == number
+            ],
+        }
+
+    def add_transfer(self, block_number, sender, to, value):
+        """
+        A transfer sent from outside the app, mined in ``block_number``, returning its hash
+        """
+        nonce = sum(tx['from'] == sender for tx in self.transactions.values())
+        tx_hash = Web3.keccak(text=f'{sender}:{nonce}').hex()
+        self.transactions[tx_hash] = self.transaction_fields(tx_hash, sender, nonce, to, value)
+        self.receipts[tx_hash] = block_number
+        return tx_hash
+
+    def transaction_fields(self, tx_hash, sender, nonce, to, value):
+        return {
+            'hash': tx_hash,
+            'from': sender,
+            'to': to,
+            'value': hex(value),
+            'nonce': hex(nonce),
+            'gas': hex(21000),
+            'maxFeePerGas': hex(2 * 10 ** 10),
+            'input': '0x',
+        }
+
+    def block_time(self, number):
+        return 1_700_000_000 + 12 * number
+
+    def eth_getTransactionReceipt(self, tx_hash):
+        block_number = self.receipts.get(tx_hash)
+        if block_number is None:
+            return None
+        return {
+            'transactionHash': tx_hash,
+            'blockHash': '0x' + '%064x' % block_number,
+            'blockNumber': hex(block_number),
+            'transactionIndex': '0x0',
+            'gasUsed': hex(21000),
+            'cumulativeGasUsed': hex(21000),
+            'effectiveGasPrice': hex(10 ** 10),
+            'status': '0x0' if tx_hash in self.failed else '0x1',
+            'type': '0x2',
+            'from': '0x' + '00' * 20,
+            'to': '0x' + '00' * 20,
+            'contractAddress': None,
+            'logs': [],
+            'logsBloom': '0x' + '00' * 256,
+        }
+
+
+class AsyncStubNode:
+    """
+    Async front of a StubNode that waits out its latency without blocking the loop
+    """
+    def __init__(self, node):
+        self.node = node
+
+    async def make_request(self, method, params):
+        await asyncio.sleep(self.node.latency)
+        return self.node.answer(method, params)
+
+    async def make_batch_request(self, calls):
+        await asyncio.sleep(self.node.latency)
+        return self.node.answer_batch(calls)
+
+
+class StubNodeMixin:
+    """
+    A Web3Client on a fresh StubNode, and an empty cache, for every test
+    """
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.node = StubNode()
+        self.web3_client = Web3Client(provider=self.node)
+        self.web3_client.fee_oracle.start = lambda: None
+        # No background price fetches from the network
+        patcher = mock.patch.object(PriceFeed, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def async_web3_client(self):
+        """
+        An AsyncWeb3Client routed to the same StubNode
+        """
+        router = RoutingHTTPProvider([self.node], hedge_after=0)
+        return AsyncWeb3Client(AsyncRoutingHTTPProvider(router, [AsyncStubNode(self.node)]))
+
+    def create_user(self, username):
+        return CustomUser.objects.create_user(
+            username=username, email=f'{username}@example.com', password='password'
+        )
+
+
+class MultiSigExecutionTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.owner)
+        self.signer = self.web3_client.create_wallet(self.create_user('signer'))
+        self.manager = MultiSigManager(self.web3_client)
+        self.executor = MultiSigExecutor(web3_client=self.web3_client)
+
+    def sent(self):
+        return sum(batch.count('eth_sendRawTransaction') for batch in self.node.batches)
+
+    def test_approved_multisig_is_broadcast_once(self):
+        multisig = self.manager.create_multisig_transaction(
+            self.wallet, self.signer.address, 1, 2, signers=[self.signer]
+        )
+        self.assertFalse(self.manager.sign_transaction(multisig, self.wallet))
+        self.assertTrue(self.manager.sign_transaction(multisig, self.signer))
+
+        self.assertEqual(self.executor.tick(), 1)
+        self.assertEqual(self.executor.tick(), 0)
+        # A queue row put back by hand does not send it again either
+        MultiSigExecution.objects.update(status=MultiSigExecution.QUEUED, next_attempt_at=timezone.now())
+        self.assertEqual(self.executor.tick(), 0)
+        self.assertEqual(self.sent(), 1)
+        multisig.transaction.refresh_from_db()
+        self.assertEqual(multisig.transaction.status, Transaction.PENDING)
+        self.assertEqual(multisig.transaction.nonce, 0)
+
+    def test_signing_failure_gives_the_nonces_back(self):
+        other = self.web3_client.create_wallet(self.owner)
+        for wallet in (self.wallet, other):
+            multisig = self.manager.create_multisig_transaction(
+                wallet, self.signer.address, 1, 2, signers=[self.signer]
+            )
+            self.manager.sign_transaction(multisig, wallet)
+            self.manager.sign_transaction(multisig, self.signer)
+
+        sign_transactions = self.web3_client.sign_transactions
+
+        def sign(wallet, transactions):
+            if wallet == self.wallet:
+                raise RuntimeError('key unavailable')
+            return sign_transactions(wallet, transactions)
+
+        with mock.patch.object(self.web3_client, 'sign_transactions', side_effect=sign), \
+                self.assertLogs('banking.tasks', 'ERROR'):
+            self.assertEqual(self.executor.tick(), 1)
+
+        # The other wallet's transfer still went out
+        self.assertEqual(self.sent(), 1)
+        counter = WalletNonce.objects.get(wallet=self.wallet)
+        self.assertEqual((counter.next_nonce, counter.in_flight), (0, 0))
+        execution = MultiSigExecution.objects.get(multisig__transaction__from_wallet=self.wallet)
+        self.assertEqual(execution.status, MultiSigExecution.QUEUED)
+        self.assertIsNone(execution.raw_transaction)
+        self.assertEqual(execution.last_error, 'Signing failed: key unavailable')
+        self.assertGreater(execution.next_attempt_at, timezone.now())
+
+        # The retry signs with the nonce that was given back
+        MultiSigExecution.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.executor.tick(), 1)
+        execution.multisig.transaction.refresh_from_db()
+        self.assertEqual(execution.multisig.transaction.nonce, 0)
+
+    def test_legacy_broadcast_multisig_is_not_queued(self):
+        # Before the execution queue the transfer was sent when the multisig was created
+        transaction = Transaction.objects.create(
+            from_wallet=self.wallet,
+            from_address=self.wallet.address,
+            to_address=self.signer.address,
+            amount=1,
+            tx_hash='0x' + 'ab' * 32,
+            nonce=0
+        )
+        multisig = MultiSigTransaction.objects.create(
+            transaction=transaction,
+            required_signatures=1,
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+        self.assertTrue(self.manager.sign_transaction(multisig, self.wallet))
+        self.assertFalse(MultiSigExecution.objects.exists())
+        self.assertEqual(self.executor.tick(), 0)
+        self.assertEqual(self.sent(), 0)
+
+
+class MultiSigExecutionMigrationTests(TransactionTestCase):
+    migrate_from = [('banking', '0009_signature_verification')]
+    migrate_to = [('banking', '0010_multisig_execution_queue')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_existing_multisigs_are_marked_broadcast(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        user = apps.get_model('accounts', 'CustomUser').objects.create(username='owner', email='owner@example.com')
+        wallet = apps.get_model('banking', 'Wallet').objects.create(
+            user=user, address='0x' + '11' * 20, encrypted_private_key='key'
+        )
+        transaction = apps.get_model('banking', 'Transaction').objects.create(
+            from_wallet=wallet,
+            from_address=wallet.address,
+            to_address='0x' + '22' * 20,
+            amount=1,
+            gas_price=1,
+            tx_hash='0x' + 'ab' * 32,
+            nonce=0
+        )
+        apps.get_model('banking', 'MultiSigTransaction').objects.create(
+            transaction=transaction,
+            required_signatures=2,
+            expires_at=timezone.now() + timedelta(hours=1)
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        execution = apps.get_model('banking', 'MultiSigExecution').objects.get()
+        self.assertEqual(execution.status, 'broadcast')
+        self.assertEqual(execution.multisig.reference, transaction.tx_hash)
+
+
+class TransactionDetailTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.user)
+        self.transaction = Transaction.objects.create(
+            from_wallet=self.wallet,
+            from_address=self.wallet.address,
+            to_address='0x' + '22' * 20,
+            amount=1,
+            gas_price=10,
+            gas_used=21000,
+            tx_hash='0x' + 'ab' * 32,
+            nonce=0,
+            status=Transaction.COMPLETED,
+            block_number=101,
+            block_timestamp=timezone.now()
+        )
+        cache.set(Web3Client.LATEST_BLOCK_KEY, 105)
+
+    def assertRendered(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn(reverse('banking:transaction_history'), content)
+        self.assertIn(reverse('banking:wallet_dashboard'), content)
+
+    def test_sync_view_renders(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with mock.patch('banking.views.get_web3_client', return_value=self.web3_client):
+            response = transaction_detail(request, tx_hash=self.transaction.tx_hash)
+        self.assertRendered(response)
+        # Confirmations counted from the head the monitor published
+        self.assertIn('<dd class="col-sm-8">4</dd>', response.content.decode())
+
+    async def test_async_view_renders(self):
+        request = AsyncRequestFactory().get('/')
+        request.user = self.user
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        with mock.patch('banking.async_views.get_async_web3_client', return_value=self.async_web3_client()):
+            response = await async_views.transaction_detail(request, tx_hash=self.transaction.tx_hash)
+        self.assertRendered(response)
+
+    async def test_async_view_settles_a_pending_transaction(self):
+        tx_hash = '0x' + 'cd' * 32
+        transaction = await Transaction.objects.acreate(
+            from_wallet=self.wallet, from_address=self.wallet.address, to_address='0x' + '22' * 20,
+            amount=1, tx_hash=tx_hash, nonce=1, status=Transaction.PENDING
+        )
+        self.node.receipts[tx_hash] = 103
+        request = AsyncRequestFactory().get('/')
+        request.user = self.user
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        with mock.patch('banking.async_views.get_async_web3_client', return_value=self.async_web3_client()):
+            response = await async_views.transaction_detail(request, tx_hash=tx_hash)
+
+        self.assertRendered(response)
+        await transaction.arefresh_from_db()
+        self.assertEqual((transaction.status, transaction.block_number), (Transaction.COMPLETED, 103))
+        self.assertEqual(transaction.block_timestamp.timestamp(), 1_700_000_000 + 12 * 103)
+        self.assertIn('<dd class="col-sm-8">2</dd>', response.content.decode())
+
+
+@override_settings(READ_REPLICAS_ENABLED=True)
+@mock.patch('banking.db_router.replica_aliases', return_value=['replica1', 'replica2', 'replica3'])
+class ReplicaRoutingTests(SimpleTestCase):
+    router = ReplicaRouter()
+
+    def read(self):
+        return self.router.db_for_read(Wallet)
+
+    def test_one_replica_per_request(self, aliases):
+        @replica_reads
+        def view(request):
+            return HttpResponse(' '.join(self.read() for _ in range(20)))
+
+        for _ in range(20):
+            reads = set(view(RequestFactory().get('/')).content.decode().split())
+            self.assertEqual(len(reads), 1)
+            self.assertIn(reads.pop(), aliases.return_value)
+        self.assertEqual(self.read(), 'default')
+
+    def test_primary_after_write_pin_and_unsafe_methods(self, aliases):
+        @replica_reads
+        def view(request):
+            before = self.read()
+            with primary_reads():
+                checked = self.read()
+            self.router.db_for_write(Wallet)
+            return HttpResponse(' '.join([before, checked, self.read()]))
+
+        def reads(request):
+            return view(request).content.decode().split()
+
+        before, checked, after = reads(RequestFactory().get('/'))
+        self.assertIn(before, aliases.return_value)
+        self.assertEqual((checked, after), ('default', 'default'))
+
+        pinned = RequestFactory().get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(reads(pinned)[0], 'default')
+        self.assertEqual(reads(RequestFactory().post('/'))[0], 'default')
+
+    def test_streamed_body_reads_from_the_request_replica(self, aliases):
+        @replica_reads
+        def view(request):
+            return StreamingHttpResponse(self.read() for _ in range(5))
+
+        response = view(RequestFactory().get('/'))
+        # The body is produced after the view returned
+        chunks = {chunk.decode() for chunk in response}
+        self.assertEqual(len(chunks), 1)
+        self.assertIn(chunks.pop(), aliases.return_value)
+
+    async def test_async_streamed_body_reads_from_the_request_replica(self, aliases):
+        async def lines():
+            for _ in range(5):
+                yield self.read()
+
+        @replica_reads
+        async def view(request):
+            return StreamingHttpResponse(lines())
+
+        response = await view(AsyncRequestFactory().get('/'))
+        chunks = {chunk.decode() async for chunk in response}
+        self.assertEqual(len(chunks), 1)
+        self.assertIn(chunks.pop(), aliases.return_value)
+
+
+@override_settings(READ_REPLICAS_ENABLED=True, DATABASE_ROUTERS=['banking.db_router.ReplicaRouter'])
+class LaggingReplicaTests(StubNodeMixin, TestCase):
+    """
+    Dashboard reads against a replica that has not received the user's wallet yet
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # An empty in-memory database, shared by the threads of this process,
+        # stands in for a replica that has not caught up yet
+        cls.replica_settings = override_settings(DATABASES={
+            **settings.DATABASES,
+            'lagging_replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': 'file:lagging_replica?mode=memory&cache=shared',
+            },
+        })
+        # The warning is about the connection handler, which is reset below
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', 'Overriding setting DATABASES', UserWarning)
+            cls.replica_settings.enable()
+        # It reads DATABASES once, so hand it the new aliases
+        connections.settings = connections.configure_settings(None)
+        # Declared here, as the alias does not exist when the runner collects the tests
+        cls.databases = {'default', 'lagging_replica'}
+        replica = connections['lagging_replica']
+        with replica.schema_editor() as editor:
+            for model in (CustomUser, Wallet, WalletBalanceSnapshot, PortfolioSnapshot, Transaction):
+                editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        # Closing the last connection drops the in-memory database
+        connections['lagging_replica'].close()
+        del connections['lagging_replica']
+        cls.replica_settings.disable()
+        connections.settings = connections.configure_settings(None)
+        del cls.databases
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('banking.db_router.replica_aliases', return_value=['lagging_replica'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.user)
+
+    def request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request._messages = mock.MagicMock()
+        return request
+
+    def test_sync_dashboard_does_not_create_a_second_wallet(self):
+        with mock.patch('banking.views.get_web3_client', return_value=self.web3_client):
+            response = wallet_dashboard(self.request())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Wallet.objects.filter(user=self.user).count(), 1)
+        self.assertIn(self.wallet.address, response.content.decode())
+
+    async def test_async_dashboard_does_not_create_a_second_wallet(self):
+        request = self.request()
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        with mock.patch('banking.async_views.get_web3_client', return_value=self.web3_client), \
+                mock.patch('banking.async_views.get_async_web3_client', return_value=self.async_web3_client()):
+            response = await async_views.wallet_dashboard(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Wallet.objects.filter(user=self.user).acount(), 1)
+        self.assertIn(self.wallet.address, response.content.decode())
+
+
+class TransactionHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='password')
+        cls.first, cls.second = [
+            Wallet.objects.create(user=cls.user, address='0x' + digits * 20, encrypted_private_key='key')
+            for digits in ('11', '33')
+        ]
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='password')
+        cls.other_wallet = Wallet.objects.create(user=other, address='0x' + '44' * 20, encrypted_private_key='key')
+        outsider = '0x' + '22' * 20
+
+        # Newest first: index 0 is the latest; pairs share a timestamp so ids break the tie
+        parties = [
+            (cls.first, outsider),              # sent
+            (None, cls.second.address),         # received
+            (cls.first, cls.second.address),    # between the user's own wallets
+            (cls.other_wallet, outsider),       # someone else's
+        ]
+        start = timezone.now()
+        transactions = []
+        for index in range(10):
+            from_wallet, to_address = parties[index % len(parties)]
+            transactions.append(Transaction.objects.create(
+                from_wallet=from_wallet,
+                from_address=from_wallet.address if from_wallet else outsider,
+                to_address=to_address,
+                amount=index,
+                tx_hash='0x%064x' % index,
+            ))
+        for index, transaction in enumerate(transactions):
+            Transaction.objects.filter(pk=transaction.pk).update(created_at=start - timedelta(minutes=index // 2))
+        newest_first = sorted(enumerate(transactions), key=lambda item: (item[0] // 2, -item[1].pk))
+        cls.expected = [
+            transaction.tx_hash for _, transaction in newest_first
+            if transaction.from_wallet != cls.other_wallet
+        ]
+
+    def wallets(self):
+        return Wallet.objects.filter(user=self.user)
+
+    def walk(self, limit):
+        pages, cursor = [], None
+        while True:
+            page, cursor = history_page(self.wallets(), cursor, limit)
+            pages.append([transaction.tx_hash for transaction in page])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_the_history_once_newest_first(self):
+        for limit in (1, 2, 3, 7, 8, 50):
+            pages = self.walk(limit)
+            self.assertEqual(sum(pages, []), self.expected, f'limit {limit}')
+            self.assertTrue(all(0 < len(page) <= limit for page in pages))
+
+    def test_exactly_full_last_page_has_no_cursor(self):
+        # 8 of the 10 rows are the user's
+        page, cursor = history_page(self.wallets(), limit=8)
+        self.assertEqual(len(page), 8)
+        self.assertIsNone(cursor)
+
+    def test_own_wallet_transfer_is_listed_once(self):
+        own = set(Transaction.objects.filter(
+            from_wallet=self.first, to_address=self.second.address
+        ).values_list('tx_hash', flat=True))
+        page, _ = history_page(self.wallets(), limit=50)
+        # Found by both the sent and the received query, listed once
+        self.assertEqual(len(own), 2)
+        self.assertEqual([tx.tx_hash for tx in page if tx.tx_hash in own], [h for h in self.expected if h in own])
+
+    def test_cursor_round_trips(self):
+        transaction = Transaction.objects.latest('id')
+        self.assertEqual(decode_cursor(encode_cursor(transaction)), (transaction.created_at, transaction.pk))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ('!!!', 'bm90LWEtY3Vyc29y', base64.urlsafe_b64encode(b'yesterday|1').decode(), '\u00e9'):
+            with self.assertRaisesMessage(ValueError, 'Invalid cursor'):
+                history_page(self.wallets(), cursor)
+
+    def test_json_endpoint_follows_next_cursor(self):
+        self.client.force_login(self.user)
+        url = reverse('banking:transaction_history_api')
+        seen, params = [], {'limit': 3}
+        while True:
+            body = self.client.get(url, params).json()
+            seen.extend(transaction['tx_hash'] for transaction in body['transactions'])
+            if body['next_cursor'] is None:
+                break
+            params['cursor'] = body['next_cursor']
+        self.assertEqual(seen, self.expected)
+
+    @override_settings(HISTORY_MAX_PAGE_SIZE=2)
+    def test_json_endpoint_caps_and_checks_its_parameters(self):
+        self.client.force_login(self.user)
+        url = reverse('banking:transaction_history_api')
+        self.assertEqual(len(self.client.get(url, {'limit': 100}).json()['transactions']), 2)
+        for params in ({'limit': 0}, {'limit': 'ten'}, {'cursor': 'not-a-cursor'}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_page_with_a_malformed_cursor_goes_back_to_the_start(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('banking:transaction_history'), {'cursor': 'not-a-cursor'})
+        self.assertRedirects(response, reverse('banking:transaction_history'))
+
+
+@override_settings(EXPORT_CHUNK_SIZE=200)
+class TransactionExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='owner', email='owner@example.com', password='password'
+        )
+        cls.small, cls.large = [
+            Wallet.objects.create(user=cls.user, address='0x' + digits * 20, encrypted_private_key='key')
+            for digits in ('11', '33')
+        ]
+        Transaction.objects.bulk_create([
+            Transaction(
+                from_wallet=cls.small if index < 1000 else cls.large,
+                from_address=(cls.small if index < 1000 else cls.large).address,
+                to_address='0x' + '22' * 20,
+                amount=1,
+                tx_hash='0x%064x' % index,
+                nonce=index
+            )
+            for index in range(5000)
+        ])
+
+    def url(self, wallet=None):
+        url = reverse('banking:export_transactions') + '?format=csv'
+        return f'{url}&wallet={wallet.address}' if wallet else url
+
+    def test_wsgi_export_streams_csv(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url())
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5001)
+        self.assertEqual(lines[1].split(',')[1], '0x%064x' % 0)
+
+    async def export(self, wallet=None):
+        """
+        Consume an export the way the ASGI handler does, returning (lines, bytes, peak memory)
+        """
+        response = await self.async_client.get(self.url(wallet))
+        self.assertTrue(response.is_async)
+        size = lines = 0
+        tracemalloc.start()
+        try:
+            async for chunk in response.streaming_content:
+                size += len(chunk)
+                lines += chunk.count(b'\n')
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return lines, size, peak
+
+    async def test_asgi_export_memory_does_not_grow_with_its_size(self):
+        await self.async_client.aforce_login(self.user)
+        await self.export(self.small)
+        small_lines, small_size, small_peak = await self.export(self.small)
+        lines, size, peak = await self.export()
+        self.assertEqual((small_lines, lines), (1001, 5001))
+        # Drained into memory first, the peak would grow with the body
+        self.assertLess(peak - small_peak, (size - small_size) / 4)
+
+
+def run_in_threads(count, target):
+    """
+    Run ``target(index)`` in ``count`` threads at once, returning the exceptions raised
+    """
+    errors = []
+    barrier = threading.Barrier(count)
+
+    def run(index):
+        try:
+            barrier.wait()
+            target(index)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class WriteContentionTests(TransactionTestCase):
+    """
+    Concurrent read-modify-write transactions on one row, with either engine
+    """
+    threads = 8
+    writes = 50
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='password')
+        wallet = Wallet.objects.create(user=user, address='0x' + '11' * 20, encrypted_private_key='key')
+        self.counter = WalletNonce.objects.create(wallet=wallet, next_nonce=0, synced_at=timezone.now())
+
+    def test_sqlite_connections_are_tuned(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite profile only')
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertGreater(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 0)
+
+    def test_concurrent_writers_neither_fail_nor_lose_updates(self):
+        def increment(index):
+            for _ in range(self.writes):
+                # Reading before writing is the pattern that fails with
+                # "database is locked" when SQLite upgrades a read lock
+                with db_transaction.atomic():
+                    counter = WalletNonce.objects.select_for_update().get(pk=self.counter.pk)
+                    counter.next_nonce += 1
+                    counter.save(update_fields=['next_nonce'])
+
+        started = time.monotonic()
+        errors = run_in_threads(self.threads, increment)
+        elapsed = time.monotonic() - started
+        self.assertEqual(errors, [])
+        self.counter.refresh_from_db()
+        self.assertEqual(self.counter.next_nonce, self.threads * self.writes)
+        # A loose ceiling, well above what either engine needs for 400 commits
+        self.assertLess(elapsed, 30)
+
+
+class NonceStressTests(StubNodeMixin, TransactionTestCase):
+    """
+    Parallel sends from one hot wallet through Web3Client.send_transaction
+    """
+    sends = 100
+    threads = 20
+
+    def setUp(self):
+        super().setUp()
+        self.wallet = self.web3_client.create_wallet(self.create_user('owner'))
+        self.recipient = '0x' + '22' * 20
+
+    def send_all(self, count):
+        """
+        Fire ``count`` sends from ``threads`` threads, returning the exceptions raised
+        """
+        errors = []
+
+        def send(index):
+            for _ in range(index, count, self.threads):
+                try:
+                    self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+                except Exception as e:
+                    errors.append(e)
+        errors.extend(run_in_threads(self.threads, send))
+        return errors
+
+    def assertNoGap(self, sent):
+        """
+        The node holds exactly nonces 0..sent-1 from the wallet, so all of them can be mined
+        """
+        nonces = sorted(Transaction.objects.values_list('nonce', flat=True))
+        self.assertEqual(nonces, list(range(sent)))
+        self.assertEqual(self.node.pending_count(self.wallet.address), sent)
+        counter = WalletNonce.objects.get(wallet=self.wallet)
+        self.assertEqual((counter.next_nonce, counter.in_flight, counter.released), (sent, 0, []))
+        self.node.mine()
+        self.assertEqual(len(self.node.receipts), sent)
+
+    def test_parallel_sends_get_distinct_nonces(self):
+        # The first send seeds the counter from the chain
+        self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+        self.assertEqual(self.send_all(self.sends - 1), [])
+        self.assertNoGap(self.sends)
+        self.assertEqual(self.node.calls.count('eth_getTransactionCount'), 1)
+
+    def test_failed_sends_leave_no_gap(self):
+        # Every seventh send is refused; its nonce goes to a later send
+        attempts = iter(range(1, 1000))
+        self.node.reject = lambda sender, nonce: 'insufficient funds' if next(attempts) % 7 == 0 else None
+        errors = self.send_all(self.sends)
+        self.assertTrue(errors)
+        self.assertNoGap(self.sends - len(errors))
+
+    def test_unanswered_send_keeps_its_nonce(self):
+        make_request = self.node.make_request
+
+        def time_out(method, params):
+            if method == 'eth_sendRawTransaction':
+                raise TimeoutError('read timed out')
+            return make_request(method, params)
+
+        with mock.patch.object(self.node, 'make_request', time_out), \
+                self.assertLogs('banking.utils.web3_utils', 'WARNING'):
+            tx = self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+
+        # Tracked for the receipt monitor, and its nonce is not handed out again
+        self.assertEqual((tx.nonce, tx.status), (0, Transaction.PENDING))
+        counter = WalletNonce.objects.get(wallet=self.wallet)
+        self.assertEqual((counter.next_nonce, counter.in_flight, counter.released), (1, 0, []))
+
+        # It never reached the node: the resync gives the nonce back once the send is old
+        long_ago = timezone.now() - timedelta(hours=1)
+        WalletNonce.objects.filter(wallet=self.wallet).update(allocated_at=long_ago, synced_at=long_ago)
+        NonceManager(self.web3_client).resync(self.wallet)
+        self.assertEqual(self.web3_client.send_transaction(self.wallet, self.recipient, 2).nonce, 0)
+
+    def test_failed_signing_releases_the_nonce(self):
+        with mock.patch.object(self.web3_client, 'sign_transactions', side_effect=RuntimeError('bad key')):
+            with self.assertRaises(RuntimeError):
+                self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+        counter = WalletNonce.objects.get(wallet=self.wallet)
+        self.assertEqual((counter.next_nonce, counter.in_flight), (0, 0))
+
+    def test_nonce_used_elsewhere_moves_the_counter_forward(self):
+        self.assertEqual(self.send_all(10), [])
+        self.node.mine()
+        # Five transactions sent from the same key by another system
+        self.node.mined[self.wallet.address] += 5
+        self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+        self.assertEqual(Transaction.objects.order_by('-nonce').values_list('nonce', flat=True)[0], 15)
+        self.assertEqual(WalletNonce.objects.get(wallet=self.wallet).in_flight, 0)
+
+    def test_nonce_of_a_crashed_sender_is_reused_once_it_is_abandoned(self):
+        manager = NonceManager(self.web3_client)
+        # Allocated and never sent or released
+        self.assertEqual(manager.allocate(self.wallet), 0)
+        self.assertEqual(self.send_all(5), [])
+        self.assertEqual(self.node.pending_count(self.wallet.address), 0)
+
+        # Still outstanding, so the gap is left alone
+        manager.resync(self.wallet)
+        self.assertEqual(WalletNonce.objects.get(wallet=self.wallet).released, [])
+
+        long_ago = timezone.now() - timedelta(hours=1)
+        WalletNonce.objects.filter(wallet=self.wallet).update(allocated_at=long_ago, synced_at=long_ago)
+        self.web3_client.send_transaction(self.wallet, self.recipient, 1)
+        self.assertEqual(self.node.pending_count(self.wallet.address), 6)
+        self.assertEqual(WalletNonce.objects.get(wallet=self.wallet).next_nonce, 6)
+
+
+class ConcurrentSignerTests(StubNodeMixin, TransactionTestCase):
+    """
+    More signers than the threshold signing one multisig at the same moment
+    """
+    signers = 10
+    required = 3
+
+    def test_signatures_stop_at_the_threshold(self):
+        owner = self.web3_client.create_wallet(self.create_user('owner'))
+        wallets = [self.web3_client.create_wallet(self.create_user(f'signer{index}')) for index in range(self.signers)]
+        manager = MultiSigManager(self.web3_client)
+        multisig = manager.create_multisig_transaction(owner, '0x' + '22' * 20, 1, self.required, signers=wallets)
+
+        approvals = []
+
+        def sign(index):
+            approvals.append(manager.sign_transaction(
+                MultiSigTransaction.objects.get(pk=multisig.pk), wallets[index]
+            ))
+
+        errors = run_in_threads(self.signers, sign)
+        self.assertEqual(len(approvals), self.required)
+        self.assertEqual(approvals.count(True), 1)
+        self.assertEqual(len(errors), self.signers - self.required)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+        multisig.refresh_from_db()
+        self.assertEqual(multisig.current_signatures, self.required)
+        self.assertEqual(multisig.status, MultiSigTransaction.APPROVED)
+        # Signatures of the refused signers were rolled back with their count
+        self.assertEqual(TransactionSignature.objects.filter(multi_sig_transaction=multisig).count(), self.required)
+        self.assertEqual(MultiSigExecution.objects.filter(multisig=multisig).count(), 1)
+
+    def test_second_signature_from_one_wallet_is_refused(self):
+        owner = self.web3_client.create_wallet(self.create_user('owner'))
+        wallets = [self.web3_client.create_wallet(self.create_user(f'signer{index}')) for index in range(2)]
+        manager = MultiSigManager(self.web3_client)
+        multisig = manager.create_multisig_transaction(owner, '0x' + '22' * 20, 1, self.required, signers=wallets)
+
+        errors = run_in_threads(4, lambda index: manager.sign_transaction(
+            MultiSigTransaction.objects.get(pk=multisig.pk), owner
+        ))
+        self.assertEqual(len(errors), 3)
+        multisig.refresh_from_db()
+        self.assertEqual(multisig.current_signatures, 1)
+
+
+class SigningDaemonTests(SimpleTestCase):
+    """
+    Round trips through the signing daemon match signing in the web worker
+    """
+    transactions = [
+        {
+            'nonce': nonce,
+            'to': '0x' + '22' * 20,
+            'value': 10 ** 15,
+            'gas': 21000,
+            'maxFeePerGas': 2 * 10 ** 9,
+            'maxPriorityFeePerGas': 10 ** 9,
+            'chainId': 1,
+            'data': b'\x01\x02',
+        }
+        for nonce in range(3)
+    ]
+
+    def setUp(self):
+        self.encrypted_key = Fernet(settings.ENCRYPTION_KEY).encrypt(Account.create().key.hex().encode()).decode()
+        self.socket_path = os.path.join(tempfile.mkdtemp(), 'signer.sock')
+        self.client = SigningClient(self.socket_path)
+        self.addCleanup(self.client._close)
+
+    def start_server(self):
+        keys = KeyCache(settings.ENCRYPTION_KEY)
+        server = SigningServer(self.socket_path, keys)
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.addCleanup(stop)
+        return keys
+
+    def local_signature(self, message):
+        private_key = Fernet(settings.ENCRYPTION_KEY).decrypt(self.encrypted_key.encode()).decode()
+        return Account.sign_message(encode_defunct(text=message), private_key).signature.hex()
+
+    def test_round_trip(self):
+        keys = self.start_server()
+        self.assertEqual(
+            self.client.sign_transactions(self.encrypted_key, self.transactions),
+            sign_transfers(self.encrypted_key, settings.ENCRYPTION_KEY, self.transactions)
+        )
+        self.assertEqual(self.client.sign_message(self.encrypted_key, 'approve 1'), self.local_signature('approve 1'))
+        # The key was decrypted once for both calls
+        self.assertEqual((keys.misses, keys.hits), (1, 3))
+
+    def test_errors_come_back_per_request(self):
+        self.start_server()
+        with self.assertRaises(SigningError):
+            self.client.sign_message(Fernet(Fernet.generate_key()).encrypt(b'00').decode(), 'approve 1')
+        # The connection is still usable after a refused request
+        self.assertEqual(self.client.sign_message(self.encrypted_key, 'approve 1'), self.local_signature('approve 1'))
+
+    def test_reconnects_after_restart(self):
+        server = SigningServer(self.socket_path, KeyCache(settings.ENCRYPTION_KEY))
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+        self.client.sign_message(self.encrypted_key, 'approve 1')
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+        # The kept connection is dead, the next call opens a new one
+        keys = self.start_server()
+        self.assertEqual(self.client.sign_message(self.encrypted_key, 'approve 1'), self.local_signature('approve 1'))
+        self.assertEqual(keys.misses, 1)
+
+    def test_run_signer_command(self):
+        daemon = subprocess.Popen(
+            [sys.executable, 'manage.py', 'run_signer', '--socket', self.socket_path],
+            cwd=settings.BASE_DIR,
+            stdout=subprocess.PIPE
+        )
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.kill)
+        self.assertIn(b'Signing on', daemon.stdout.readline())
+
+        self.assertEqual(
+            self.client.sign_transactions(self.encrypted_key, self.transactions),
+            sign_transfers(self.encrypted_key, settings.ENCRYPTION_KEY, self.transactions)
+        )
+        self.assertEqual(self.client.sign_message(self.encrypted_key, 'approve 1'), self.local_signature('approve 1'))
+
+        # SIGTERM wipes the keys and removes the socket
+        daemon.send_signal(signal.SIGTERM)
+        self.assertEqual(daemon.wait(timeout=10), 0)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_web3_client_signs_through_the_daemon(self):
+        self.start_server()
+        wallet = Wallet(address=Account.create().address, encrypted_private_key=self.encrypted_key)
+        with override_settings(SIGNER_SOCKET=self.socket_path):
+            client = Web3Client(provider=StubNode())
+        self.assertIsNotNone(client.signer)
+        with mock.patch('banking.utils.web3_utils.sign_transfers') as local:
+            self.assertEqual(
+                client.sign_transactions(wallet, self.transactions),
+                sign_transfers(self.encrypted_key, settings.ENCRYPTION_KEY, self.transactions)
+            )
+            self.assertEqual(client.sign_message(wallet, 'approve 1'), self.local_signature('approve 1'))
+        local.assert_not_called()
+
+
+class SignatureRecoveryTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = MultiSigManager(self.web3_client)
+        owner = self.web3_client.create_wallet(self.create_user('owner'))
+        self.wallets = [self.web3_client.create_wallet(self.create_user(f'signer{index}')) for index in range(4)]
+        self.multisig = self.manager.create_multisig_transaction(owner, '0x' + '22' * 20, 1, 5, signers=self.wallets)
+
+    def add_signature(self, wallet, signature):
+        return TransactionSignature.objects.create(
+            multi_sig_transaction=self.multisig,
+            signer=wallet,
+            signature=signature
+        )
+
+    def forged_signature(self, wallet):
+        # A valid signature of the right message, by a key that is not the wallet's
+        message = signature_message(self.multisig.reference, wallet.address)
+        return Account.sign_message(encode_defunct(text=message), Account.create().key).signature.hex()
+
+    def pending(self):
+        return TransactionSignature.objects.select_related('signer', 'multi_sig_transaction').order_by('id')
+
+    def test_recovers_the_signer(self):
+        self.manager.sign_transaction(self.multisig, self.wallets[0])
+        self.add_signature(self.wallets[1], self.forged_signature(self.wallets[1]))
+        self.add_signature(self.wallets[2], '0x1234')
+
+        good, forged, garbage = verify_signatures(self.pending())
+        self.assertTrue(good.verified)
+        self.assertEqual(good.recovered_address, self.wallets[0].address)
+        self.assertFalse(forged.verified)
+        self.assertIsNotNone(forged.recovered_address)
+        self.assertNotEqual(forged.recovered_address, self.wallets[1].address)
+        self.assertFalse(garbage.verified)
+        self.assertIsNone(garbage.recovered_address)
+
+        # The outcome is stored
+        self.assertEqual(
+            list(self.pending().values_list('verified', flat=True)),
+            [True, False, False]
+        )
+
+    @override_settings(SIGNATURE_PROCESS_POOL_MIN_SIZE=2, SIGNATURE_VERIFY_CHUNK_SIZE=1, SIGNATURE_VERIFY_PROCESSES=2)
+    def test_process_pool_keeps_input_order(self):
+        self.manager.sign_transaction(self.multisig, self.wallets[0])
+        self.add_signature(self.wallets[1], self.forged_signature(self.wallets[1]))
+        self.manager.sign_transaction(self.multisig, self.wallets[2])
+        self.add_signature(self.wallets[3], 'not a signature')
+
+        signatures = verify_signatures(self.pending())
+        self.assertEqual([sig.verified for sig in signatures], [True, False, True, False])
+        self.assertEqual(signatures[2].recovered_address, self.wallets[2].address)
+
+    def test_pending_signatures_are_verified_once(self):
+        for wallet in self.wallets[:3]:
+            self.manager.sign_transaction(self.multisig, wallet)
+        self.add_signature(self.wallets[3], self.forged_signature(self.wallets[3]))
+
+        self.assertEqual(verify_pending_signatures(batch_size=2), (3, 1))
+        self.assertEqual(verify_pending_signatures(batch_size=2), (0, 0))
+
+        self.add_signature(self.web3_client.create_wallet(self.create_user('late')), '0x00')
+        output = StringIO()
+        call_command('verify_signatures', stdout=output)
+        self.assertIn('Verified 0 signature(s), 1 invalid', output.getvalue())
+
+
+class ExpireMultisigTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = MultiSigManager(self.web3_client)
+        owner = self.web3_client.create_wallet(self.create_user('owner'))
+        signer = self.web3_client.create_wallet(self.create_user('signer'))
+        self.multisigs = []
+        for _ in range(6):
+            multisig = self.manager.create_multisig_transaction(owner, '0x' + '22' * 20, 1, 2, signers=[signer])
+            self.manager.sign_transaction(multisig, signer)
+            self.multisigs.append(multisig)
+        # All but the last are past their expiry
+        self.due = self.multisigs[:5]
+        MultiSigTransaction.objects.filter(id__in=[multisig.id for multisig in self.due]).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+    def statuses(self):
+        return list(MultiSigTransaction.objects.order_by('id').values_list('status', flat=True))
+
+    def test_expires_due_multisigs_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expire_multisigs(batch_size=2), 5)
+        expiring = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE') and 'banking_multisigtransaction' in query['sql'].split('SET')[0]
+        ]
+        self.assertEqual(len(expiring), 3)
+
+        self.assertEqual(self.statuses(), [MultiSigTransaction.EXPIRED] * 5 + [MultiSigTransaction.OPEN])
+        self.assertEqual(Transaction.objects.filter(status=Transaction.FAILED).count(), 5)
+        # Signatures are kept as the record of who approved
+        self.assertEqual(TransactionSignature.objects.count(), 6)
+        self.assertEqual(expire_multisigs(batch_size=2), 0)
+
+    def test_purge_signatures_deletes_only_expired_signatures(self):
+        self.assertEqual(expire_multisigs(batch_size=2, purge_signatures=True), 5)
+        self.assertEqual(
+            list(TransactionSignature.objects.values_list('multi_sig_transaction_id', flat=True)),
+            [self.multisigs[-1].id]
+        )
+
+    def test_command_loop_logs_failed_sweeps(self):
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                raise KeyboardInterrupt
+
+        output = StringIO()
+        with mock.patch('banking.management.base.time.sleep', side_effect=sleep), \
+                mock.patch(
+                    'banking.management.commands.expire_multisigs.expire_multisigs',
+                    side_effect=[DatabaseError('database is locked'), 5]
+                ), \
+                self.assertLogs('banking.management.commands.expire_multisigs', 'ERROR') as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('expire_multisigs', interval=30, stdout=output)
+
+        self.assertEqual(sleeps, [30, 30])
+        self.assertIn('database is locked', logs.output[0])
+        self.assertEqual(output.getvalue(), 'Expired 5 multisig transaction(s)\n')
+
+
+class BatchedBalanceTests(StubNodeMixin, TestCase):
+    def addresses(self, count):
+        return [Account.create().address for _ in range(count)]
+
+    def test_one_batch_for_many_addresses(self):
+        addresses = self.addresses(20)
+        for index, address in enumerate(addresses):
+            self.node.balances[address] = index * 10 ** 17
+        balances = self.web3_client.get_balances(addresses)
+
+        self.assertEqual(self.node.batches, [['eth_getBalance'] * 20])
+        self.assertNotIn('eth_getBalance', self.node.calls)
+        for index, address in enumerate(addresses):
+            self.assertEqual(balances[address], {'balance': Web3.from_wei(index * 10 ** 17, 'ether'), 'error': None})
+
+    def test_errors_are_per_address(self):
+        good, bad = self.addresses(2)
+        self.node.balances[bad] = 'header not found'
+        balances = self.web3_client.get_balances([good, bad])
+        self.assertEqual(balances[good]['balance'], 1)
+        self.assertEqual(balances[bad], {'balance': None, 'error': 'header not found'})
+
+        # Only the address that failed is asked for again
+        del self.node.balances[bad]
+        self.web3_client.get_balances([good, bad])
+        self.assertEqual(self.node.batches[-1], ['eth_getBalance'])
+
+    def test_cached_balances_skip_the_node(self):
+        addresses = self.addresses(5)
+        self.web3_client.get_balances(addresses)
+        self.web3_client.get_balances(addresses)
+        self.assertEqual(len(self.node.batches), 1)
+
+        # A new head reads every balance again
+        self.node.block_number += 1
+        cache.clear()
+        self.web3_client.get_balances(addresses)
+        self.assertEqual(len(self.node.batches), 2)
+        self.assertEqual(self.web3_client.get_balances([]), {})
+
+    def test_latency_stays_flat_as_wallets_grow(self):
+        self.node.latency = 0.02
+        self.web3_client.get_block_number()
+
+        timings = {}
+        for count in (1, 10, 50):
+            started = time.perf_counter()
+            self.web3_client.get_balances(self.addresses(count))
+            timings[count] = time.perf_counter() - started
+        # One round trip each; 50 serial lookups would take a second
+        self.assertLess(timings[50], timings[1] + 3 * self.node.latency)
+        self.assertEqual([len(batch) for batch in self.node.batches], [1, 10, 50])
+
+    def test_send_page_reads_balances_in_one_batch(self):
+        user = self.create_user('owner')
+        for _ in range(5):
+            self.web3_client.create_wallet(user)
+        self.client.force_login(user)
+        with mock.patch('banking.views.get_web3_client', return_value=self.web3_client):
+            response = self.client.get(reverse('banking:send_transaction'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['wallets']), 5)
+        self.assertEqual(self.node.batches, [['eth_getBalance'] * 5])
+        self.assertNotIn('eth_getBalance', self.node.calls)
+
+
+class BulkPayoutTests(StubNodeMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.user)
+        self.client.force_login(self.user)
+        patcher = mock.patch('banking.views.get_web3_client', return_value=self.web3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def payout_data(self, count):
+        return '\n'.join(
+            ['from_wallet,to_address,amount'] +
+            [f'{self.wallet.address},{Account.create().address},0.01' for _ in range(count)]
+        )
+
+    def wait_for(self, job_id, timeout=20):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            progress = self.client.get(reverse('banking:bulk_payout_status', args=[job_id])).json()
+            if progress['status'] in ('done', 'failed'):
+                return progress
+            time.sleep(0.05)
+        self.fail(f"Payout {job_id} did not finish")
+
+    def test_payout_runs_in_the_background(self):
+        gate = threading.Event()
+
+        def hold(sender, nonce):
+            # Broadcasts wait until the request has returned
+            gate.wait(10)
+
+        self.node.reject = hold
+
+        response = self.client.post(reverse('banking:bulk_payout'), {
+            'payout_data': self.payout_data(3),
+            'job_id': 'job1',
+        })
+        self.assertRedirects(response, reverse('banking:bulk_payout') + '?job=job1')
+        status = self.client.get(reverse('banking:bulk_payout_status', args=['job1']))
+        self.assertNotEqual(status.json()['status'], 'done')
+        gate.set()
+
+        progress = self.wait_for('job1')
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['broadcast'], 3)
+        self.assertEqual([row['status'] for row in progress['results']], ['sent'] * 3)
+        self.assertEqual(Transaction.objects.filter(from_wallet=self.wallet).count(), 3)
+
+        page = self.client.get(reverse('banking:bulk_payout'), {'job': 'job1'})
+        self.assertContains(page, 'Sent 3 of 3 payouts')
+        self.assertContains(page, progress['results'][0]['tx_hash'])
+
+    def test_ajax_post_returns_the_status_url(self):
+        response = self.client.post(
+            reverse('banking:bulk_payout'),
+            {'payout_data': self.payout_data(1), 'job_id': 'job1'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status_url'], reverse('banking:bulk_payout_status', args=['job1']))
+        self.assertEqual(self.wait_for('job1')['status'], 'done')
+
+    def test_jobs_are_scoped_to_their_user(self):
+        self.client.post(reverse('banking:bulk_payout'), {'payout_data': self.payout_data(1), 'job_id': 'job1'})
+        self.wait_for('job1')
+
+        self.client.force_login(self.create_user('other'))
+        response = self.client.get(reverse('banking:bulk_payout_status', args=['job1']))
+        self.assertEqual(response.status_code, 404)
+        page = self.client.get(reverse('banking:bulk_payout'), {'job': 'job1'})
+        self.assertNotContains(page, 'payoutProgress')
+
+    @override_settings(PAYOUT_PROCESS_POOL_MIN_ROWS=2, PAYOUT_SIGNING_CHUNK_SIZE=2, PAYOUT_SIGNING_PROCESSES=2)
+    def test_large_payouts_sign_in_the_shared_pool(self):
+        pool = get_signing_pool()
+        self.assertIs(get_signing_pool(), pool)
+        self.assertNotEqual(pool._mp_context.get_start_method(), 'fork')
+
+        rows = [
+            {'from_wallet': self.wallet.address, 'to_address': Account.create().address, 'amount': '0.01'}
+            for _ in range(6)
+        ]
+        service = BulkPayoutService(self.web3_client, job_id='job1')
+        with mock.patch.object(type(pool), 'map', wraps=pool.map) as pool_map:
+            results = service.start(self.user, rows).result(timeout=60)
+        pool_map.assert_called_once()
+        self.assertEqual([row['status'] for row in results], ['sent'] * 6)
+        self.assertEqual(sorted(row['nonce'] for row in results), list(range(6)))
+
+
+class PayoutRecordingTests(StubNodeMixin, TransactionTestCase):
+    """
+    Payout rows are written before they are broadcast, and nonces are only
+    given back when the node definitely did not take them
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.user)
+        self.service = BulkPayoutService(self.web3_client)
+
+    def rows(self, count):
+        return [
+            {'from_wallet': self.wallet.address, 'to_address': Account.create().address, 'amount': '0.01'}
+            for _ in range(count)
+        ]
+
+    def counter(self):
+        return WalletNonce.objects.get(wallet=self.wallet)
+
+    def test_rows_exist_before_the_broadcast(self):
+        seen = []
+
+        def check(sender, nonce):
+            seen.append(Transaction.objects.filter(from_wallet=self.wallet, status=Transaction.QUEUED).count())
+
+        self.node.reject = check
+        results = self.service.execute(self.user, self.rows(3))
+        self.assertEqual(seen, [3, 3, 3])
+        self.assertEqual([row['status'] for row in results], ['sent'] * 3)
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('tx_hash', flat=True)),
+            sorted(row['tx_hash'] for row in results)
+        )
+        self.assertFalse(Transaction.objects.exclude(status=Transaction.PENDING).exists())
+
+    def test_rejected_rows_fail_and_give_their_nonce_back(self):
+        self.node.reject = lambda sender, nonce: 'insufficient funds' if nonce == 2 else None
+        results = self.service.execute(self.user, self.rows(3))
+
+        self.assertEqual([row['status'] for row in results], ['sent', 'sent', 'failed'])
+        self.assertIsNone(results[2]['tx_hash'])
+        self.assertEqual(Transaction.objects.filter(status=Transaction.FAILED).count(), 1)
+        self.assertEqual(self.counter().next_nonce, 2)
+
+    def test_unanswered_batch_keeps_its_nonces(self):
+        batch = self.node.make_batch_request
+
+        def time_out(calls):
+            if calls[0][0] == 'eth_sendRawTransaction':
+                raise TimeoutError('read timed out')
+            return batch(calls)
+
+        with mock.patch.object(self.node, 'make_batch_request', time_out):
+            results = self.service.execute(self.user, self.rows(3))
+
+        self.assertEqual([row['status'] for row in results], ['unknown'] * 3)
+        # The receipt monitor settles them if the node took them after all
+        self.assertEqual(Transaction.objects.filter(status=Transaction.PENDING).count(), 3)
+        counter = self.counter()
+        self.assertEqual((counter.next_nonce, counter.released, counter.in_flight), (3, [], 0))
+
+        # The next send does not reuse any of them
+        self.assertEqual(NonceManager(self.web3_client).allocate(self.wallet), 3)
+
+    def test_signing_failure_releases_the_nonces(self):
+        with mock.patch('banking.utils.payout_utils.sign_transfers', side_effect=RuntimeError('bad key')):
+            with self.assertRaises(RuntimeError):
+                self.service.execute(self.user, self.rows(3))
+
+        self.assertFalse(Transaction.objects.exists())
+        counter = self.counter()
+        self.assertEqual((counter.next_nonce, counter.released, counter.in_flight), (0, [], 0))
+
+    def test_row_already_indexed_is_kept(self):
+        # The incoming-transfer indexer may have stored the same hash first
+        real_sign = BulkPayoutService._sign
+
+        def sign(service, by_wallet, fees):
+            signed = real_sign(service, by_wallet, fees)
+            _, tx_hash = next(iter(signed.values()))
+            Transaction.objects.create(
+                from_address=self.wallet.address, to_address=self.wallet.address, amount=0, tx_hash=tx_hash
+            )
+            return signed
+
+        with mock.patch.object(BulkPayoutService, '_sign', sign):
+            results = self.service.execute(self.user, self.rows(2))
+        self.assertEqual([row['status'] for row in results], ['sent'] * 2)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class RPCRouterTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('banking.utils.rpc_router.logger')
+        self.logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def nodes(self, count):
+        nodes = [StubNode() for _ in range(count)]
+        for index, node in enumerate(nodes):
+            node.endpoint_uri = f'stub://{index}'
+        return nodes
+
+    def router(self, nodes, **kwargs):
+        kwargs.setdefault('hedge_after', 0)
+        return RoutingHTTPProvider(nodes, **kwargs)
+
+    def wait_until(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("Timed out waiting for the router")
+            time.sleep(0.01)
+
+    def test_latency_is_a_moving_average(self):
+        endpoint = self.router(self.nodes(1), alpha=0.2).endpoints[0]
+        endpoint.record_success(1.0)
+        endpoint.record_success(0.0)
+        self.assertAlmostEqual(endpoint.latency, 0.8)
+
+    def test_fastest_provider_is_ranked_first(self):
+        slow, fast = self.nodes(2)
+        slow.latency = 0.02
+        router = self.router([slow, fast])
+
+        # Unmeasured providers are tried first, then the fastest one is used
+        for _ in range(4):
+            router.make_request('eth_blockNumber', [])
+        self.assertEqual(router.ranked_endpoints()[0].provider, fast)
+        self.assertEqual(slow.calls, ['eth_blockNumber'])
+        self.assertEqual(fast.calls, ['eth_blockNumber'] * 3)
+
+    def test_failing_provider_fails_over_then_is_ejected_and_probed_back(self):
+        flaky, backup = self.nodes(2)
+        flaky.down = True
+        router = self.router([flaky, backup], failure_threshold=2, probe_interval=0.05)
+
+        for _ in range(2):
+            self.assertEqual(router.make_request('eth_blockNumber', [])['result'], hex(100))
+        first, second = router.metrics()
+        self.assertEqual((first['healthy'], first['errors']), (False, 2))
+        self.assertEqual([endpoint.provider for endpoint in router.ranked_endpoints()], [backup])
+
+        self.logger.warning.assert_called_once_with(
+            "Ejecting RPC provider %s after %d failures", 'stub://0', 2
+        )
+
+        flaky.down = False
+        self.wait_until(lambda: router.endpoints[0].healthy)
+        self.assertIn(router.endpoints[0], router.ranked_endpoints())
+
+    def test_every_provider_failing_raises_the_last_error(self):
+        nodes = self.nodes(2)
+        for node in nodes:
+            node.down = True
+        with self.assertRaisesMessage(ConnectionError, 'stub://1 is down'):
+            self.router(nodes).make_request('eth_blockNumber', [])
+
+    def test_throttled_answer_counts_as_a_failure(self):
+        throttled, backup = self.nodes(2)
+        throttled.handle = lambda method, params: {'error': {'code': 429, 'message': 'Too many requests'}}
+        router = self.router([throttled, backup])
+        self.assertEqual(router.make_request('eth_blockNumber', [])['result'], hex(100))
+        self.assertEqual(router.metrics()[0]['errors'], 1)
+
+    def test_writes_are_not_hedged(self):
+        slow, backup = self.nodes(2)
+        slow.latency = 0.1
+        slow.handle = lambda method, params: {'result': '0x' + '00' * 32}
+        router = self.router([slow, backup], hedge_after=0.01)
+        router.make_request('eth_sendRawTransaction', ['0x00'])
+        self.assertEqual(backup.calls, [])
+        self.assertEqual(router.metrics()[1]['hedged'], 0)
+
+    def test_fast_primary_is_not_hedged(self):
+        primary, runner_up = self.nodes(2)
+        router = self.router([primary, runner_up], hedge_after=0.05)
+        router.make_request('eth_blockNumber', [])
+        time.sleep(0.1)
+        self.assertEqual(runner_up.calls, [])
+        self.assertEqual(router.metrics()[1]['hedged'], 0)
+
+    def test_slow_failing_primary_uses_the_hedge_already_sent(self):
+        primary, runner_up = self.nodes(2)
+        primary.latency, primary.down = 0.3, True
+        runner_up.latency = 0.2
+        router = self.router([primary, runner_up], hedge_after=0.05)
+
+        started = time.monotonic()
+        response = router.make_request('eth_blockNumber', [])
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(response['result'], hex(100))
+        self.assertEqual(runner_up.calls, ['eth_blockNumber'])
+        self.assertEqual(router.metrics()[1]['hedged'], 1)
+        # Not the primary's 0.3s plus a fresh 0.2s round trip
+        self.assertLess(elapsed, 0.45)
+
+    def test_primary_runs_on_the_calling_thread(self):
+        primary, runner_up = self.nodes(2)
+        threads = []
+        primary.handle = lambda method, params: threads.append(threading.current_thread()) or {'result': '0x1'}
+        self.router([primary, runner_up], hedge_after=0.5).make_request('eth_blockNumber', [])
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+class AsyncRPCRouterTests(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('banking.utils.rpc_router.logger')
+        self.logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def router(self, count, **kwargs):
+        nodes = RPCRouterTests.nodes(self, count)
+        kwargs.setdefault('hedge_after', 0)
+        router = RoutingHTTPProvider(nodes, **kwargs)
+        return nodes, router, AsyncRoutingHTTPProvider(router, [AsyncStubNode(node) for node in nodes])
+
+    async def test_async_client_reads_through_the_router(self):
+        nodes, router, provider = self.router(2)
+        client = AsyncWeb3Client(provider)
+        self.assertEqual(await client.w3.eth.get_balance(Account.create().address), 10 ** 18)
+        self.assertEqual(router.metrics()[0]['requests'], 1)
+
+    async def test_async_calls_fail_over_and_share_the_router_stats(self):
+        (flaky, backup), router, provider = self.router(2, failure_threshold=1)
+        flaky.down = True
+        response = await provider.make_request('eth_blockNumber', [])
+        self.assertEqual(response['result'], hex(100))
+        first, second = router.metrics()
+        self.assertEqual((first['healthy'], first['errors'], second['requests']), (False, 1, 1))
+        # The sync router skips the provider the async one ejected
+        self.assertEqual([endpoint.provider for endpoint in router.ranked_endpoints()], [backup])
+
+    async def test_async_hedge_takes_the_first_answer(self):
+        (slow, fast), router, provider = self.router(2, hedge_after=0.05)
+        slow.latency = 0.5
+        started = time.monotonic()
+        response = await provider.make_request('eth_blockNumber', [])
+        self.assertEqual(response['result'], hex(100))
+        self.assertLess(time.monotonic() - started, 0.3)
+        self.assertEqual(router.metrics()[1]['hedged'], 1)
+        self.assertEqual(slow.calls, [])
+
+    async def test_async_client_routes_over_the_worker_router(self):
+        router = RoutingHTTPProvider(RPCRouterTests.nodes(self, 2))
+        with mock.patch('banking.utils.web3_utils.get_web3_client', return_value=Web3Client(provider=router)):
+            client = get_async_web3_client()
+        provider = client.w3.provider
+        self.assertIs(provider.router, router)
+        self.assertEqual(
+            [inner.endpoint_uri for inner in provider.providers.values()], ['stub://0', 'stub://1']
+        )
+        self.assertIs(get_async_web3_client(), client)
+        await client.close()
+
+
+class AsyncViewTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client = self.async_web3_client()
+        for patcher in (
+            mock.patch('banking.async_views.get_web3_client', return_value=self.web3_client),
+            mock.patch('banking.async_views.get_async_web3_client', return_value=self.async_client),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.set(Web3Client.CHAIN_HEAD_KEY, 100)
+
+    def request(self, user):
+        request = AsyncRequestFactory().get('/')
+        request._messages = mock.MagicMock()
+
+        async def auser():
+            return user
+        request.auser = auser
+        return request
+
+    async def test_dashboard_reads_missing_snapshots_through_the_async_client(self):
+        user = await sync_to_async(self.create_user)('owner')
+        wallet = await sync_to_async(self.web3_client.create_wallet)(user)
+        response = await async_views.wallet_dashboard(self.request(user))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(wallet.address, response.content.decode())
+        self.assertEqual(self.node.batches, [['eth_getBalance']])
+        snapshot = await WalletBalanceSnapshot.objects.aget(wallet=wallet)
+        self.assertEqual((snapshot.balance, snapshot.block_number), (1, 100))
+
+    async def test_send_page_renders_every_balance(self):
+        user = await sync_to_async(self.create_user)('owner')
+        wallets = [await sync_to_async(self.web3_client.create_wallet)(user) for _ in range(2)]
+        response = await async_views.send_transaction(self.request(user))
+
+        self.assertEqual(response.status_code, 200)
+        for wallet in wallets:
+            self.assertIn(f'{wallet.address} (1.000000 ETH)', response.content.decode())
+
+    async def test_concurrent_dashboards_wait_on_the_node_together(self):
+        self.node.latency = 0.2
+        users = [await sync_to_async(self.create_user)(f'user{index}') for index in range(3)]
+        for user in users:
+            await sync_to_async(self.web3_client.create_wallet)(user)
+
+        started = time.monotonic()
+        responses = await asyncio.gather(*(async_views.wallet_dashboard(self.request(user)) for user in users))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([response.status_code for response in responses], [200] * 3)
+        self.assertEqual(len(self.node.batches), 3)
+        # One balance round trip each, overlapping instead of one after the other
+        self.assertLess(elapsed, 0.45)
+
+    async def test_lifespan_shutdown_closes_the_rpc_session(self):
+        from auth_project.asgi import application
+
+        session = mock.MagicMock(close=mock.AsyncMock())
+        client = AsyncWeb3Client(self.async_client.w3.provider, session)
+        web3_utils._async_clients[asyncio.get_running_loop()] = client
+
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await application({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        session.close.assert_awaited_once()
+        self.assertNotIn(asyncio.get_running_loop(), web3_utils._async_clients)
+
+
+@override_settings(ETH_PRICE_STATIC='2500.5')
+class PriceFeedTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch.object(PriceFeed, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def source(self, **kwargs):
+        source = mock.Mock(fetch=mock.Mock(**kwargs))
+        source.name = 'mock'
+        return source
+
+    def feed(self, *sources):
+        return PriceFeed(sources=list(sources) or [StaticPriceSource()], refresh_interval=30, max_age=3600)
+
+    def test_readers_get_the_stale_price_until_the_refresh_lands(self):
+        feed = self.feed()
+        self.assertIsNone(feed.get_price())
+        cache.set(PriceFeed.CACHE_KEY, {'price': Decimal('1900'), 'source': 'static', 'fetched_at': time.time() - 60})
+
+        # Stale, but still served without a fetch
+        self.assertEqual(feed.get_price(), Decimal('1900'))
+        self.assertEqual(feed.tick(), Decimal('2500.5'))
+        self.assertEqual(feed.get_price(), Decimal('2500.5'))
+
+    def test_fresh_price_is_not_refetched(self):
+        source = self.source(return_value=Decimal('2000'))
+        feed = self.feed(source)
+        feed.tick()
+        cache.delete(PriceFeed.LOCK_KEY)
+        self.assertIsNone(feed.tick())
+        self.assertEqual(source.fetch.call_count, 1)
+
+    def test_next_source_is_used_when_one_fails(self):
+        feed = self.feed(self.source(side_effect=requests.Timeout('timed out')), StaticPriceSource())
+        with self.assertLogs('banking.utils.price_feed', 'WARNING') as logs:
+            self.assertEqual(feed.tick(), Decimal('2500.5'))
+        self.assertIn('ETH price source mock failed: timed out', logs.output[0])
+        self.assertEqual(cache.get(PriceFeed.CACHE_KEY)['source'], 'static')
+
+    def test_one_worker_refreshes_per_interval(self):
+        source = self.source(return_value=Decimal('2000'))
+        feeds = [self.feed(source) for _ in range(5)]
+        self.assertEqual(run_in_threads(len(feeds), lambda index: feeds[index].tick()), [])
+        self.assertEqual(source.fetch.call_count, 1)
+
+    def test_refresher_survives_errors(self):
+        feed = self.feed()
+        with mock.patch.object(feed, 'tick', side_effect=[RuntimeError('cache down'), None]) as tick, \
+                mock.patch('banking.utils.price_feed.time.sleep', side_effect=[None, KeyboardInterrupt]), \
+                self.assertLogs('banking.utils.price_feed', 'ERROR') as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            feed._run()
+        self.assertEqual(tick.call_count, 2)
+        self.assertIn('RuntimeError: cache down', logs.output[0])
+
+
+class ReceiptMonitorLeaseTests(StubNodeMixin, TransactionTestCase):
+    """
+    Several receipt monitors sharing the pending rows through leases
+    """
+    def setUp(self):
+        super().setUp()
+        self.hashes = ['0x%064x' % index for index in range(1, 13)]
+        Transaction.objects.bulk_create([
+            Transaction(from_address='0x' + '11' * 20, to_address='0x' + '22' * 20, amount=1, tx_hash=tx_hash)
+            for tx_hash in self.hashes
+        ])
+
+    def monitor(self, **kwargs):
+        kwargs.setdefault('lease_batch_size', 4)
+        return ReceiptMonitor(web3_client=self.web3_client, lease_ttl=30, **kwargs)
+
+    def owners(self):
+        return dict(Transaction.objects.values_list('tx_hash', 'lease_owner'))
+
+    def test_concurrent_monitors_lease_disjoint_rows(self):
+        monitors = [self.monitor() for _ in range(3)]
+        leased = [None] * len(monitors)
+
+        def lease(index):
+            leased[index] = monitors[index].lease_transactions()
+        self.assertEqual(run_in_threads(len(monitors), lease), [])
+
+        self.assertEqual(sorted(sum(leased, [])), sorted(self.hashes))
+        owners = self.owners()
+        for monitor, hashes in zip(monitors, leased):
+            self.assertEqual(len(hashes), 4)
+            self.assertEqual(set(monitor.pending), set(hashes))
+            self.assertEqual({owners[tx_hash] for tx_hash in hashes}, {monitor.worker_id})
+        # Nothing is left to lease
+        self.assertEqual(self.monitor().lease_transactions(), [])
+
+    def test_monitor_leases_up_to_its_limit(self):
+        monitor = self.monitor(max_leased=6)
+        self.assertEqual(len(monitor.lease_transactions()), 4)
+        self.assertEqual(len(monitor.lease_transactions()), 2)
+        self.assertEqual(monitor.lease_transactions(), [])
+        self.assertEqual(len(self.monitor(lease_batch_size=20).lease_transactions()), 6)
+
+    def test_expired_lease_is_taken_over(self):
+        stalled, other = self.monitor(lease_batch_size=20), self.monitor(lease_batch_size=20)
+        stalled.lease_transactions()
+        self.assertEqual(other.lease_transactions(), [])
+
+        Transaction.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(sorted(other.lease_transactions()), sorted(self.hashes))
+        self.assertEqual(set(self.owners().values()), {other.worker_id})
+
+        # The stalled monitor notices on its next heartbeat and lets them go
+        stalled.heartbeat()
+        self.assertEqual((stalled.pending, stalled.retry), ({}, []))
+
+    def test_heartbeat_extends_the_leases(self):
+        monitor = self.monitor(lease_batch_size=20)
+        monitor.lease_transactions()
+        Transaction.objects.update(lease_expires_at=timezone.now() + timedelta(seconds=5))
+
+        # Not due yet: leases are renewed every lease_ttl / 3
+        monitor.last_heartbeat = timezone.now()
+        monitor.heartbeat()
+        self.assertEqual(self.monitor().lease_transactions(), [])
+        monitor.last_heartbeat -= timedelta(seconds=11)
+        monitor.heartbeat()
+        expiry = Transaction.objects.aggregate(earliest=Min('lease_expires_at'))['earliest']
+        self.assertGreater(expiry, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(len(monitor.pending), len(self.hashes))
+
+    def test_release_hands_the_leases_back(self):
+        monitor = self.monitor(lease_batch_size=20)
+        monitor.lease_transactions()
+        Transaction.objects.filter(tx_hash=self.hashes[0]).update(status=Transaction.COMPLETED)
+
+        monitor.release()
+        self.assertEqual(monitor.pending, {})
+        self.assertFalse(Transaction.objects.filter(status=Transaction.PENDING, lease_owner__isnull=False).exists())
+        self.assertEqual(len(self.monitor(lease_batch_size=20).lease_transactions()), len(self.hashes) - 1)
+
+
+class ReceiptMonitorTickTests(StubNodeMixin, TestCase):
+    """
+    The receipt monitor following StubNode's blocks
+    """
+    def setUp(self):
+        super().setUp()
+        self.sender = self.web3_client.create_wallet(self.create_user('sender'))
+        self.monitor = ReceiptMonitor(web3_client=self.web3_client)
+
+    def pending(self, index):
+        return Transaction.objects.create(
+            from_wallet=self.sender, from_address=self.sender.address, to_address='0x' + '22' * 20,
+            amount=1, tx_hash='0x%064x' % index, nonce=index
+        )
+
+    def mine(self, *transactions, failed=()):
+        """
+        Put ``transactions`` in a new block, the ``failed`` ones reverted
+        """
+        self.node.block_number += 1
+        for tx in transactions + failed:
+            self.node.receipts[tx.tx_hash] = self.node.block_number
+        self.node.failed.update(tx.tx_hash for tx in failed)
+        # The next tick sees the new head
+        cache.delete(Web3Client.CHAIN_HEAD_KEY)
+
+    def test_transactions_settle_from_the_block_they_are_in(self):
+        confirmed, reverted, waiting = self.pending(1), self.pending(2), self.pending(3)
+        self.monitor.tick()
+        self.assertEqual(len(self.monitor.pending), 3)
+
+        self.mine(confirmed, failed=(reverted,))
+        self.monitor.tick()
+
+        for tx in (confirmed, reverted, waiting):
+            tx.refresh_from_db()
+        self.assertEqual((confirmed.status, confirmed.block_number, confirmed.gas_used), (Transaction.COMPLETED, 101, 21000))
+        self.assertEqual(confirmed.block_timestamp.timestamp(), self.node.block_time(101))
+        self.assertIsNone(confirmed.lease_owner)
+        self.assertEqual(reverted.status, Transaction.FAILED)
+        # Still waiting, and still leased by this monitor
+        self.assertEqual((waiting.status, waiting.lease_owner), (Transaction.PENDING, self.monitor.worker_id))
+        self.assertEqual(list(self.monitor.pending), [waiting.tx_hash])
+
+    def test_each_new_block_is_read_once_and_the_head_published(self):
+        tx = self.pending(1)
+        self.monitor.tick()
+        self.assertEqual(cache.get(Web3Client.LATEST_BLOCK_KEY), 100)
+        self.mine()
+        self.mine(tx)
+        self.monitor.tick()
+        self.assertEqual(cache.get(Web3Client.LATEST_BLOCK_KEY), 102)
+        # The block's own timestamp is used, no second lookup for it
+        self.assertEqual(self.node.calls.count('eth_getBlockByNumber'), 2)
+        self.assertEqual(Transaction.objects.get(pk=tx.pk).block_number, 102)
+
+    def test_transaction_mined_before_it_was_leased_is_settled_directly(self):
+        self.monitor.tick()
+        tx = self.pending(1)
+        self.mine(tx)
+        self.mine()
+        cache.set(Web3Client.CHAIN_HEAD_KEY, 100)
+        # The head did not move for this monitor, the lease lookup settles it
+        self.monitor.tick()
+        self.assertEqual(Transaction.objects.get(pk=tx.pk).status, Transaction.COMPLETED)
+
+    def test_only_leased_hashes_get_receipt_lookups(self):
+        self.monitor.tick()
+        stranger = Transaction(tx_hash='0x%064x' % 99)
+        self.mine(stranger)
+        batches = len(self.node.batches)
+        self.monitor.tick()
+        self.assertEqual(self.node.batches[batches:], [])
+
+    def test_failed_receipt_lookup_is_retried(self):
+        tx = self.pending(1)
+        self.monitor.tick()
+        self.mine(tx)
+        receipts = self.web3_client.get_transaction_receipts
+        with mock.patch.object(self.web3_client, 'get_transaction_receipts', side_effect=lambda hashes: {
+            tx_hash: None for tx_hash in hashes
+        }):
+            self.monitor.tick()
+        self.assertEqual(self.monitor.retry, [tx.tx_hash])
+        self.assertEqual(Transaction.objects.get(pk=tx.pk).status, Transaction.PENDING)
+
+        with mock.patch.object(self.web3_client, 'get_transaction_receipts', side_effect=receipts):
+            self.monitor.tick()
+        self.assertEqual(self.monitor.retry, [])
+        self.assertEqual(Transaction.objects.get(pk=tx.pk).status, Transaction.COMPLETED)
+
+    def test_settled_transfer_refreshes_the_snapshots(self):
+        tx = self.pending(1)
+        self.monitor.tick()
+        self.mine(tx)
+        self.monitor.tick()
+        snapshot = WalletBalanceSnapshot.objects.get(wallet=self.sender)
+        self.assertEqual(snapshot.block_number, 101)
+
+
+class IncomingTransferIndexerTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('owner')
+        self.wallet = self.web3_client.create_wallet(self.user)
+        self.outsider = Account.create().address
+        self.indexer = IncomingTransferIndexer(web3_client=self.web3_client, blocks_per_pass=2, confirmations=0)
+        # The first pass starts the checkpoint at the head
+        self.indexer.tick()
+
+    def advance(self, blocks):
+        self.node.block_number += blocks
+        cache.delete(Web3Client.CHAIN_HEAD_KEY)
+
+    def checkpoint(self):
+        return IndexerCheckpoint.objects.get(name=IncomingTransferIndexer.CHECKPOINT).block_number
+
+    def test_transfers_to_our_wallets_are_indexed(self):
+        incoming = [
+            self.node.add_transfer(101, self.outsider, self.wallet.address, 10 ** 18),
+            self.node.add_transfer(103, self.outsider, self.wallet.address, 2 * 10 ** 18),
+        ]
+        self.node.add_transfer(102, self.outsider, Account.create().address, 10 ** 18)
+        self.node.failed.add(incoming[1])
+        self.advance(3)
+        self.indexer.tick()
+
+        self.assertEqual(self.checkpoint(), 103)
+        rows = {tx.tx_hash: tx for tx in Transaction.objects.all()}
+        self.assertEqual(set(rows), set(incoming))
+        first, second = rows[incoming[0]], rows[incoming[1]]
+        self.assertEqual((first.amount, first.from_address, first.to_address), (1, self.outsider, self.wallet.address))
+        self.assertEqual((first.status, first.block_number), (Transaction.COMPLETED, 101))
+        self.assertEqual(first.block_timestamp.timestamp(), self.node.block_time(101))
+        self.assertEqual(second.status, Transaction.FAILED)
+
+    def test_new_wallets_are_picked_up(self):
+        self.advance(1)
+        self.indexer.tick()
+        wallet = self.web3_client.create_wallet(self.user)
+        tx_hash = self.node.add_transfer(102, self.outsider, wallet.address, 10 ** 18)
+        self.advance(1)
+        self.indexer.tick()
+        self.assertEqual(Transaction.objects.get().tx_hash, tx_hash)
+
+    def test_transfer_between_our_wallets_is_not_stored_twice(self):
+        other = self.web3_client.create_wallet(self.create_user('other'))
+        sent = self.web3_client.send_transaction(self.wallet, other.address, 1)
+        self.node.mine()
+        cache.delete(Web3Client.CHAIN_HEAD_KEY)
+        self.indexer.tick()
+
+        self.assertEqual(self.checkpoint(), 101)
+        # The sender's row is kept as it was
+        self.assertEqual(Transaction.objects.get(), sent)
+        self.assertEqual(Transaction.objects.get().from_wallet, self.wallet)
+
+    def test_blocks_wait_for_their_confirmations(self):
+        self.indexer.confirmations = 2
+        self.node.add_transfer(101, self.outsider, self.wallet.address, 10 ** 18)
+        self.advance(2)
+        self.indexer.tick()
+        self.assertFalse(Transaction.objects.exists())
+        self.advance(1)
+        self.indexer.tick()
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_rows_and_checkpoint_are_saved_together(self):
+        self.node.add_transfer(101, self.outsider, self.wallet.address, 10 ** 18)
+        self.node.add_transfer(103, self.outsider, self.wallet.address, 10 ** 18)
+        self.advance(3)
+        save = IndexerCheckpoint.save
+
+        def fail_second_pass(checkpoint, *args, **kwargs):
+            if checkpoint.block_number > 102:
+                raise DatabaseError('disk full')
+            save(checkpoint, *args, **kwargs)
+
+        with mock.patch.object(IndexerCheckpoint, 'save', fail_second_pass):
+            with self.assertRaises(DatabaseError):
+                self.indexer.tick()
+        # The first pass of two blocks committed, the second left nothing behind
+        self.assertEqual(self.checkpoint(), 102)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        self.indexer.tick()
+        self.assertEqual(self.checkpoint(), 103)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class FeeOracleTests(StubNodeMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.oracle = self.fee_oracle()
+
+    def fee_oracle(self):
+        oracle = FeeOracle(self.web3_client, history_blocks=4, priority_percentile=50)
+        oracle.start = lambda: None
+        return oracle
+
+    def new_block(self):
+        self.node.block_number += 1
+        cache.delete(Web3Client.CHAIN_HEAD_KEY)
+
+    def test_fees_follow_the_fee_history(self):
+        self.node.next_base_fee = 3 * 10 ** 10
+        # Blocks without tips don't drag the median down
+        self.node.rewards = [10 ** 9, 3 * 10 ** 9, 0, 2 * 10 ** 9]
+        estimate = self.oracle.refresh()
+        self.assertEqual(estimate['block_number'], 100)
+        self.assertEqual(estimate['base_fee_per_gas'], 3 * 10 ** 10)
+        self.assertEqual(estimate['max_priority_fee_per_gas'], 2 * 10 ** 9)
+        # Room for the base fee to double
+        self.assertEqual(estimate['max_fee_per_gas'], 6 * 10 ** 10 + 2 * 10 ** 9)
+
+    def test_blocks_without_tips_give_no_priority_fee(self):
+        self.node.rewards = [0] * 4
+        estimate = self.oracle.refresh()
+        self.assertEqual((estimate['max_priority_fee_per_gas'], estimate['max_fee_per_gas']), (0, 2 * 10 ** 10))
+
+    def test_estimate_is_refreshed_once_per_block(self):
+        self.oracle.tick()
+        self.oracle.tick()
+        self.assertEqual(self.node.calls.count('eth_feeHistory'), 1)
+        self.new_block()
+        self.oracle.tick()
+        self.assertEqual(self.node.calls.count('eth_feeHistory'), 2)
+        self.assertEqual(self.oracle.get_fees()['block_number'], 101)
+
+    def test_estimate_another_worker_published_is_reused(self):
+        self.oracle.tick()
+        other = self.fee_oracle()
+        other.tick()
+        self.assertEqual(self.node.calls.count('eth_feeHistory'), 1)
+        self.assertEqual(other.get_fees(), self.oracle.get_fees())
+
+    def test_senders_make_no_fee_call_once_warm(self):
+        # Cold start computes the estimate inline
+        self.assertEqual(self.oracle.get_fees()['block_number'], 100)
+        for _ in range(3):
+            self.oracle.get_fees()
+        self.assertEqual(self.node.calls.count('eth_feeHistory'), 1)
+
+        # A stale in-memory estimate falls back to the shared one
+        self.oracle._estimate = dict(self.oracle._estimate, updated_at=0, block_number=1)
+        self.assertEqual(self.oracle.get_fees()['block_number'], 100)
+        self.assertEqual(self.node.calls.count('eth_feeHistory'), 1)
+
+
+class Web3ClientCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(web3_utils._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('banking.utils.web3_utils.Web3Client', side_effect=lambda: object())
+        self.client_class = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_is_reused_within_a_process(self):
+        with mock.patch('banking.utils.web3_utils.os.getpid', return_value=1000):
+            client = web3_utils.get_web3_client()
+            self.assertIs(web3_utils.get_web3_client(), client)
+        self.assertEqual(self.client_class.call_count, 1)
+
+    def test_client_is_rebuilt_after_fork(self):
+        with mock.patch('banking.utils.web3_utils.os.getpid', return_value=1000):
+            parent = web3_utils.get_web3_client()
+        with mock.patch('banking.utils.web3_utils.os.getpid', return_value=1001):
+            child = web3_utils.get_web3_client()
+            self.assertIs(web3_utils.get_web3_client(), child)
+        self.assertIsNot(child, parent)
+        self.assertEqual(self.client_class.call_count, 2)
+        # The parent's client, and its connection pool, is not kept in the child
+        self.assertEqual(list(web3_utils._clients), [1001])
+
+
+class SingleFlightTests(StubNodeMixin, SimpleTestCase):
+    threads = 8
+
+    def wait_for_followers(self, flight):
+        deadline = time.monotonic() + 2
+        while flight.stats()['collapsed'] < self.threads - 1:
+            self.assertLess(time.monotonic(), deadline, "Followers never joined the call")
+            time.sleep(0.01)
+
+    def test_concurrent_identical_calls_share_one_result(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def fetch():
+            calls.append(1)
+            release.wait(2)
+            return object()
+
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.do('receipt:0x1', fetch)))
+            for _ in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        self.wait_for_followers(flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), self.threads)
+        self.assertEqual(len({id(result) for result in results}), 1)
+        self.assertEqual(flight.stats(), {'calls': 8, 'collapsed': 7, 'shared_collapsed': 0, 'in_flight': 0})
+
+    def test_leader_exception_reaches_every_follower(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fetch():
+            release.wait(2)
+            raise ConnectionError('node down')
+
+        def call():
+            try:
+                flight.do('block_number', fetch)
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_followers(flight)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), self.threads)
+        self.assertEqual(len({id(error) for error in errors}), 1)
+        # The failed call is not cached, the next one goes upstream again
+        self.assertEqual(flight.do('block_number', lambda: 100), 100)
+
+    def test_concurrent_receipt_lookups_make_one_rpc_call(self):
+        self.node.latency = 0.2
+        self.node.receipts['0x' + 'ab' * 32] = 100
+        receipts = []
+        errors = run_in_threads(
+            self.threads,
+            lambda index: receipts.append(self.web3_client.get_transaction_receipt('0x' + 'ab' * 32))
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(self.node.calls.count('eth_getTransactionReceipt'), 1)
+        self.assertEqual({receipt['blockNumber'] for receipt in receipts}, {100})
+
+    def test_shared_mode_lets_other_workers_reuse_the_result(self):
+        workers = [SingleFlight(shared=True, shared_ttl=5) for _ in range(2)]
+        calls = []
+        for worker in workers:
+            self.assertEqual(worker.do('block_number', lambda: calls.append(1) or 100), 100)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(workers[1].stats()['shared_collapsed'], 1)
+
+
+class ProductionCacheSettingsTests(SimpleTestCase):
+    def check(self, **environ):
+        env = {key: value for key, value in os.environ.items() if key != 'REDIS_URL'}
+        env.update(environ)
+        return subprocess.run(
+            [sys.executable, 'manage.py', 'check'],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+
+    def test_production_needs_redis(self):
+        result = self.check(DEBUG='0')
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('ImproperlyConfigured: Set REDIS_URL when DEBUG is off', result.stderr)
+
+    def test_production_with_redis_starts(self):
+        result = self.check(DEBUG='0', REDIS_URL='redis://redis:6379/0')
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_debug_falls_back_to_memory(self):
+        self.assertEqual(self.check(DEBUG='1').returncode, 0)
+
+
+class MultiSigVisibilityTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner')
+        self.owner_wallet = self.web3_client.create_wallet(self.owner)
+        self.signer = self.create_user('signer')
+        self.web3_client.create_wallet(self.signer)
+        # Designated through a wallet other than the signer's primary one
+        self.signer_wallet = self.web3_client.create_wallet(self.signer)
+        self.outsider = self.create_user('outsider')
+        self.web3_client.create_wallet(self.outsider)
+        self.manager = MultiSigManager(self.web3_client)
+        self.multisig = self.manager.create_multisig_transaction(
+            self.owner_wallet, '0x' + '22' * 20, 1, 2, signers=[self.signer_wallet]
+        )
+        patcher = mock.patch('banking.views.get_web3_client', return_value=self.web3_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def inbox(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('banking:multisig_inbox_api'))
+        return [multisig['reference'] for multisig in response.json()['multisigs']]
+
+    def test_inbox_only_shows_the_owner_and_the_signers(self):
+        self.assertEqual(self.inbox(self.owner), [self.multisig.reference])
+        self.assertEqual(self.inbox(self.signer), [self.multisig.reference])
+        self.assertEqual(self.inbox(self.outsider), [])
+        self.assertFalse(signable_multisigs(self.outsider).exists())
+
+    def test_detail_is_hidden_from_other_users(self):
+        url = reverse('banking:multisig_detail', args=[self.multisig.reference])
+        self.client.force_login(self.outsider)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.client.force_login(self.signer)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['can_sign'])
+
+    def test_only_the_owner_and_the_signers_can_sign(self):
+        url = reverse('banking:sign_multisig', args=[self.multisig.reference])
+        self.client.force_login(self.outsider)
+        self.client.post(url)
+        self.assertFalse(TransactionSignature.objects.exists())
+        with self.assertRaisesMessage(ValueError, 'not a signer'):
+            self.manager.sign_transaction(self.multisig, Wallet.objects.get(user=self.outsider))
+
+        self.client.force_login(self.signer)
+        self.client.post(url)
+        self.client.force_login(self.owner)
+        self.client.post(url)
+        self.assertEqual(
+            set(TransactionSignature.objects.values_list('signer', flat=True)),
+            {self.signer_wallet.pk, self.owner_wallet.pk}
+        )
+        self.multisig.refresh_from_db()
+        self.assertEqual(self.multisig.status, MultiSigTransaction.APPROVED)
+        self.assertEqual(self.inbox(self.signer), [])
+
+    def test_owner_signs_only_from_the_sending_wallet(self):
+        # Created after the owner's primary wallet, so the view must not pick that one
+        sending_wallet = self.web3_client.create_wallet(self.owner)
+        multisig = self.manager.create_multisig_transaction(
+            sending_wallet, '0x' + '22' * 20, 1, 2, signers=[self.signer_wallet]
+        )
+        with self.assertRaisesMessage(ValueError, 'not a signer'):
+            self.manager.sign_transaction(multisig, self.owner_wallet)
+
+        self.client.force_login(self.owner)
+        self.client.post(reverse('banking:sign_multisig', args=[multisig.reference]))
+        self.assertEqual(
+            list(TransactionSignature.objects.filter(multi_sig_transaction=multisig).values_list('signer', flat=True)),
+            [sending_wallet.pk]
+        )
+        multisig.refresh_from_db()
+        self.assertEqual(multisig.current_signatures, 1)
+
+    def test_one_designated_wallet_per_signer(self):
+        other_wallet = Wallet.objects.filter(user=self.signer).exclude(pk=self.signer_wallet.pk).get()
+        with self.assertRaisesMessage(ValueError, 'one wallet per signer'):
+            self.manager.create_multisig_transaction(
+                self.owner_wallet, '0x' + '22' * 20, 1, 3, signers=[self.signer_wallet, other_wallet]
+            )
+
+    def test_create_checks_the_signers(self):
+        self.client.force_login(self.owner)
+        url = reverse('banking:create_multisig')
+        data = {
+            'from_wallet': self.owner_wallet.address,
+            'to_address': '0x' + '33' * 20,
+            'amount': '0.5',
+            'required_signatures': 2,
+        }
+        for signers in ['0x' + '44' * 20, self.owner_wallet.address, '']:
+            self.client.post(url, {**data, 'signers': signers})
+        self.assertEqual(MultiSigTransaction.objects.count(), 1)
+
+        response = self.client.post(url, {**data, 'signers': self.signer_wallet.address.lower()})
+        created = MultiSigTransaction.objects.latest('id')
+        self.assertRedirects(response, reverse('banking:multisig_detail', args=[created.reference]))
+        self.assertEqual(list(created.designated_signers.all()), [self.signer_wallet])
+
+
+class SnapshotBlockTests(StubNodeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.sender = self.web3_client.create_wallet(self.create_user('sender'))
+        self.recipient = self.web3_client.create_wallet(self.create_user('recipient'))
+
+    def test_settled_transfer_snapshots_its_block(self):
+        tx = self.web3_client.send_transaction(self.sender, self.recipient.address, Decimal('0.25'))
+        # The head is cached before the transfer is mined
+        self.assertEqual(self.web3_client.get_block_number(), 100)
+        self.node.mine()
+        self.node.balances.update({self.sender.address: 75 * 10 ** 16, self.recipient.address: 125 * 10 ** 16})
+
+        monitor = ReceiptMonitor(web3_client=self.web3_client)
+        monitor.block_timestamps[101] = 1700000000
+        monitor.settle(monitor.lease_transactions())
+
+        tx.refresh_from_db()
+        self.assertEqual(tx.block_number, 101)
+        snapshots = {
+            snapshot.wallet_id: snapshot for snapshot in WalletBalanceSnapshot.objects.all()
+        }
+        self.assertEqual(snapshots[self.sender.id].block_number, 101)
+        self.assertEqual(snapshots[self.sender.id].balance, Decimal('0.75'))
+        self.assertEqual(snapshots[self.recipient.id].block_number, 101)
+        self.assertEqual(snapshots[self.recipient.id].balance, Decimal('1.25'))
+
+    def test_refresh_never_reads_behind_the_cached_head(self):
+        self.node.block_number = 105
+        SnapshotService(self.web3_client).refresh_wallets([self.sender], 101)
+        self.assertEqual(WalletBalanceSnapshot.objects.get(wallet=self.sender).block_number, 105)
+
+
+class WorkerLoggingTests(SimpleTestCase):
+    def test_failed_snapshot_refresh_is_logged(self):
+        snapshots = mock.Mock()
+        snapshots.refresh_addresses.side_effect = RuntimeError('node down')
+        with self.assertLogs('banking.tasks', 'WARNING') as logs:
+            refresh_snapshots(snapshots, {'0x' + '11' * 20}, 101)
+        self.assertIn('Error refreshing balance snapshots: node down', logs.output[0])
+
+    def test_worker_loop_errors_are_logged_with_their_traceback(self):
+        executor = MultiSigExecutor(web3_client=mock.Mock())
+        with mock.patch.object(executor, 'tick', side_effect=RuntimeError('node down')), \
+                mock.patch('banking.tasks.time.sleep', side_effect=KeyboardInterrupt), \
+                self.assertLogs('banking.tasks', 'ERROR') as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            executor.run()
+        self.assertIn('Error executing multisig transactions', logs.output[0])
+        self.assertIn('RuntimeError: node down', logs.output[0])
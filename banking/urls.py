@@ -1,16 +1,30 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    # Served by uvicorn workers through auth_project.asgi
+    from . import async_views as rpc_views
+else:
+    rpc_views = views
+
 app_name = 'banking'  # Add namespace
 
 urlpatterns = [
-    path('dashboard/', views.wallet_dashboard, name='wallet_dashboard'),
+    path('dashboard/', rpc_views.wallet_dashboard, name='wallet_dashboard'),
     path('create-wallet/', views.create_wallet, name='create_wallet'),
-    path('send-transaction/', views.send_transaction, name='send_transaction'),
+    path('send-transaction/', rpc_views.send_transaction, name='send_transaction'),
+    path('payouts/', views.bulk_payout, name='bulk_payout'),
+    path('payouts/<str:job_id>/status/', views.bulk_payout_status, name='bulk_payout_status'),
     path('transactions/', views.transaction_history, name='transaction_history'),
-    path('transaction/<str:tx_hash>/', views.transaction_detail, name='transaction_detail'),
+    path('transactions/export/', views.export_transactions, name='export_transactions'),
+    path('api/transactions/', views.transaction_history_api, name='transaction_history_api'),
+    path('transaction/<str:tx_hash>/', rpc_views.transaction_detail, name='transaction_detail'),
     path('multisig/create/', views.create_multisig_transaction, name='create_multisig'),
-    path('multisig/<str:tx_hash>/', views.multisig_detail, name='multisig_detail'),
-    path('multisig/<str:tx_hash>/sign/', views.sign_multisig, name='sign_multisig'),
+    path('multisig/inbox/', views.multisig_inbox, name='multisig_inbox'),
+    path('api/multisig/inbox/', views.multisig_inbox_api, name='multisig_inbox_api'),
+    path('multisig/<str:reference>/', views.multisig_detail, name='multisig_detail'),
+    path('multisig/<str:reference>/sign/', views.sign_multisig, name='sign_multisig'),
     path('balance-proof/', views.generate_balance_proof, name='balance_proof'),
+    path('metrics/', views.rpc_metrics, name='rpc_metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+class BalanceCache:
+    """
+    Wallet balances cached in Django's cache, tagged with the block they were read at
+
+    An entry only counts as a hit while the chain head is still the block it
+    was read at, so a new block (or the TTL running out) makes it stale.
+    """
+    KEY_PREFIX = 'banking:balance:'
+    HITS_KEY = 'banking:balance-cache:hits'
+    MISSES_KEY = 'banking:balance-cache:misses'
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or settings.BALANCE_CACHE_TTL
+
+    def _key(self, address):
+        return f"{self.KEY_PREFIX}{address.lower()}"
+
+    def _hits(self, addresses, entries, block_number):
+        hits = {}
+        for address in addresses:
+            entry = entries.get(self._key(address))
+            if entry is not None and entry['block_number'] == block_number:
+                hits[address] = entry['balance']
+        return hits
+
+    def get_many(self, addresses, block_number):
+        """
+        Return {address: balance} for the addresses cached at ``block_number``
+        """
+        addresses = list(addresses)
+        entries = cache.get_many([self._key(address) for address in addresses])
+        hits = self._hits(addresses, entries, block_number)
+        self._count(self.HITS_KEY, len(hits))
+        self._count(self.MISSES_KEY, len(addresses) - len(hits))
+        return hits
+
+    async def aget_many(self, addresses, block_number):
+        addresses = list(addresses)
+        entries = await cache.aget_many([self._key(address) for address in addresses])
+        hits = self._hits(addresses, entries, block_number)
+        await self._acount(self.HITS_KEY, len(hits))
+        await self._acount(self.MISSES_KEY, len(addresses) - len(hits))
+        return hits
+
+    def get(self, address, block_number):
+        return self.get_many([address], block_number).get(address)
+
+    def set_many(self, balances, block_number):
+        cache.set_many({
+            self._key(address): {'balance': balance, 'block_number': block_number}
+            for address, balance in balances.items()
+        }, self.timeout)
+
+    async def aset_many(self, balances, block_number):
+        await cache.aset_many({
+            self._key(address): {'balance': balance, 'block_number': block_number}
+            for address, balance in balances.items()
+        }, self.timeout)
+
+    def set(self, address, balance, block_number):
+        self.set_many({address: balance}, block_number)
+
+    def invalidate(self, *addresses):
+        """
+        Drop cached balances, e.g. after a wallet sends or receives funds
+        """
+        cache.delete_many([self._key(address) for address in addresses if address])
+
+    def _count(self, key, amount):
+        if not amount:
+            return
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            # Counter not created yet (or evicted)
+            cache.add(key, 0, None)
+            cache.incr(key, amount)
+
+    async def _acount(self, key, amount):
+        if not amount:
+            return
+        try:
+            await cache.aincr(key, amount)
+        except ValueError:
+            await cache.aadd(key, 0, None)
+            await cache.aincr(key, amount)
+
+    def stats(self):
+        """
+        Hit/miss counters shared by every worker using the same cache
+        """
+        counters = cache.get_many([self.HITS_KEY, self.MISSES_KEY])
+        hits = counters.get(self.HITS_KEY, 0)
+        misses = counters.get(self.MISSES_KEY, 0)
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+        }
+
+    def reset_stats(self):
+        cache.delete_many([self.HITS_KEY, self.MISSES_KEY])
+
+
+balance_cache = BalanceCache()
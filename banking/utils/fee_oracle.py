@@ -0,0 +1,99 @@
+import logging
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class FeeOracle:
+    """
+    EIP-1559 fee estimates refreshed in the background once per new block
+
+    ``maxPriorityFeePerGas`` is the median of the configured reward percentile
+    over the last ``history_blocks`` blocks of ``eth_feeHistory``.
+    ``maxFeePerGas`` leaves room for the base fee to double before the
+    transaction is mined. Senders read the last estimate from memory or from
+    the shared cache, so no fee RPC happens on the request path.
+    """
+    CACHE_KEY = 'banking:fee-estimate'
+
+    def __init__(self, web3_client, poll_interval=None, history_blocks=None,
+                 priority_percentile=None):
+        self.web3_client = web3_client
+        self.poll_interval = poll_interval or settings.FEE_ORACLE_POLL_INTERVAL
+        self.history_blocks = history_blocks or settings.FEE_HISTORY_BLOCKS
+        self.priority_percentile = priority_percentile or settings.FEE_PRIORITY_PERCENTILE
+        self._estimate = None
+        self.last_block = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Recompute the estimate from eth_feeHistory and publish it
+        """
+        history = self.web3_client.w3.eth.fee_history(
+            self.history_blocks, 'latest', [self.priority_percentile]
+        )
+        # The last entry is the base fee of the next (pending) block
+        next_base_fee = history['baseFeePerGas'][-1]
+        rewards = [reward[0] for reward in history['reward'] if reward and reward[0] > 0]
+        priority_fee = int(statistics.median(rewards)) if rewards else 0
+
+        self._estimate = {
+            'block_number': history['oldestBlock'] + len(history['reward']) - 1,
+            'base_fee_per_gas': next_base_fee,
+            'max_priority_fee_per_gas': priority_fee,
+            'max_fee_per_gas': 2 * next_base_fee + priority_fee,
+            'updated_at': time.time(),
+        }
+        cache.set(self.CACHE_KEY, self._estimate, settings.FEE_ESTIMATE_MAX_AGE)
+        return self._estimate
+
+    def get_fees(self):
+        """
+        Latest estimate; only computed inline on a cold start
+        """
+        self.start()
+        estimate = self._estimate
+        if estimate is None or time.time() - estimate['updated_at'] > settings.FEE_ESTIMATE_MAX_AGE:
+            estimate = cache.get(self.CACHE_KEY)
+        if estimate is None:
+            estimate = self.refresh()
+        return estimate
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='fee-oracle', daemon=True
+                )
+                self._thread.start()
+
+    def tick(self):
+        """
+        Refresh the estimate once per new block, unless another worker already published it
+        """
+        block_number = self.web3_client.get_block_number()
+        if block_number == self.last_block:
+            return
+        shared = cache.get(self.CACHE_KEY)
+        if shared is not None and shared['block_number'] >= block_number:
+            self._estimate = shared
+        else:
+            self.refresh()
+        self.last_block = block_number
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning("Fee oracle refresh failed: %s", e)
+            time.sleep(self.poll_interval)
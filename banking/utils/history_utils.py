@@ -0,0 +1,140 @@
+import base64
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from banking.models import Transaction
+
+
+def encode_cursor(transaction):
+    """
+    Opaque cursor pointing just past ``transaction`` in newest-first order
+    """
+    raw = f"{transaction.created_at.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (created_at, id) a cursor points past, raising ValueError if it is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def history_page(wallets, cursor=None, limit=50):
+    """
+    One newest-first page of the transactions sent or received by ``wallets``
+
+    Sent and received transactions are read by two separate keyset queries,
+    each ordered on (created_at, id) and walking its own
+    (from_wallet, created_at, id) or (to_address, created_at, id) index,
+    then merged. Each query reads at most ``limit + 1`` rows, so a page
+    costs the same however deep it is. Returns (transactions, next_cursor),
+    with next_cursor None on the last page.
+    """
+    wallets = list(wallets)
+    branches = [
+        Transaction.objects.filter(from_wallet__in=wallets),
+        Transaction.objects.filter(to_address__in=[wallet.address for wallet in wallets]),
+    ]
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        after_cursor = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        branches = [branch.filter(after_cursor) for branch in branches]
+
+    # A transfer between two of the user's wallets shows up in both branches
+    merged = {}
+    for branch in branches:
+        for transaction in branch.order_by('-created_at', '-id')[:limit + 1]:
+            merged[transaction.id] = transaction
+    transactions = sorted(
+        merged.values(),
+        key=lambda transaction: (transaction.created_at, transaction.id),
+        reverse=True
+    )
+
+    page = transactions[:limit]
+    next_cursor = encode_cursor(page[-1]) if len(transactions) > limit else None
+    return page, next_cursor
+
+
+EXPORT_COLUMNS = [
+    'created_at', 'tx_hash', 'from_address', 'to_address', 'amount',
+    'gas_price', 'gas_used', 'status', 'block_number', 'block_timestamp',
+]
+
+
+class _Echo:
+    """
+    File-like object whose write() hands the line back instead of buffering it
+    """
+    def write(self, value):
+        return value
+
+
+def export_rows(wallets, start=None, end=None, chunk_size=2000):
+    """
+    Stream EXPORT_COLUMNS tuples of the wallets' transactions, oldest first
+
+    Rows come from a server-side cursor ``chunk_size`` at a time, so memory
+    stays flat however long the history is. ``start`` is inclusive and
+    ``end`` exclusive.
+    """
+    wallets = list(wallets)
+    transactions = Transaction.objects.filter(
+        Q(from_wallet__in=wallets) | Q(to_address__in=[wallet.address for wallet in wallets])
+    )
+    if start is not None:
+        transactions = transactions.filter(created_at__gte=start)
+    if end is not None:
+        transactions = transactions.filter(created_at__lt=end)
+    return transactions.order_by('created_at', 'id').values_list(
+        *EXPORT_COLUMNS
+    ).iterator(chunk_size=chunk_size)
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow([_export_value(value) for value in row])
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_value, row)))) + '\n'
+
+
+async def aiter_lines(lines, batch_size=2000):
+    """
+    Async iterator over a sync line generator, ``batch_size`` lines per thread hop
+
+    ASGI servers drain a sync iterator into memory before sending it, so
+    exports served over ASGI go through this instead. The generator, and the
+    database cursor behind it, always advance on the request's sync thread.
+    """
+    lines = iter(lines)
+    next_batch = sync_to_async(lambda: list(islice(lines, batch_size)), thread_sensitive=True)
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        yield ''.join(batch)
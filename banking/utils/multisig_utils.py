@@ -1,56 +1,287 @@
+from banking.models import MultiSigExecution
 from banking.models import MultiSigTransaction
+from banking.models import Transaction
 from banking.models import TransactionSignature
-from eth_account.messages import encode_defunct
+from banking.models import Wallet
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import BooleanField, Case, Exists, ExpressionWrapper, F, OuterRef, Q, Value, When
+from django.utils import timezone
+from .signing_utils import recover_signers, recover_signers_job
+
+
+def signer_of(user):
+    """
+    Filter for multisigs ``user`` may see and sign: their own, or ones
+    that designate one of their wallets
+    """
+    return Q(transaction__from_wallet__user=user) | Q(Exists(
+        Wallet.objects.filter(user=user, designated_multisigs=OuterRef('pk'))
+    ))
+
+
+def signable_multisigs(user):
+    """
+    Open multi-signature transactions ``user`` may sign and has not signed yet, soonest to expire first
+
+    A single query: the open filter walks the partial index on open
+    multisigs, multisigs the user neither owns nor is designated on are
+    dropped, the user's signatures are checked with NOT EXISTS, and the
+    underlying transaction is joined in. Each row carries a
+    ``remaining_signatures`` annotation. Rows past their expiry that the
+    sweeper has not reached yet are skipped too.
+    """
+    already_signed = TransactionSignature.objects.filter(
+        multi_sig_transaction=OuterRef('pk'),
+        signer__user=user
+    )
+    return MultiSigTransaction.objects.filter(
+        status=MultiSigTransaction.OPEN,
+        expires_at__gt=timezone.now()
+    ).filter(
+        signer_of(user),
+        ~Exists(already_signed)
+    ).annotate(
+        remaining_signatures=F('required_signatures') - F('current_signatures')
+    ).select_related('transaction').order_by('expires_at', 'id')
+
+
+def multisig_for_signer(user, reference):
+    """
+    The multisig with ``reference`` and its transaction, annotated with
+    whether ``user`` may sign it and has already signed, in one query
+    """
+    return MultiSigTransaction.objects.filter(
+        reference=reference
+    ).annotate(
+        is_signer=ExpressionWrapper(signer_of(user), output_field=BooleanField()),
+        has_signed=Exists(TransactionSignature.objects.filter(
+            multi_sig_transaction=OuterRef('pk'),
+            signer__user=user
+        ))
+    ).select_related('transaction', 'execution')
+
+
+def expire_multisigs(batch_size=1000, purge_signatures=False):
+    """
+    Mark open multisigs past their expiry as expired, ``batch_size`` rows per UPDATE
+
+    Due rows are found through the partial index on open multisigs, so each
+    batch is a short index range scan and a short write. With
+    ``purge_signatures`` the signatures of each expired batch are deleted
+    as well, otherwise they are kept as the record of who approved.
+    Returns the number of multisigs expired.
+    """
+    now = timezone.now()
+    expired = 0
+    while True:
+        ids = list(
+            MultiSigTransaction.objects.filter(
+                status=MultiSigTransaction.OPEN,
+                expires_at__lte=now
+            ).order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return expired
+        # Re-checking the status leaves a row a late signer approved alone
+        expired += MultiSigTransaction.objects.filter(
+            id__in=ids,
+            status=MultiSigTransaction.OPEN
+        ).update(status=MultiSigTransaction.EXPIRED)
+        # Their transfers will never be sent
+        Transaction.objects.filter(
+            multisigtransaction__id__in=ids,
+            multisigtransaction__status=MultiSigTransaction.EXPIRED,
+            status=Transaction.QUEUED
+        ).update(status=Transaction.FAILED)
+        if purge_signatures:
+            TransactionSignature.objects.filter(
+                multi_sig_transaction_id__in=ids,
+                multi_sig_transaction__status=MultiSigTransaction.EXPIRED
+            ).delete()
+
+
+def signature_message(reference, address):
+    """
+    Text a signer signs to approve the multisig with ``reference``
+    """
+    return f"{reference}:{address}"
+
+
+def verify_signatures(signatures):
+    """
+    Recover the signer of every signature in one pass and store the outcome
+
+    ``signatures`` must come with select_related('signer',
+    'multi_sig_transaction'). Sets of at least
+    SIGNATURE_PROCESS_POOL_MIN_SIZE are recovered in a pool of
+    SIGNATURE_VERIFY_PROCESSES processes, SIGNATURE_VERIFY_CHUNK_SIZE per
+    task. Results are written with one bulk update, so each signature is
+    recovered once and pages only read the stored ``verified`` flag.
+    """
+    signatures = list(signatures)
+    items = [
+        (
+            signature_message(sig.multi_sig_transaction.reference, sig.signer.address),
+            sig.signature
+        )
+        for sig in signatures
+    ]
+    chunk_size = settings.SIGNATURE_VERIFY_CHUNK_SIZE
+    chunks = [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+    if len(items) >= settings.SIGNATURE_PROCESS_POOL_MIN_SIZE and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=settings.SIGNATURE_VERIFY_PROCESSES) as executor:
+            recovered = [address for chunk in executor.map(recover_signers_job, chunks) for address in chunk]
+    else:
+        recovered = recover_signers(items)
+
+    for sig, address in zip(signatures, recovered):
+        sig.recovered_address = address
+        sig.verified = address is not None and address.lower() == sig.signer.address.lower()
+    TransactionSignature.objects.bulk_update(signatures, ['recovered_address', 'verified'])
+    return signatures
+
+
+def verify_pending_signatures(batch_size=1000):
+    """
+    Verify every signature the verifier has not checked yet, ``batch_size`` at a time
+
+    Returns (verified, invalid) counts.
+    """
+    verified = invalid = 0
+    last_id = 0
+    while True:
+        batch = list(
+            TransactionSignature.objects.filter(
+                verified__isnull=True,
+                id__gt=last_id
+            ).select_related(
+                'signer', 'multi_sig_transaction'
+            ).order_by('id')[:batch_size]
+        )
+        if not batch:
+            return verified, invalid
+        for sig in verify_signatures(batch):
+            if sig.verified:
+                verified += 1
+            else:
+                invalid += 1
+        last_id = batch[-1].id
+
+
 class MultiSigManager:
     def __init__(self, web3_client):
         self.web3_client = web3_client
     
 
 
-    def create_multisig_transaction(self, transaction, required_signatures, expires_in_hours=24):
+    def create_multisig_transaction(self, from_wallet, to_address, amount_ether,
+                                    required_signatures, expires_in_hours=24, signers=()):
         """
         Create a multi-signature transaction that requires multiple approvals
+
+        ``signers`` are the other users' wallets asked to approve it besides
+        the owner. The transfer is only recorded as queued; nothing is
+        signed or sent until the last approval hands it to the execution
+        queue.
         """
         from django.utils import timezone
         from datetime import timedelta
         
-        return MultiSigTransaction.objects.create(
-            transaction=transaction,
-            required_signatures=required_signatures,
-            expires_at=timezone.now() + timedelta(hours=expires_in_hours)
-        )
+        signers = set(signers)
+        if any(wallet.user_id == from_wallet.user_id for wallet in signers):
+            raise ValueError("Designated signers must be other users' wallets")
+        # With the owner signing only from the sending wallet, every user signs once
+        if len({wallet.user_id for wallet in signers}) < len(signers):
+            raise ValueError("Designate one wallet per signer")
+        if required_signatures > len(signers) + 1:
+            raise ValueError(
+                f"{required_signatures} signatures required but only {len(signers) + 1} signers"
+            )
+
+        with db_transaction.atomic():
+            transaction = Transaction.objects.create(
+                from_wallet=from_wallet,
+                from_address=from_wallet.address,
+                to_address=to_address,
+                amount=amount_ether,
+                status=Transaction.QUEUED
+            )
+            multi_sig_tx = MultiSigTransaction.objects.create(
+                transaction=transaction,
+                required_signatures=required_signatures,
+                expires_at=timezone.now() + timedelta(hours=expires_in_hours)
+            )
+            multi_sig_tx.designated_signers.set(signers)
+            return multi_sig_tx
     
     def sign_transaction(self, multi_sig_tx, signer_wallet):
         """
         Add a signature to a multi-signature transaction
+
+        The signature is stored and counted in one database transaction. The
+        count is bumped by a conditional UPDATE that re-checks the threshold
+        and expiry, so concurrent signers can never push it past
+        required_signatures, and a second signature from the same wallet is
+        rejected by the unique constraint. Only the sending wallet and the
+        designated wallets may sign. The approving signature queues the
+        transfer for the executor in the same transaction, unless it is no
+        longer queued.
         """
-        # Verify signer hasn't already signed
-        if TransactionSignature.objects.filter(
-            multi_sig_transaction=multi_sig_tx,
-            signer=signer_wallet
-        ).exists():
-            raise ValueError("Wallet has already signed this transaction")
-        
-        # Create signature
-        message = f"{multi_sig_tx.transaction.tx_hash}:{signer_wallet.address}"
-        signature = self.web3_client.w3.eth.account.sign_message(
-            encode_defunct(text=message),
-            private_key=self.web3_client.fernet.decrypt(
-                signer_wallet.encrypted_private_key.encode()
-            ).decode()
-        )
-        
-        # Save signature
-        TransactionSignature.objects.create(
-            multi_sig_transaction=multi_sig_tx,
-            signer=signer_wallet,
-            signature=signature.signature.hex()
+        allowed = MultiSigTransaction.objects.filter(pk=multi_sig_tx.pk).filter(
+            Q(transaction__from_wallet=signer_wallet) |
+            Q(designated_signers=signer_wallet)
         )
-        
-        # Update signature count
-        multi_sig_tx.current_signatures = TransactionSignature.objects.filter(
-            multi_sig_transaction=multi_sig_tx
-        ).count()
-        multi_sig_tx.save()
-        
-        return multi_sig_tx.current_signatures >= multi_sig_tx.required_signatures
\ No newline at end of file
+        if not allowed.exists():
+            raise ValueError("Wallet is not a signer of this transaction")
+
+        # Create signature before taking any locks
+        message = signature_message(multi_sig_tx.reference, signer_wallet.address)
+        signature = self.web3_client.sign_message(signer_wallet, message)
+
+        with db_transaction.atomic():
+            try:
+                with db_transaction.atomic():
+                    TransactionSignature.objects.create(
+                        multi_sig_transaction=multi_sig_tx,
+                        signer=signer_wallet,
+                        signature=signature
+                    )
+            except IntegrityError:
+                raise ValueError("Wallet has already signed this transaction")
+
+            # Update signature count, approving on the last one and rolling
+            # the signature back if the transaction filled up or expired in
+            # the meantime
+            updated = MultiSigTransaction.objects.filter(
+                pk=multi_sig_tx.pk,
+                status=MultiSigTransaction.OPEN,
+                current_signatures__lt=F('required_signatures'),
+                expires_at__gt=timezone.now()
+            ).update(
+                current_signatures=F('current_signatures') + 1,
+                status=Case(
+                    When(
+                        current_signatures__gte=F('required_signatures') - 1,
+                        then=Value(MultiSigTransaction.APPROVED)
+                    ),
+                    default=Value(MultiSigTransaction.OPEN)
+                )
+            )
+            if not updated:
+                raise ValueError("Transaction is expired or already has the required signatures")
+            multi_sig_tx.refresh_from_db(fields=['current_signatures', 'status'])
+            # Multisigs from before the execution queue were broadcast when
+            # they were created, only a still queued transfer is handed over
+            if multi_sig_tx.status == MultiSigTransaction.APPROVED and Transaction.objects.filter(
+                pk=multi_sig_tx.transaction_id,
+                status=Transaction.QUEUED
+            ).exists():
+                MultiSigExecution.objects.create(
+                    multisig=multi_sig_tx,
+                    next_attempt_at=timezone.now()
+                )
+
+        return multi_sig_tx.status == MultiSigTransaction.APPROVED
\ No newline at end of file
@@ -0,0 +1,171 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from banking.models import WalletNonce
+
+
+def is_nonce_too_low(error):
+    message = str(error).lower()
+    return 'nonce too low' in message or 'nonce is too low' in message
+
+
+class NonceManager:
+    """
+    Hands out wallet nonces from a locked per-wallet counter row
+
+    The counter is seeded from the chain the first time a wallet sends.
+    Every allocation stays outstanding until the sender reports it ``sent``
+    or ``release``s it. Released nonces the counter cannot simply step back
+    over are handed out again before new ones, so a failed send never leaves
+    a gap that later transfers wait behind. The chain is only asked again on
+    "nonce too low", and every NONCE_RESYNC_INTERVAL seconds while nothing
+    is outstanding, so the send path normally makes no
+    eth_getTransactionCount call.
+    """
+    def __init__(self, web3_client, allocation_timeout=None, resync_interval=None):
+        self.web3_client = web3_client
+        self.allocation_timeout = timedelta(
+            seconds=allocation_timeout or settings.NONCE_ALLOCATION_TIMEOUT
+        )
+        self.resync_interval = timedelta(seconds=resync_interval or settings.NONCE_RESYNC_INTERVAL)
+
+    def _chain_nonce(self, wallet):
+        # 'pending' also counts transactions still sitting in the mempool
+        return self.web3_client.w3.eth.get_transaction_count(wallet.address, 'pending')
+
+    def _counter(self, wallet):
+        counter = WalletNonce.objects.filter(wallet=wallet).first()
+        if counter is None:
+            counter, _ = WalletNonce.objects.get_or_create(
+                wallet=wallet,
+                defaults={
+                    'next_nonce': self._chain_nonce(wallet),
+                    'synced_at': timezone.now(),
+                }
+            )
+        return counter
+
+    def _settled(self, counter, now):
+        """
+        Whether nothing is outstanding and the last send had time to reach every node
+        """
+        if counter.allocated_at is None:
+            return True
+        if counter.allocated_at < now - self.allocation_timeout:
+            # Allocations a crashed sender never reported stop counting
+            return True
+        return counter.in_flight <= 0 and counter.allocated_at < now - self.resync_interval
+
+    def allocate(self, wallet):
+        """
+        Reserve one nonce for ``wallet``
+        """
+        return self.allocate_many(wallet, 1)[0]
+
+    def allocate_many(self, wallet, count):
+        """
+        Reserve ``count`` nonces for ``wallet``, released ones first, in increasing order
+        """
+        counter = self._counter(wallet)
+        now = timezone.now()
+        if counter.synced_at < now - self.resync_interval and self._settled(counter, now):
+            self.resync(wallet)
+
+        # Bump first and read back inside one transaction: the UPDATE takes the
+        # row lock up front, which also works on SQLite where a locking read
+        # followed by a write deadlocks between concurrent senders
+        with transaction.atomic():
+            WalletNonce.objects.filter(wallet=wallet).update(
+                in_flight=F('in_flight') + count,
+                allocated_at=now,
+                updated_at=now
+            )
+            counter = WalletNonce.objects.get(wallet=wallet)
+            released = sorted(counter.released)
+            nonces = released[:count]
+            fresh = count - len(nonces)
+            nonces.extend(range(counter.next_nonce, counter.next_nonce + fresh))
+            WalletNonce.objects.filter(wallet=wallet).update(
+                next_nonce=counter.next_nonce + fresh,
+                released=released[count:]
+            )
+        return nonces
+
+    def sent(self, wallet, count=1):
+        """
+        Report that ``count`` allocated nonces reached the node
+        """
+        if count:
+            WalletNonce.objects.filter(wallet=wallet).update(
+                in_flight=Greatest(F('in_flight') - count, 0),
+                updated_at=timezone.now()
+            )
+
+    def release(self, wallet, nonce, count=1):
+        """
+        Give back nonces that never reached the node, to be handed out again
+        """
+        with transaction.atomic():
+            WalletNonce.objects.filter(wallet=wallet).update(
+                in_flight=Greatest(F('in_flight') - count, 0),
+                updated_at=timezone.now()
+            )
+            counter = WalletNonce.objects.get(wallet=wallet)
+            released = set(counter.released) | set(range(nonce, nonce + count))
+            # Step the counter back over released nonces at its top
+            next_nonce = counter.next_nonce
+            while next_nonce - 1 in released:
+                next_nonce -= 1
+                released.discard(next_nonce)
+            WalletNonce.objects.filter(wallet=wallet).update(
+                next_nonce=next_nonce,
+                released=sorted(released)
+            )
+
+    def resync(self, wallet):
+        """
+        Reconcile the counter with the chain's pending transaction count
+
+        A chain ahead of the counter moves it forward. A chain behind it has
+        a gap at its pending count: a nonce that never reached the node, or a
+        send still on its way. Only once nothing is outstanding and the last
+        send is NONCE_RESYNC_INTERVAL old is that nonce taken to be lost and
+        handed out again, and only if the counter did not change while the
+        chain was asked. The counter never moves back, so no nonce is handed
+        out twice.
+        """
+        counter = self._counter(wallet)
+        chain_nonce = self._chain_nonce(wallet)
+        now = timezone.now()
+        settled = self._settled(counter, now)
+        changes = {'synced_at': now, 'updated_at': now}
+        if chain_nonce >= counter.next_nonce:
+            changes.update(next_nonce=chain_nonce, released=[])
+        else:
+            # Released nonces below the chain's count were used after all
+            released = {nonce for nonce in counter.released if nonce >= chain_nonce}
+            if settled:
+                released.add(chain_nonce)
+            changes['released'] = sorted(released)
+        if settled:
+            changes['in_flight'] = 0
+
+        # Every allocate, send report and release changes one of these
+        updated = WalletNonce.objects.filter(
+            wallet=wallet,
+            next_nonce=counter.next_nonce,
+            in_flight=counter.in_flight,
+            allocated_at=counter.allocated_at
+        ).update(**changes)
+        if not updated and chain_nonce > counter.next_nonce:
+            # Raced with a sender; moving forward is safe regardless
+            WalletNonce.objects.filter(wallet=wallet, next_nonce__lt=chain_nonce).update(
+                next_nonce=chain_nonce,
+                synced_at=now,
+                updated_at=now
+            )
+        return chain_nonce
@@ -0,0 +1,350 @@
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from web3 import Web3
+
+from banking.forms import TransactionForm
+from banking.models import Transaction, Wallet
+from .balance_cache import balance_cache
+from .nonce_utils import NonceManager, is_nonce_too_low
+from .signing_utils import sign_transfers, sign_transfers_job
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _shared_executor(name, factory):
+    """
+    One executor per ``name`` and worker process, keyed by pid like the web3 clients
+    """
+    key = (name, os.getpid())
+    executor = _executors.get(key)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(key)
+            if executor is None:
+                executor = _executors[key] = factory()
+    return executor
+
+
+def get_signing_pool():
+    """
+    Process pool signing large payouts, shared by every payout of this worker process
+
+    Its processes are started from a forkserver (spawned where there is
+    none) once, instead of forking the threaded web worker on every payout.
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return _shared_executor('signing', lambda: ProcessPoolExecutor(
+        max_workers=settings.PAYOUT_SIGNING_PROCESSES,
+        mp_context=multiprocessing.get_context(method)
+    ))
+
+
+def get_payout_runner():
+    """
+    Threads running payouts off the request, PAYOUT_WORKERS at a time per worker process
+    """
+    return _shared_executor('runner', lambda: ThreadPoolExecutor(
+        max_workers=settings.PAYOUT_WORKERS,
+        thread_name_prefix='payout'
+    ))
+
+
+class BulkPayoutService:
+    """
+    Validate, sign and broadcast a list of (from_wallet, to_address, amount) payouts
+
+    Keys are decrypted once per wallet, signing is spread over a process pool
+    for large lists, and the signed transactions go out as batched
+    eth_sendRawTransaction calls. ``start`` runs the payout in the background;
+    progress, and the per-row results once done, are published in the cache
+    under the user and ``job_id`` so the user can poll them.
+    """
+    PROGRESS_KEY = 'banking:payout:{user_id}:{job_id}'
+
+    def __init__(self, web3_client, job_id=None):
+        self.web3_client = web3_client
+        self.job_id = job_id
+        self.user = None
+        self.progress = {
+            'status': 'validating',
+            'total': 0,
+            'valid': 0,
+            'signed': 0,
+            'broadcast': 0,
+            'unknown': 0,
+            'failed': 0,
+        }
+
+    @classmethod
+    def get_progress(cls, user, job_id):
+        """
+        Progress of ``user``'s payout ``job_id``, None for jobs of other users
+        """
+        return cache.get(cls.PROGRESS_KEY.format(user_id=user.pk, job_id=job_id))
+
+    def _report(self, **changes):
+        self.progress.update(changes)
+        if self.job_id:
+            cache.set(
+                self.PROGRESS_KEY.format(user_id=self.user.pk, job_id=self.job_id),
+                self.progress,
+                3600
+            )
+
+    def start(self, user, rows):
+        """
+        Queue the payout on the payout runner and return its future
+        """
+        self.user = user
+        self._report(status='queued', total=len(rows))
+        return get_payout_runner().submit(self._run, user, rows)
+
+    def _run(self, user, rows):
+        try:
+            results = self.execute(user, rows)
+            self._report(results=results)
+            return results
+        except Exception as e:
+            self._report(status='failed', error=str(e))
+            raise
+        finally:
+            # Runner threads outlive the request that queued them
+            connections.close_all()
+
+    def validate(self, user, rows):
+        """
+        Check every row with the TransactionForm rules and resolve its wallet
+
+        Returns one result dict per row; rows that passed have a ``wallet``.
+        """
+        wallets = {
+            wallet.address.lower(): wallet
+            for wallet in Wallet.objects.filter(user=user)
+        }
+        results = []
+        for index, row in enumerate(rows, start=1):
+            result = {
+                'row': index,
+                'from_wallet': row.get('from_wallet', ''),
+                'to_address': row.get('to_address', ''),
+                'amount': row.get('amount', ''),
+                'status': 'invalid',
+                'tx_hash': None,
+                'error': None,
+            }
+            form = TransactionForm({'to_address': result['to_address'], 'amount': result['amount']})
+            wallet = wallets.get(str(result['from_wallet']).lower())
+            if wallet is None:
+                result['error'] = "Unknown wallet"
+            elif not form.is_valid():
+                result['error'] = '; '.join(
+                    f"{field}: {' '.join(errors)}" for field, errors in form.errors.items()
+                )
+            else:
+                result.update({
+                    'wallet': wallet,
+                    'to_address': form.cleaned_data['to_address'],
+                    'amount': form.cleaned_data['amount'],
+                    'status': 'valid',
+                })
+            results.append(result)
+        return results
+
+    def _check_balances(self, by_wallet):
+        balances = self.web3_client.get_balances([wallet.address for wallet in by_wallet])
+        for wallet, rows in list(by_wallet.items()):
+            balance = balances[wallet.address]
+            total = sum((row['amount'] for row in rows), Decimal('0'))
+            error = balance['error'] or (
+                "Insufficient balance" if balance['balance'] < total else None
+            )
+            if error:
+                for row in rows:
+                    row.update({'status': 'failed', 'error': error})
+                del by_wallet[wallet]
+
+    def _sign(self, by_wallet, fees):
+        """
+        Sign every row of every wallet, returning {row index: (raw_tx, tx_hash)}
+
+        If allocating or signing fails, every nonce allocated so far is
+        released before the error propagates.
+        """
+        nonce_manager = NonceManager(self.web3_client)
+        allocated = []
+        try:
+            return self._sign_rows(nonce_manager, allocated, by_wallet, fees)
+        except Exception:
+            for wallet, nonces in allocated:
+                for nonce in nonces:
+                    nonce_manager.release(wallet, nonce)
+            raise
+
+    def _sign_rows(self, nonce_manager, allocated, by_wallet, fees):
+        jobs, job_rows = [], []
+        chunk_size = settings.PAYOUT_SIGNING_CHUNK_SIZE
+        for wallet, rows in by_wallet.items():
+            nonces = nonce_manager.allocate_many(wallet, len(rows))
+            allocated.append((wallet, nonces))
+            for row, nonce in zip(rows, nonces):
+                row['nonce'] = nonce
+            # One job per chunk so a hot wallet still spreads over the pool,
+            # while its key is decrypted once per chunk instead of per row
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                jobs.append((
+                    wallet.encrypted_private_key,
+                    settings.ENCRYPTION_KEY,
+                    [
+                        self.web3_client.build_transfer(row['nonce'], row['to_address'], row['amount'], fees)
+                        for row in chunk
+                    ],
+                ))
+                job_rows.append(chunk)
+
+        if self.web3_client.signer:
+            # The signing daemon does the crypto, one batch per chunk
+            return self._collect_signed(job_rows, (
+                self.web3_client.signer.sign_transactions(encrypted_key, transactions)
+                for encrypted_key, _, transactions in jobs
+            ))
+
+        total_rows = sum(len(rows) for rows in by_wallet.values())
+        if total_rows >= settings.PAYOUT_PROCESS_POOL_MIN_ROWS and len(jobs) > 1:
+            return self._collect_signed(job_rows, get_signing_pool().map(sign_transfers_job, jobs))
+        return self._collect_signed(job_rows, (sign_transfers(*job) for job in jobs))
+
+    def _collect_signed(self, job_rows, signed_chunks):
+        signed = {}
+        for rows, chunk in zip(job_rows, signed_chunks):
+            for row, (raw_tx, tx_hash) in zip(rows, chunk):
+                signed[row['row']] = (raw_tx, tx_hash)
+            self._report(signed=len(signed))
+        return signed
+
+    def _broadcast(self, rows, signed):
+        """
+        Send the signed rows in batches, marking each ``sent``, ``failed``
+        when the node rejected it, or ``unknown`` when the batch got no answer
+        """
+        batch_size = settings.PAYOUT_BROADCAST_BATCH_SIZE
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                responses = self.web3_client.w3.provider.make_batch_request([
+                    ('eth_sendRawTransaction', [signed[row['row']][0]]) for row in batch
+                ])
+            except Exception as e:
+                # The node may have accepted any of them; the receipt monitor finds out
+                for row in batch:
+                    row.update({'status': 'unknown', 'error': str(e) or e.__class__.__name__})
+                responses = []
+
+            for row, response in zip(batch, responses):
+                if response.get('error'):
+                    row.update({
+                        'status': 'failed',
+                        'error': response['error'].get('message', str(response['error'])),
+                    })
+                else:
+                    row['status'] = 'sent'
+            self._report(
+                broadcast=self.progress['broadcast'] + sum(row['status'] == 'sent' for row in batch),
+                unknown=self.progress['unknown'] + sum(row['status'] == 'unknown' for row in batch),
+                failed=self.progress['failed'] + sum(row['status'] == 'failed' for row in batch),
+            )
+
+    def execute(self, user, rows):
+        """
+        Run the whole payout and return the per-row results
+        """
+        self.user = user
+        results = self.validate(user, rows)
+        valid = [row for row in results if row['status'] == 'valid']
+        self._report(
+            status='signing',
+            total=len(results),
+            valid=len(valid),
+            failed=len(results) - len(valid),
+        )
+
+        by_wallet = defaultdict(list)
+        for row in valid:
+            by_wallet[row['wallet']].append(row)
+        self._check_balances(by_wallet)
+        to_send = [row for rows in by_wallet.values() for row in rows]
+        self._report(failed=len(results) - len(to_send))
+
+        if to_send:
+            fees = self.web3_client.fee_oracle.get_fees()
+            signed = self._sign(by_wallet, fees)
+            for row in to_send:
+                row['tx_hash'] = signed[row['row']][1]
+
+            # Recorded before anything is sent, so a crash mid-broadcast
+            # never leaves transfers on chain without a row
+            Transaction.objects.bulk_create([
+                Transaction(
+                    from_wallet=row['wallet'],
+                    from_address=row['wallet'].address,
+                    to_address=row['to_address'],
+                    amount=row['amount'],
+                    gas_price=Web3.from_wei(fees['max_fee_per_gas'], 'gwei'),
+                    tx_hash=row['tx_hash'],
+                    nonce=row['nonce'],
+                    status=Transaction.QUEUED,
+                )
+                for row in to_send
+            ], ignore_conflicts=True)
+
+            self._report(status='broadcasting')
+            self._broadcast(to_send, signed)
+
+            # Sent rows and rows the node may have taken go to the receipt
+            # monitor, rejected ones are failed
+            for statuses, status in (
+                (('sent', 'unknown'), Transaction.PENDING),
+                (('failed',), Transaction.FAILED),
+            ):
+                Transaction.objects.filter(
+                    tx_hash__in=[row['tx_hash'] for row in to_send if row['status'] in statuses],
+                    status=Transaction.QUEUED
+                ).update(status=status, updated_at=timezone.now())
+            for row in to_send:
+                if row['status'] == 'failed':
+                    row['tx_hash'] = None
+
+            # Rejected rows give their nonces back for the next sends, unless
+            # the chain already used them; rows without an answer keep theirs
+            nonce_manager = NonceManager(self.web3_client)
+            for wallet, rows in by_wallet.items():
+                used = [
+                    row for row in rows
+                    if row['status'] != 'failed' or is_nonce_too_low(row['error'])
+                ]
+                nonce_manager.sent(wallet, len(used))
+                for row in rows:
+                    if row['status'] == 'failed' and not is_nonce_too_low(row['error']):
+                        nonce_manager.release(wallet, row['nonce'])
+                if any(row['status'] == 'failed' for row in used):
+                    nonce_manager.resync(wallet)
+
+            balance_cache.invalidate(*(
+                [wallet.address for wallet in by_wallet] +
+                [row['to_address'] for row in to_send if row['status'] != 'failed']
+            ))
+
+        self._report(status='done')
+        for row in results:
+            row.pop('wallet', None)
+        return results
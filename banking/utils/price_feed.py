@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class CoinGeckoSource:
+    name = 'coingecko'
+    URL = 'https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd'
+
+    def __init__(self):
+        self.session = requests.Session()
+
+    def fetch(self, timeout):
+        response = self.session.get(self.URL, timeout=timeout)
+        response.raise_for_status()
+        return Decimal(str(response.json()['ethereum']['usd']))
+
+
+class StaticPriceSource:
+    """
+    Local stand-in source returning settings.ETH_PRICE_STATIC, for tests and offline work
+    """
+    name = 'static'
+
+    def fetch(self, timeout):
+        return Decimal(str(settings.ETH_PRICE_STATIC))
+
+
+class PriceFeed:
+    """
+    ETH/USD price served from the cache and refreshed by a background thread
+
+    Readers never touch the network: they get whatever price is cached, even
+    a stale one, or None before the first refresh lands. The refresher tries
+    each source in order with a strict timeout, and a cache lock makes sure
+    only one worker refreshes per interval.
+    """
+    CACHE_KEY = 'banking:eth-price'
+    LOCK_KEY = 'banking:eth-price:refreshing'
+
+    def __init__(self, sources=None, timeout=None, refresh_interval=None, max_age=None):
+        self.sources = sources if sources is not None else [
+            import_string(path)() for path in settings.ETH_PRICE_SOURCES
+        ]
+        self.timeout = timeout or settings.ETH_PRICE_TIMEOUT
+        self.refresh_interval = refresh_interval or settings.ETH_PRICE_REFRESH_INTERVAL
+        self.max_age = max_age or settings.ETH_PRICE_MAX_AGE
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get_price(self):
+        self.start()
+        entry = cache.get(self.CACHE_KEY)
+        return entry['price'] if entry else None
+
+    async def aget_price(self):
+        self.start()
+        entry = await cache.aget(self.CACHE_KEY)
+        return entry['price'] if entry else None
+
+    def refresh(self):
+        """
+        Fetch from the first source that answers and publish the price
+        """
+        for source in self.sources:
+            try:
+                price = source.fetch(self.timeout)
+            except Exception as e:
+                logger.warning("ETH price source %s failed: %s", source.name, e)
+                continue
+            cache.set(self.CACHE_KEY, {
+                'price': price,
+                'source': source.name,
+                'fetched_at': time.time(),
+            }, self.max_age)
+            return price
+        return None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='price-feed', daemon=True
+                )
+                self._thread.start()
+
+    def tick(self):
+        """
+        Refresh a stale price unless another worker holds the refresh lock
+        """
+        entry = cache.get(self.CACHE_KEY)
+        is_stale = entry is None or time.time() - entry['fetched_at'] >= self.refresh_interval
+        if is_stale and cache.add(self.LOCK_KEY, 1, self.refresh_interval):
+            return self.refresh()
+        return None
+
+    def _run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                # A cache outage must not end the thread for good
+                logger.exception("Error refreshing the ETH price")
+            time.sleep(self.refresh_interval)
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_price_feed():
+    """
+    Return the PriceFeed of this worker process
+    """
+    pid = os.getpid()
+    feed = _feeds.get(pid)
+    if feed is None:
+        with _feeds_lock:
+            feed = _feeds.get(pid)
+            if feed is None:
+                _feeds.clear()
+                feed = _feeds[pid] = PriceFeed()
+    return feed
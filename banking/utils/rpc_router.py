@@ -0,0 +1,404 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from web3.providers.async_base import AsyncJSONBaseProvider
+from web3.providers.base import JSONBaseProvider
+
+logger = logging.getLogger(__name__)
+
+# Calls without side effects, safe to send to a second provider while the
+# first one is still answering
+READ_METHODS = {
+    'eth_blockNumber',
+    'eth_call',
+    'eth_chainId',
+    'eth_estimateGas',
+    'eth_feeHistory',
+    'eth_gasPrice',
+    'eth_getBalance',
+    'eth_getBlockByHash',
+    'eth_getBlockByNumber',
+    'eth_getCode',
+    'eth_getLogs',
+    'eth_getTransactionByHash',
+    'eth_getTransactionCount',
+    'eth_getTransactionReceipt',
+    'eth_maxPriorityFeePerGas',
+    'net_version',
+}
+
+# JSON-RPC error codes meaning "this provider is throttling us", not "bad request"
+THROTTLE_ERROR_CODES = {-32005, 429}
+
+
+class ProviderUnavailable(Exception):
+    pass
+
+
+class RPCEndpoint:
+    """
+    One upstream provider plus its latency average and circuit breaker state
+    """
+    def __init__(self, provider, alpha, failure_threshold):
+        self.provider = provider
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.hedged = 0
+        self.consecutive_failures = 0
+        self.ejected_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def uri(self):
+        return self.provider.endpoint_uri
+
+    @property
+    def healthy(self):
+        return self.ejected_at is None
+
+    def record_success(self, elapsed):
+        with self.lock:
+            self.requests += 1
+            self.consecutive_failures = 0
+            self.ejected_at = None
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency = self.alpha * elapsed + (1 - self.alpha) * self.latency
+
+    def record_failure(self):
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.healthy and self.consecutive_failures >= self.failure_threshold:
+                self.ejected_at = time.monotonic()
+                logger.warning("Ejecting RPC provider %s after %d failures",
+                               self.uri, self.consecutive_failures)
+
+    def metrics(self):
+        return {
+            'uri': self.uri,
+            'healthy': self.healthy,
+            'latency_ms': round(self.latency * 1000, 2) if self.latency is not None else None,
+            'requests': self.requests,
+            'errors': self.errors,
+            'hedged': self.hedged,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class HedgedCall:
+    """
+    A read sent to the runner-up once the primary has taken too long
+    """
+    def __init__(self, endpoint, send):
+        self.endpoint = endpoint
+        self.send = send
+        self.future = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def start(self, executor, call):
+        with self.lock:
+            if self.cancelled:
+                return
+            with self.endpoint.lock:
+                self.endpoint.hedged += 1
+            self.future = executor.submit(call, self.endpoint, self.send)
+
+    def cancel(self):
+        """
+        Stop the hedge from starting, returning its future if it already has
+        """
+        with self.lock:
+            self.cancelled = True
+            return self.future
+
+
+class RoutingHTTPProvider(JSONBaseProvider):
+    """
+    Send each call to the fastest healthy provider, failing over to the next one
+
+    Providers are ranked by an exponential moving average of their latency.
+    A provider that fails ``failure_threshold`` times in a row is ejected until
+    a background probe gets an answer from it again. Read calls run on the
+    calling thread; one that takes longer than ``hedge_after`` seconds is also
+    sent to the runner-up from a small pool, so when the primary then fails
+    the runner-up's answer is already on its way.
+    """
+    def __init__(self, providers, hedge_after=0.5, failure_threshold=3,
+                 probe_interval=15, alpha=0.2):
+        super().__init__()
+        if not providers:
+            raise ValueError("At least one RPC provider is required")
+        self.endpoints = [
+            RPCEndpoint(provider, alpha, failure_threshold) for provider in providers
+        ]
+        self.hedge_after = hedge_after
+        self.probe_interval = probe_interval
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.endpoints), thread_name_prefix='rpc-hedge'
+        )
+        # (deadline, sequence, HedgedCall) heap served by one timer thread
+        self._hedges = []
+        self._hedge_sequence = itertools.count()
+        self._hedge_condition = threading.Condition()
+        self._hedge_thread = None
+        self._probe_thread = None
+        self._probe_lock = threading.Lock()
+
+    @property
+    def endpoint_uri(self):
+        return self.endpoints[0].uri
+
+    def __str__(self):
+        return f"RPC router over {', '.join(endpoint.uri for endpoint in self.endpoints)}"
+
+    def ranked_endpoints(self):
+        """
+        Healthy providers fastest first; unmeasured ones are tried first so they get a latency
+        """
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+        if not healthy:
+            # Everything is ejected: try them all rather than fail outright
+            return sorted(self.endpoints, key=lambda endpoint: endpoint.ejected_at)
+        return sorted(
+            healthy,
+            key=lambda endpoint: -1 if endpoint.latency is None else endpoint.latency
+        )
+
+    def _call(self, endpoint, send):
+        started = time.monotonic()
+        try:
+            response = send(endpoint.provider)
+        except Exception:
+            self._record_failure(endpoint)
+            raise
+        return self._record_response(endpoint, response, started)
+
+    def _record_response(self, endpoint, response, started):
+        if _is_throttled(response):
+            self._record_failure(endpoint)
+            raise ProviderUnavailable(f"{endpoint.uri} is rate limiting: {response}")
+        endpoint.record_success(time.monotonic() - started)
+        return response
+
+    def _record_failure(self, endpoint):
+        endpoint.record_failure()
+        if not endpoint.healthy:
+            self._ensure_probe()
+
+    def _failover(self, endpoints, send):
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                return self._call(endpoint, send)
+            except Exception as e:
+                last_error = e
+                logger.info("RPC provider %s failed, trying next: %s", endpoint.uri, e)
+        raise last_error
+
+    def _hedged(self, endpoints, send):
+        primary, secondary = endpoints[0], endpoints[1]
+        hedge = HedgedCall(secondary, send)
+        self._schedule_hedge(hedge)
+        try:
+            response = self._call(primary, send)
+        except Exception as e:
+            last_error = e
+            logger.info("RPC provider %s failed, trying next: %s", primary.uri, e)
+        else:
+            hedge.cancel()
+            return response
+
+        tried = [primary]
+        future = hedge.cancel()
+        if future is not None:
+            tried.append(secondary)
+            try:
+                return future.result()
+            except Exception as e:
+                last_error = e
+
+        # Fall back to the providers not tried yet
+        remaining = [endpoint for endpoint in endpoints if endpoint not in tried]
+        if not remaining:
+            raise last_error
+        return self._failover(remaining, send)
+
+    def _schedule_hedge(self, hedge):
+        with self._hedge_condition:
+            heapq.heappush(
+                self._hedges,
+                (time.monotonic() + self.hedge_after, next(self._hedge_sequence), hedge)
+            )
+            if self._hedge_thread is None:
+                self._hedge_thread = threading.Thread(
+                    target=self._hedge_loop, name='rpc-hedge-timer', daemon=True
+                )
+                self._hedge_thread.start()
+            self._hedge_condition.notify()
+
+    def _hedge_loop(self):
+        """
+        Start each hedge whose primary is still running at its deadline
+        """
+        while True:
+            with self._hedge_condition:
+                while not self._hedges:
+                    self._hedge_condition.wait()
+                deadline, _, hedge = self._hedges[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._hedge_condition.wait(delay)
+                    continue
+                heapq.heappop(self._hedges)
+            hedge.start(self._executor, self._call)
+
+    def make_request(self, method, params):
+        endpoints = self.ranked_endpoints()
+        send = lambda provider: provider.make_request(method, params)
+        if method in READ_METHODS and self.hedge_after and len(endpoints) > 1:
+            return self._hedged(endpoints, send)
+        return self._failover(endpoints, send)
+
+    def make_batch_request(self, calls):
+        endpoints = self.ranked_endpoints()
+        send = lambda provider: provider.make_batch_request(calls)
+        if self.hedge_after and len(endpoints) > 1 and all(method in READ_METHODS for method, _ in calls):
+            return self._hedged(endpoints, send)
+        return self._failover(endpoints, send)
+
+    def metrics(self):
+        return [endpoint.metrics() for endpoint in self.endpoints]
+
+    def _ensure_probe(self):
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        with self._probe_lock:
+            if self._probe_thread is None or not self._probe_thread.is_alive():
+                self._probe_thread = threading.Thread(
+                    target=self._probe_loop, name='rpc-probe', daemon=True
+                )
+                self._probe_thread.start()
+
+    def _probe_loop(self):
+        """
+        Re-admit ejected providers once they answer again, exit when none are ejected
+        """
+        while True:
+            time.sleep(self.probe_interval)
+            ejected = [endpoint for endpoint in self.endpoints if not endpoint.healthy]
+            if not ejected:
+                return
+            for endpoint in ejected:
+                started = time.monotonic()
+                try:
+                    response = endpoint.provider.make_request('eth_blockNumber', [])
+                    if 'result' not in response:
+                        raise ProviderUnavailable(str(response))
+                except Exception as e:
+                    logger.debug("RPC provider %s still unavailable: %s", endpoint.uri, e)
+                    continue
+                endpoint.record_success(time.monotonic() - started)
+                logger.info("RPC provider %s is back", endpoint.uri)
+
+
+class AsyncRoutingHTTPProvider(AsyncJSONBaseProvider):
+    """
+    Async counterpart of RoutingHTTPProvider over the same endpoints
+
+    ``providers`` are async providers for ``router.endpoints``, in order.
+    Latency, circuit breaker state and metrics are kept on the router's
+    endpoints, so sync and async calls rank providers alike and the router's
+    probe re-admits ejected ones. Hedged reads race both providers and the
+    first answer wins.
+    """
+    def __init__(self, router, providers):
+        super().__init__()
+        self.router = router
+        self.providers = dict(zip(router.endpoints, providers))
+
+    @property
+    def endpoint_uri(self):
+        return self.router.endpoint_uri
+
+    def __str__(self):
+        return f"Async {self.router}"
+
+    async def _call(self, endpoint, send):
+        started = time.monotonic()
+        try:
+            response = await send(self.providers[endpoint])
+        except Exception:
+            self.router._record_failure(endpoint)
+            raise
+        return self.router._record_response(endpoint, response, started)
+
+    async def _failover(self, endpoints, send):
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                return await self._call(endpoint, send)
+            except Exception as e:
+                last_error = e
+                logger.info("RPC provider %s failed, trying next: %s", endpoint.uri, e)
+        raise last_error
+
+    async def _hedged(self, endpoints, send):
+        primary, secondary = endpoints[0], endpoints[1]
+        tasks = {asyncio.ensure_future(self._call(primary, send)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=self.router.hedge_after)
+        if not done:
+            with secondary.lock:
+                secondary.hedged += 1
+            tasks[asyncio.ensure_future(self._call(secondary, send))] = secondary
+
+        pending = set(tasks)
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return task.result()
+                last_error = task.exception()
+
+        remaining = [endpoint for endpoint in endpoints if endpoint not in tasks.values()]
+        if not remaining:
+            raise last_error
+        return await self._failover(remaining, send)
+
+    async def make_request(self, method, params):
+        endpoints = self.router.ranked_endpoints()
+        send = lambda provider: provider.make_request(method, params)
+        if method in READ_METHODS and self.router.hedge_after and len(endpoints) > 1:
+            return await self._hedged(endpoints, send)
+        return await self._failover(endpoints, send)
+
+    async def make_batch_request(self, calls):
+        endpoints = self.router.ranked_endpoints()
+        send = lambda provider: provider.make_batch_request(calls)
+        if self.router.hedge_after and len(endpoints) > 1 and all(method in READ_METHODS for method, _ in calls):
+            return await self._hedged(endpoints, send)
+        return await self._failover(endpoints, send)
+
+    def metrics(self):
+        return self.router.metrics()
+
+
+def _is_throttled(response):
+    if isinstance(response, list):
+        return any(_is_throttled(item) for item in response)
+    error = response.get('error') if isinstance(response, dict) else None
+    return bool(error) and isinstance(error, dict) and error.get('code') in THROTTLE_ERROR_CODES
@@ -0,0 +1,254 @@
+"""
+Local signing daemon reached over a Unix socket, and its client
+
+Web workers send encrypted wallet keys and unsigned payloads; the daemon
+decrypts each key once, keeps it in a bounded LRU for a short while and does
+the ECDSA work, so hot wallets are not decrypted on every operation and the
+crypto CPU stays off the web workers. No Django imports, the daemon only
+needs the encryption key.
+
+The protocol is one JSON document per line in each direction:
+
+    {"requests": [{"type": "transaction", "encrypted_key": ..., "transaction": {...}},
+                  {"type": "message", "encrypted_key": ..., "message": "text"}]}
+    {"results": [{"raw_transaction": "0x..", "tx_hash": "0x.."},
+                 {"signature": "0x.."}, {"error": "..."}]}
+"""
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.fernet import Fernet
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+
+class SigningError(Exception):
+    pass
+
+
+def _zeroize(buffer):
+    for index in range(len(buffer)):
+        buffer[index] = 0
+
+
+class KeyCache:
+    """
+    Decrypted private keys by encrypted key, least recently used first out
+
+    Keys are held as bytearrays and overwritten with zeros when they are
+    evicted, expire ``ttl`` seconds after being decrypted, or the cache is
+    cleared. Copies the signing library makes while signing are outside
+    its reach.
+    """
+    def __init__(self, encryption_key, max_size=1000, ttl=300):
+        self.fernet = Fernet(encryption_key)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _decrypt(self, encrypted_key):
+        private_key = self.fernet.decrypt(encrypted_key.encode()).decode()
+        if private_key.startswith('0x'):
+            private_key = private_key[2:]
+        return bytearray.fromhex(private_key)
+
+    def get(self, encrypted_key):
+        """
+        Return a copy of the decrypted key as bytes
+        """
+        cache_key = hashlib.sha256(encrypted_key.encode()).digest()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(cache_key)
+                self.hits += 1
+                return bytes(entry[0])
+
+        key = self._decrypt(encrypted_key)
+        with self.lock:
+            self.misses += 1
+            previous = self.entries.pop(cache_key, None)
+            if previous is not None:
+                _zeroize(previous[0])
+            self.entries[cache_key] = (key, now + self.ttl)
+            while len(self.entries) > self.max_size:
+                _zeroize(self.entries.popitem(last=False)[1][0])
+            return bytes(key)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self.lock:
+            for cache_key in [k for k, (_, expires) in self.entries.items() if expires <= now]:
+                _zeroize(self.entries.pop(cache_key)[0])
+
+    def clear(self):
+        with self.lock:
+            for key, _ in self.entries.values():
+                _zeroize(key)
+            self.entries.clear()
+
+
+def sign_request(keys, request):
+    """
+    Sign one request from a batch, returning its result dict
+    """
+    try:
+        private_key = keys.get(request['encrypted_key'])
+        if request['type'] == 'transaction':
+            signed = Account.sign_transaction(request['transaction'], private_key)
+            return {'raw_transaction': signed.rawTransaction.hex(), 'tx_hash': signed.hash.hex()}
+        if request['type'] == 'message':
+            signed = Account.sign_message(encode_defunct(text=request['message']), private_key)
+            return {'signature': signed.signature.hex()}
+        return {'error': f"Unknown request type: {request['type']}"}
+    except Exception as e:
+        return {'error': str(e) or e.__class__.__name__}
+
+
+class _SigningHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        with self.server.connections_lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self.connection)
+        super().finish()
+
+    def handle(self):
+        # A connection may carry any number of batches, one per line
+        for line in self.rfile:
+            try:
+                requests = json.loads(line)['requests']
+                response = {'results': [sign_request(self.server.keys, request) for request in requests]}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'error': f"Malformed request: {str(e)}"}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class SigningServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server answering batched sign requests from a KeyCache
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, keys):
+        self.keys = keys
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # Only this user may connect
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _SigningHandler)
+        finally:
+            os.umask(old_umask)
+
+    def service_actions(self):
+        # Called from serve_forever between polls
+        self.keys.purge_expired()
+
+    def server_close(self):
+        super().server_close()
+        # Open connections would otherwise keep signing, and decrypting, after close
+        with self.connections_lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.keys.clear()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class SigningClient:
+    """
+    Client for a SigningServer, one connection per thread kept open between calls
+    """
+    def __init__(self, socket_path, timeout=5):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            connection = self.local.connection = (sock, sock.makefile('rb'))
+        return connection
+
+    def _close(self):
+        connection = getattr(self.local, 'connection', None)
+        self.local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+    def sign_batch(self, requests):
+        """
+        Send one batch and return its results in request order
+        """
+        payload = json.dumps({'requests': requests}).encode() + b'\n'
+        # A connection the daemon dropped since the last call is retried once
+        for attempt in range(2):
+            try:
+                sock, reader = self._connection()
+                sock.sendall(payload)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("Signer closed the connection")
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        response = json.loads(line)
+        if 'error' in response:
+            raise SigningError(response['error'])
+        return response['results']
+
+    def sign_transactions(self, encrypted_key, transactions):
+        """
+        Sign transaction dicts with one wallet key, returning (raw_transaction_hex, tx_hash_hex) pairs
+        """
+        results = self.sign_batch([
+            {
+                'type': 'transaction',
+                'encrypted_key': encrypted_key,
+                # JSON has no bytes, the signer takes hex data as well
+                'transaction': {
+                    field: '0x' + value.hex() if isinstance(value, bytes) else value
+                    for field, value in transaction.items()
+                },
+            }
+            for transaction in transactions
+        ])
+        signed = []
+        for result in results:
+            if 'error' in result:
+                raise SigningError(result['error'])
+            signed.append((result['raw_transaction'], result['tx_hash']))
+        return signed
+
+    def sign_message(self, encrypted_key, message):
+        result = self.sign_batch([
+            {'type': 'message', 'encrypted_key': encrypted_key, 'message': message}
+        ])[0]
+        if 'error' in result:
+            raise SigningError(result['error'])
+        return result['signature']
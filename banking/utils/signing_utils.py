@@ -0,0 +1,50 @@
+"""
+Pure signing helpers with no Django imports, so they can run in worker processes
+"""
+from cryptography.fernet import Fernet
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+
+def sign_transfers(encrypted_private_key, encryption_key, transactions):
+    """
+    Decrypt a wallet key once and sign every transaction dict with it
+
+    Returns a list of (raw_transaction_hex, tx_hash_hex) in input order.
+    """
+    private_key = Fernet(encryption_key).decrypt(encrypted_private_key.encode()).decode()
+    signed = []
+    for transaction in transactions:
+        signed_tx = Account.sign_transaction(transaction, private_key)
+        signed.append((signed_tx.rawTransaction.hex(), signed_tx.hash.hex()))
+    return signed
+
+
+def sign_transfers_job(job):
+    """
+    ProcessPoolExecutor.map entry point for sign_transfers
+    """
+    return sign_transfers(*job)
+
+
+def recover_signers(items):
+    """
+    Recover the address behind each (message, signature) pair
+
+    Returns a list of checksum addresses in input order, None where the
+    signature could not be decoded.
+    """
+    recovered = []
+    for message, signature in items:
+        try:
+            recovered.append(Account.recover_message(encode_defunct(text=message), signature=signature))
+        except Exception:
+            recovered.append(None)
+    return recovered
+
+
+def recover_signers_job(items):
+    """
+    ProcessPoolExecutor.map entry point for recover_signers
+    """
+    return recover_signers(items)
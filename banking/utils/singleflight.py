@@ -0,0 +1,95 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapse identical concurrent calls into one upstream call
+
+    Threads of a worker asking for the same key while a call is in flight
+    wait for it and share its result (or exception). With ``shared=True`` the
+    leader also publishes its result in the cache for ``shared_ttl`` seconds,
+    and a cache lock makes leaders in other workers wait for it instead of
+    calling upstream themselves.
+    """
+    KEY_PREFIX = 'banking:singleflight:'
+
+    def __init__(self, shared=False, shared_ttl=1, wait_timeout=2):
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'calls': 0, 'collapsed': 0, 'shared_collapsed': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats['collapsed'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._shared_call(key, fn) if self.shared else fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _shared_call(self, key, fn):
+        result_key = f"{self.KEY_PREFIX}{key}"
+        lock_key = f"{result_key}:lock"
+
+        cached = cache.get(result_key)
+        if cached is not None:
+            self._count_shared()
+            return cached
+
+        if not cache.add(lock_key, 1, self.wait_timeout):
+            # Another worker is fetching it, wait for its result
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                cached = cache.get(result_key)
+                if cached is not None:
+                    self._count_shared()
+                    return cached
+            return fn()
+
+        try:
+            result = fn()
+            if result is not None:
+                cache.set(result_key, result, self.shared_ttl)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    def _count_shared(self):
+        with self._lock:
+            self._stats['shared_collapsed'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,161 @@
+import asyncio
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+from banking.models import PortfolioSnapshot, Wallet, WalletBalanceSnapshot
+from .price_feed import get_price_feed
+
+
+class SnapshotService:
+    """
+    Keep WalletBalanceSnapshot and PortfolioSnapshot rows up to date
+
+    The receipt monitor and the incoming-transfer indexer refresh just the
+    wallets a block touched; the refresher command sweeps every wallet so
+    fiat values follow the price and missed updates heal. The ``a``-prefixed
+    methods are for the async views and take an AsyncWeb3Client instead.
+    """
+    def __init__(self, web3_client):
+        self.web3_client = web3_client
+
+    def snapshots_for(self, wallets):
+        """
+        {wallet id: snapshot} for wallets loaded with select_related('balance_snapshot')
+
+        Wallets without a snapshot yet are read from the node once and stored;
+        a wallet whose read failed is left out.
+        """
+        snapshots, missing = _split_snapshots(wallets)
+        if missing:
+            snapshots.update(self.refresh_wallets(missing))
+        return snapshots
+
+    async def asnapshots_for(self, wallets):
+        snapshots, missing = _split_snapshots(wallets)
+        if missing:
+            snapshots.update(await self.arefresh_wallets(missing))
+        return snapshots
+
+    def refresh_addresses(self, addresses, block_number=None):
+        wallets = list(Wallet.objects.filter(address__in=set(addresses)))
+        if wallets:
+            self.refresh_wallets(wallets, block_number)
+
+    def refresh_wallets(self, wallets, block_number=None):
+        """
+        Read the wallets' balances in one batch and store their snapshots
+
+        Balances are read at the cached chain head, or at ``block_number``
+        when that head is behind it, so a refresh right after a transfer
+        settled in that block already includes it. Returns {wallet id:
+        snapshot} for the wallets that could be read; the ones whose
+        balance lookup failed keep their previous snapshot.
+        """
+        wallets = list(wallets)
+        block_number = max(self.web3_client.get_block_number(), block_number or 0)
+        balances = self.web3_client.get_balances(
+            [wallet.address for wallet in wallets], block_number
+        )
+        eth_price = get_price_feed().get_price()
+        return self.store_balances(wallets, balances, block_number, eth_price)
+
+    async def arefresh_wallets(self, wallets):
+        """
+        refresh_wallets at the cached head, reading the balances and the
+        price concurrently without holding a thread
+        """
+        wallets = list(wallets)
+        block_number = await self.web3_client.get_block_number()
+        balances, eth_price = await asyncio.gather(
+            self.web3_client.get_balances([wallet.address for wallet in wallets], block_number),
+            get_price_feed().aget_price(),
+        )
+        return await sync_to_async(self.store_balances)(wallets, balances, block_number, eth_price)
+
+    def store_balances(self, wallets, balances, block_number, eth_price):
+        """
+        Store the snapshots of the wallets whose balance was read, and their portfolios
+        """
+        now = timezone.now()
+
+        snapshots = []
+        for wallet in wallets:
+            result = balances[wallet.address]
+            if result['error'] is not None:
+                continue
+            snapshots.append(WalletBalanceSnapshot(
+                wallet=wallet,
+                balance=result['balance'],
+                block_number=block_number,
+                fiat_value=(
+                    (result['balance'] * eth_price).quantize(Decimal('0.01'))
+                    if eth_price else None
+                ),
+                updated_at=now,
+            ))
+        WalletBalanceSnapshot.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=['wallet'],
+            update_fields=['balance', 'block_number', 'fiat_value', 'updated_at'],
+        )
+        self.refresh_portfolios({wallet.user_id for wallet in wallets})
+        return {snapshot.wallet_id: snapshot for snapshot in snapshots}
+
+    def refresh_portfolios(self, user_ids):
+        """
+        Re-total the portfolios of ``user_ids`` from their wallet snapshots
+        """
+        totals = WalletBalanceSnapshot.objects.filter(
+            wallet__user_id__in=user_ids
+        ).values('wallet__user_id').annotate(
+            total_balance=Sum('balance'),
+            total_fiat_value=Sum('fiat_value'),
+            wallet_count=Count('id'),
+            updated_at=Min('updated_at'),
+        )
+        PortfolioSnapshot.objects.bulk_create(
+            [
+                PortfolioSnapshot(
+                    user_id=row['wallet__user_id'],
+                    total_balance=row['total_balance'],
+                    total_fiat_value=row['total_fiat_value'],
+                    wallet_count=row['wallet_count'],
+                    updated_at=row['updated_at'],
+                )
+                for row in totals
+            ],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['total_balance', 'total_fiat_value', 'wallet_count', 'updated_at'],
+        )
+
+    def refresh_all(self, batch_size=500):
+        """
+        Refresh every wallet, ``batch_size`` wallets per balance batch
+        """
+        batch = []
+        for wallet in Wallet.objects.order_by('id').iterator(chunk_size=batch_size):
+            batch.append(wallet)
+            if len(batch) == batch_size:
+                self.refresh_wallets(batch)
+                batch = []
+        if batch:
+            self.refresh_wallets(batch)
+
+
+def _split_snapshots(wallets):
+    """
+    ({wallet id: snapshot}, wallets without one) for wallets loaded with their snapshot
+    """
+    snapshots = {}
+    missing = []
+    for wallet in wallets:
+        try:
+            snapshots[wallet.id] = wallet.balance_snapshot
+        except WalletBalanceSnapshot.DoesNotExist:
+            missing.append(wallet)
+    return snapshots, missing
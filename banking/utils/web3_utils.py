@@ -1,16 +1,392 @@
-from web3 import Web3
+from web3 import Web3, AsyncWeb3
 from eth_account import Account
 from eth_account.messages import encode_defunct
 from django.conf import settings
+import asyncio
 import json
+import logging
+import os
+import socket
+import threading
+import weakref
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
 from cryptography.fernet import Fernet
+from django.core.cache import cache
 from ..models import Wallet, Transaction
+from .balance_cache import balance_cache
+from .rpc_router import AsyncRoutingHTTPProvider, RoutingHTTPProvider
+from .nonce_utils import NonceManager, is_nonce_too_low
+from .fee_oracle import FeeOracle
+from .singleflight import SingleFlight
+from .signer_service import SigningClient
+from .signing_utils import sign_transfers
+
+logger = logging.getLogger(__name__)
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that turns on TCP keep-alive for pooled RPC connections
+    """
+    def __init__(self, keepalive_idle=None, **kwargs):
+        self.keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keepalive_idle:
+            socket_options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                socket_options.append(
+                    (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(self.keepalive_idle))
+                )
+            kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledHTTPProvider(Web3.HTTPProvider):
+    """
+    HTTPProvider that sends every request through one pooled requests.Session
+
+    web3's own session cache is keyed per thread, so threaded workers would
+    still open a new connection pool per thread.
+    """
+    def __init__(self, endpoint_uri, session, timeout=None):
+        super().__init__(endpoint_uri, request_kwargs={'timeout': timeout})
+        self.session = session
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        response = self.session.post(
+            self.endpoint_uri, data=request_data, **self.get_request_kwargs()
+        )
+        response.raise_for_status()
+        return self.decode_rpc_response(response.content)
+
+    def make_batch_request(self, calls):
+        """
+        Send (method, params) pairs as one JSON-RPC batch
+
+        Responses are returned in the order of ``calls``; nodes are free to
+        answer a batch in any order, so they are matched back up by id.
+        """
+        payload = []
+        for method, params in calls:
+            payload.append({
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params,
+                'id': next(self.request_counter),
+            })
+        response = self.session.post(
+            self.endpoint_uri,
+            data=json.dumps(payload),
+            **self.get_request_kwargs()
+        )
+        response.raise_for_status()
+        by_id = {item.get('id'): item for item in response.json()}
+        return [
+            by_id.get(request['id'], {'error': {'message': 'Missing response in batch'}})
+            for request in payload
+        ]
+
+
+def build_rpc_session():
+    """
+    Build a keep-alive requests.Session sized from the WEB3_HTTP_* settings
+    """
+    session = requests.Session()
+    adapter = KeepAliveHTTPAdapter(
+        keepalive_idle=settings.WEB3_HTTP_KEEPALIVE_IDLE,
+        pool_connections=settings.WEB3_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.WEB3_HTTP_POOL_MAXSIZE,
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def build_provider(endpoint_uri):
+    return PooledHTTPProvider(
+        endpoint_uri,
+        session=build_rpc_session(),
+        timeout=(settings.WEB3_HTTP_CONNECT_TIMEOUT, settings.WEB3_HTTP_TIMEOUT),
+    )
+
+
+def _read_balance_responses(addresses, responses, results):
+    """
+    Fill ``results`` from eth_getBalance batch responses, returning the balances read
+    """
+    fetched = {}
+    for address, response in zip(addresses, responses):
+        if response.get('error'):
+            results[address] = {
+                'balance': None,
+                'error': response['error'].get('message', str(response['error']))
+            }
+        else:
+            fetched[address] = Web3.from_wei(int(response['result'], 16), 'ether')
+            results[address] = {'balance': fetched[address], 'error': None}
+    return fetched
+
+
+def _read_receipt(result):
+    """
+    The receipt fields the monitors use, decoded from a raw JSON-RPC receipt
+    """
+    if not result:
+        return None
+    return {
+        'transactionHash': result['transactionHash'],
+        'blockHash': result['blockHash'],
+        'blockNumber': int(result['blockNumber'], 16),
+        'gasUsed': int(result['gasUsed'], 16),
+        'status': int(result['status'], 16),
+    }
+
+
+def build_router(endpoint_uris):
+    """
+    Route calls over every configured provider, see RoutingHTTPProvider
+    """
+    return RoutingHTTPProvider(
+        [build_provider(uri) for uri in endpoint_uris],
+        hedge_after=settings.WEB3_HEDGE_AFTER,
+        failure_threshold=settings.WEB3_CIRCUIT_FAILURE_THRESHOLD,
+        probe_interval=settings.WEB3_CIRCUIT_PROBE_INTERVAL,
+        alpha=settings.WEB3_LATENCY_ALPHA,
+    )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_web3_client():
+    """
+    Return the Web3Client shared by every request in this worker process
+
+    Clients are keyed by pid so a forked gunicorn worker never reuses the
+    connection pool it inherited from the master.
+    """
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                _clients.clear()
+                client = _clients[pid] = Web3Client()
+    return client
+
+
+class AsyncPooledHTTPProvider(AsyncWeb3.AsyncHTTPProvider):
+    """
+    AsyncHTTPProvider bound to one aiohttp.ClientSession (and its connection pool)
+    """
+    def __init__(self, endpoint_uri, session):
+        super().__init__(endpoint_uri)
+        self.session = session
+
+    async def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        async with self.session.post(
+            self.endpoint_uri, data=request_data, **self.get_request_kwargs()
+        ) as response:
+            response.raise_for_status()
+            return self.decode_rpc_response(await response.read())
+
+    async def make_batch_request(self, calls):
+        payload = []
+        for method, params in calls:
+            payload.append({
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params,
+                'id': next(self.request_counter),
+            })
+        async with self.session.post(
+            self.endpoint_uri, data=json.dumps(payload), **self.get_request_kwargs()
+        ) as response:
+            response.raise_for_status()
+            by_id = {item.get('id'): item for item in await response.json(content_type=None)}
+        return [
+            by_id.get(request['id'], {'error': {'message': 'Missing response in batch'}})
+            for request in payload
+        ]
+
+
+def build_async_rpc_session():
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=settings.WEB3_HTTP_POOL_MAXSIZE,
+            keepalive_timeout=settings.WEB3_HTTP_KEEPALIVE_IDLE or None,
+        ),
+        timeout=aiohttp.ClientTimeout(
+            total=settings.WEB3_HTTP_CONNECT_TIMEOUT + settings.WEB3_HTTP_TIMEOUT,
+            connect=settings.WEB3_HTTP_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+def build_async_router(router, session):
+    """
+    Route async calls over the providers of ``router``, see AsyncRoutingHTTPProvider
+    """
+    return AsyncRoutingHTTPProvider(
+        router, [AsyncPooledHTTPProvider(endpoint.uri, session) for endpoint in router.endpoints]
+    )
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_web3_client():
+    """
+    Return the AsyncWeb3Client for the running event loop
+
+    aiohttp sessions are bound to the loop that created them, so each loop
+    (one per uvicorn worker) gets its own pooled session. Calls are routed
+    over the same providers, with the same health and latency stats, as the
+    worker's Web3Client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        session = build_async_rpc_session()
+        client = _async_clients[loop] = AsyncWeb3Client(
+            build_async_router(get_web3_client().w3.provider, session), session
+        )
+    return client
+
+
+async def close_async_web3_client():
+    """
+    Close the running loop's AsyncWeb3Client, called when the ASGI server shuts down
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+class AsyncWeb3Client:
+    """
+    Read-only AsyncWeb3 counterpart of Web3Client used by the async views
+    """
+    def __init__(self, provider, session=None):
+        self.w3 = AsyncWeb3(provider)
+        self.session = session
+        self._in_flight = {}
+    
+    async def close(self):
+        """
+        Close the aiohttp session (and its pooled connections) the providers share
+        """
+        if self.session is not None:
+            await self.session.close()
+    
+    async def _coalesce(self, key, coroutine_fn):
+        """
+        Await the in-flight task for ``key`` if there is one, else start it
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(coroutine_fn())
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+    
+    async def get_block_number(self):
+        block_number = await cache.aget(Web3Client.CHAIN_HEAD_KEY)
+        if block_number is None:
+            block_number = await self._coalesce('block_number', lambda: self.w3.eth.block_number)
+            await cache.aset(Web3Client.CHAIN_HEAD_KEY, block_number, settings.CHAIN_HEAD_TTL)
+        return block_number
+    
+    async def get_latest_block_number(self):
+        block_number = await cache.aget(Web3Client.LATEST_BLOCK_KEY)
+        if block_number is None:
+            block_number = await self.get_block_number()
+        return block_number
+    
+    async def get_balances(self, addresses, block_number=None):
+        """
+        Same contract as Web3Client.get_balances
+        """
+        addresses = list(addresses)
+        if not addresses:
+            return {}
+        
+        try:
+            if block_number is None:
+                block_number = await self.get_block_number()
+        except Exception as e:
+            return {address: {'balance': None, 'error': str(e)} for address in addresses}
+        
+        cached = await balance_cache.aget_many(addresses, block_number)
+        results = {
+            address: {'balance': balance, 'error': None}
+            for address, balance in cached.items()
+        }
+        missing = [address for address in addresses if address not in results]
+        if not missing:
+            return results
+        
+        try:
+            responses = await self.w3.provider.make_batch_request([
+                ('eth_getBalance', [address, hex(block_number)]) for address in missing
+            ])
+        except Exception as e:
+            results.update({address: {'balance': None, 'error': str(e)} for address in missing})
+            return results
+        
+        fetched = _read_balance_responses(missing, responses, results)
+        await balance_cache.aset_many(fetched, block_number)
+        return results
+    
+    async def get_transaction_receipt(self, tx_hash):
+        return await self._coalesce(
+            f"receipt:{tx_hash.lower()}",
+            lambda: self.w3.eth.get_transaction_receipt(tx_hash)
+        )
+    
+    async def get_block(self, block_identifier):
+        return await self._coalesce(
+            f"block:{block_identifier}",
+            lambda: self.w3.eth.get_block(block_identifier)
+        )
+
 
 class Web3Client:
-    def __init__(self):
-        self.w3 = Web3(Web3.HTTPProvider(settings.WEB3_PROVIDER_URL))
+    def __init__(self, provider=None, provider_urls=None):
+        self.w3 = Web3(provider or build_router(provider_urls or settings.WEB3_PROVIDER_URLS))
         self.encryption_key = settings.ENCRYPTION_KEY
         self.fernet = Fernet(self.encryption_key)
+        self._chain_id = None
+        self._chain_id_lock = threading.Lock()
+        self.fee_oracle = FeeOracle(self)
+        self.single_flight = SingleFlight(
+            shared=settings.WEB3_COALESCE_SHARED,
+            shared_ttl=settings.WEB3_COALESCE_SHARED_TTL,
+            wait_timeout=settings.WEB3_COALESCE_WAIT,
+        )
+        # Keys are decrypted and used by the signing daemon when one is configured
+        self.signer = (
+            SigningClient(settings.SIGNER_SOCKET, settings.SIGNER_TIMEOUT)
+            if settings.SIGNER_SOCKET else None
+        )
+    
+    @property
+    def chain_id(self):
+        """
+        Chain id of the connected network, fetched once per client
+        """
+        if self._chain_id is None:
+            with self._chain_id_lock:
+                if self._chain_id is None:
+                    self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
     
     def create_wallet(self, user):
         account = Account.create()
@@ -24,42 +400,216 @@ class Web3Client:
         )
         return wallet
     
+    CHAIN_HEAD_KEY = 'banking:chain-head'
+    # Head the receipt monitor has processed, published once per block
+    LATEST_BLOCK_KEY = 'banking:latest-block'
+    
+    def get_block_number(self):
+        """
+        Latest block number, shared through the cache for CHAIN_HEAD_TTL seconds
+        """
+        block_number = cache.get(self.CHAIN_HEAD_KEY)
+        if block_number is None:
+            block_number = self.single_flight.do('block_number', lambda: self.w3.eth.block_number)
+            cache.set(self.CHAIN_HEAD_KEY, block_number, settings.CHAIN_HEAD_TTL)
+        return block_number
+    
+    def get_latest_block_number(self):
+        """
+        Head published by the receipt monitor, asking the node only when no monitor is running
+        """
+        block_number = cache.get(self.LATEST_BLOCK_KEY)
+        if block_number is None:
+            block_number = self.get_block_number()
+        return block_number
+    
+    def get_transaction_receipt(self, tx_hash):
+        """
+        Receipt lookup shared by every concurrent caller asking for the same hash
+        """
+        return self.single_flight.do(
+            f"receipt:{tx_hash.lower()}",
+            lambda: self.w3.eth.get_transaction_receipt(tx_hash)
+        )
+    
+    def get_block(self, block_identifier, full_transactions=False):
+        return self.single_flight.do(
+            f"block:{block_identifier}:{int(full_transactions)}",
+            lambda: self.w3.eth.get_block(block_identifier, full_transactions)
+        )
+    
+    def get_transaction_receipts(self, tx_hashes):
+        """
+        Receipts for many hashes in one batch request
+
+        Returns {tx_hash: receipt}; hashes that are not mined yet, or whose
+        lookup failed, map to None so callers simply retry them later.
+        """
+        tx_hashes = list(tx_hashes)
+        if not tx_hashes:
+            return {}
+        responses = self.w3.provider.make_batch_request([
+            ('eth_getTransactionReceipt', [tx_hash]) for tx_hash in tx_hashes
+        ])
+        return {
+            tx_hash: None if response.get('error') else _read_receipt(response.get('result'))
+            for tx_hash, response in zip(tx_hashes, responses)
+        }
+    
+    def coalescing_stats(self):
+        return self.single_flight.stats()
+    
     def get_balance(self, wallet_address):
-        balance_wei = self.w3.eth.get_balance(wallet_address)
-        return Web3.from_wei(balance_wei, 'ether')
+        block_number = self.get_block_number()
+        balance = balance_cache.get(wallet_address, block_number)
+        if balance is None:
+            balance_wei = self.w3.eth.get_balance(wallet_address, block_number)
+            balance = Web3.from_wei(balance_wei, 'ether')
+            balance_cache.set(wallet_address, balance, block_number)
+        return balance
     
-    def send_transaction(self, from_wallet, to_address, amount_ether):
-        # Decrypt private key
-        private_key = self.fernet.decrypt(from_wallet.encrypted_private_key.encode()).decode()
+    def provider_metrics(self):
+        """
+        Per-provider latency and error counters for this worker process
+        """
+        return self.w3.provider.metrics()
+    
+    def get_balances(self, addresses, block_number=None):
+        """
+        Fetch the balances of many addresses in one JSON-RPC batch round trip
+
+        Returns a dict mapping each address to ``{'balance': Decimal, 'error': None}``
+        or ``{'balance': None, 'error': str}`` when that lookup failed. Balances
+        are read at ``block_number``, the current head by default.
+        """
+        addresses = list(addresses)
+        if not addresses:
+            return {}
+        
+        try:
+            if block_number is None:
+                block_number = self.get_block_number()
+        except Exception as e:
+            return {address: {'balance': None, 'error': str(e)} for address in addresses}
         
-        # Build transaction
-        nonce = self.w3.eth.get_transaction_count(from_wallet.address)
-        gas_price = self.w3.eth.gas_price
+        results = {
+            address: {'balance': balance, 'error': None}
+            for address, balance in balance_cache.get_many(addresses, block_number).items()
+        }
+        missing = [address for address in addresses if address not in results]
+        if not missing:
+            return results
+        
+        try:
+            responses = self.w3.provider.make_batch_request([
+                ('eth_getBalance', [address, hex(block_number)]) for address in missing
+            ])
+        except Exception as e:
+            results.update({address: {'balance': None, 'error': str(e)} for address in missing})
+            return results
         
-        transaction = {
+        fetched = _read_balance_responses(missing, responses, results)
+        balance_cache.set_many(fetched, block_number)
+        return results
+    
+    def build_transfer(self, nonce, to_address, amount_ether, fees):
+        """
+        Unsigned EIP-1559 ETH transfer priced from a fee oracle estimate
+        """
+        return {
+            'type': 2,  # EIP-1559
             'nonce': nonce,
-            'gasPrice': gas_price,
+            'maxFeePerGas': fees['max_fee_per_gas'],
+            'maxPriorityFeePerGas': fees['max_priority_fee_per_gas'],
             'gas': 21000,  # Standard ETH transfer
             'to': to_address,
             'value': Web3.to_wei(amount_ether, 'ether'),
             'data': b'',
-            'chainId': self.w3.eth.chain_id
+            'chainId': self.chain_id
         }
+    
+    def sign_transactions(self, wallet, transactions):
+        """
+        Sign transaction dicts with ``wallet``'s key, returning (raw_transaction_hex, tx_hash_hex) pairs
+        """
+        if self.signer:
+            return self.signer.sign_transactions(wallet.encrypted_private_key, transactions)
+        return sign_transfers(wallet.encrypted_private_key, self.encryption_key, transactions)
+    
+    def sign_message(self, wallet, message):
+        """
+        EIP-191 signature of ``message`` by ``wallet``, as hex
+        """
+        if self.signer:
+            return self.signer.sign_message(wallet.encrypted_private_key, message)
+        return self.w3.eth.account.sign_message(
+            encode_defunct(text=message),
+            private_key=self.fernet.decrypt(wallet.encrypted_private_key.encode()).decode()
+        ).signature.hex()
+    
+    def _sign_and_send(self, nonce_manager, from_wallet, transaction):
+        """
+        Sign and broadcast ``transaction``, settling its nonce with ``nonce_manager``
+
+        The nonce is given back only when the transaction certainly did not
+        reach the node: signing failed or the node answered with an error.
+        A send without an answer may have got through, so its nonce counts
+        as sent, the hash is returned to be tracked, and a later resync
+        hands the nonce out again if the node never had it.
+        """
+        try:
+            raw_transaction, tx_hash = self.sign_transactions(from_wallet, [transaction])[0]
+        except Exception:
+            nonce_manager.release(from_wallet, transaction['nonce'])
+            raise
+        try:
+            self.w3.eth.send_raw_transaction(raw_transaction)
+        except ValueError as e:
+            # web3 raises the node's JSON-RPC error responses as ValueError
+            if is_nonce_too_low(e):
+                # That nonce is used up on chain
+                nonce_manager.sent(from_wallet)
+            else:
+                nonce_manager.release(from_wallet, transaction['nonce'])
+            raise
+        except Exception as e:
+            logger.warning("No answer sending %s, tracking it as pending: %s", tx_hash, e)
+        nonce_manager.sent(from_wallet)
+        return tx_hash
+    
+    def send_transaction(self, from_wallet, to_address, amount_ether):
+        # Build transaction with a locally allocated nonce
+        nonce_manager = NonceManager(self)
+        nonce = nonce_manager.allocate(from_wallet)
+        try:
+            fees = self.fee_oracle.get_fees()
+            transaction = self.build_transfer(nonce, to_address, amount_ether, fees)
+        except Exception:
+            nonce_manager.release(from_wallet, nonce)
+            raise
         
-        # Sign transaction
-        signed = self.w3.eth.account.sign_transaction(transaction, private_key)
-        
-        # Send transaction
-        tx_hash = self.w3.eth.send_raw_transaction(signed.rawTransaction)
+        # Sign and send, resyncing the counter once if the chain is ahead of it
+        try:
+            tx_hash = self._sign_and_send(nonce_manager, from_wallet, transaction)
+        except ValueError as e:
+            if not is_nonce_too_low(e):
+                raise
+            nonce_manager.resync(from_wallet)
+            nonce = transaction['nonce'] = nonce_manager.allocate(from_wallet)
+            tx_hash = self._sign_and_send(nonce_manager, from_wallet, transaction)
         
         # Create transaction record
         tx = Transaction.objects.create(
             from_wallet=from_wallet,
+            from_address=from_wallet.address,
             to_address=to_address,
             amount=amount_ether,
-            gas_price=Web3.from_wei(gas_price, 'gwei'),
-            tx_hash=tx_hash.hex(),
+            gas_price=Web3.from_wei(fees['max_fee_per_gas'], 'gwei'),
+            tx_hash=tx_hash,
             nonce=nonce
         )
         
+        # Both sides of the transfer have a new balance from now on
+        balance_cache.invalidate(from_wallet.address, to_address)
+        
         return tx
\ No newline at end of file
@@ -1,38 +1,55 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
-from django.http import JsonResponse
-from .models import Transaction, MultiSigTransaction, Wallet, TransactionSignature
-from .utils.web3_utils import Web3Client
+from django.http import JsonResponse, StreamingHttpResponse, Http404
+from django.conf import settings
+from django.urls import reverse
+from django.core.handlers.asgi import ASGIRequest
+from .db_router import primary_reads, replica_reads
+from .models import Transaction, MultiSigExecution, MultiSigTransaction, Wallet, TransactionSignature, PortfolioSnapshot
+from .utils.web3_utils import get_web3_client
+from .utils.balance_cache import balance_cache
+from .utils.price_feed import get_price_feed
 from .utils.zkp_utils import BalanceProof
-from .utils.multisig_utils import MultiSigManager
-from .forms import TransactionForm
+from .utils.multisig_utils import MultiSigManager, multisig_for_signer, signable_multisigs
+from .utils.payout_utils import BulkPayoutService
+from .utils.snapshot_utils import SnapshotService
+from .utils.history_utils import history_page, export_rows, csv_lines, jsonl_lines, aiter_lines
+from .forms import TransactionForm, BulkPayoutForm, TransactionExportForm
 from django.db.models import Q
+from web3 import Web3
 
-from decimal import Decimal
-import requests
+from datetime import datetime, time, timedelta
+import uuid
 
 def get_eth_price():
-    try:
-        response = requests.get('https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd')
-        data = response.json()
-        return Decimal(str(data['ethereum']['usd']))
-    except:
-        return None
+    # Cached price kept fresh in the background, never blocks on the network
+    return get_price_feed().get_price()
 
 @login_required
+@replica_reads
 def wallet_dashboard(request):
     try:
-        web3_client = Web3Client()
-        wallets = Wallet.objects.filter(user=request.user)
+        web3_client = get_web3_client()
+        # Wallets, their balance snapshots and the portfolio totals in one query
+        user_wallets = Wallet.objects.filter(user=request.user).select_related(
+            'balance_snapshot', 'user__portfolio_snapshot'
+        )
+        # Only the primary can tell that the user has no wallet yet, a
+        # lagging replica would have us create a second one
+        wallets = list(user_wallets)
+        if not wallets:
+            with primary_reads():
+                wallets = list(user_wallets.all())
         
         # Initialize wallet if user has none
-        if not wallets.exists():
+        if not wallets:
             try:
                 wallet = web3_client.create_wallet(request.user)
                 messages.success(request, f"Created new wallet: {wallet.address}")
-                wallets = Wallet.objects.filter(user=request.user)
+                wallets = [wallet]
             except Exception as e:
                 messages.error(request, f"Error creating wallet: {str(e)}")
                 return render(request, 'banking/dashboard.html', {'error': str(e)})
@@ -40,28 +57,36 @@ def wallet_dashboard(request):
         # Get ETH price
         eth_price = get_eth_price()
         
-        # Get wallet balances
+        # Balances come from the snapshots, only wallets without one are read live
+        has_snapshots = all(hasattr(wallet, 'balance_snapshot') for wallet in wallets)
+        snapshots = SnapshotService(web3_client).snapshots_for(wallets)
         wallet_balances = []
         for wallet in wallets:
-            try:
-                balance = web3_client.get_balance(wallet.address)
-                wallet_info = {
+            snapshot = snapshots.get(wallet.id)
+            if snapshot is not None:
+                wallet_balances.append({
                     'wallet': wallet,
-                    'balance': balance,
-                    'balance_formatted': f"{balance:.4f}"
-                }
-                if eth_price:
-                    wallet_info['fiat_value'] = balance * eth_price
-                wallet_balances.append(wallet_info)
-            except Exception as e:
-                messages.warning(request, f"Could not fetch balance for wallet {wallet.address}: {str(e)}")
+                    'balance': snapshot.balance,
+                    'balance_formatted': f"{snapshot.balance:.4f}",
+                    'fiat_value': snapshot.fiat_value,
+                    'block_number': snapshot.block_number,
+                    'updated_at': snapshot.updated_at
+                })
+            else:
+                messages.warning(request, f"Could not fetch balance for wallet {wallet.address}")
                 wallet_balances.append({
                     'wallet': wallet,
                     'balance': 0,
                     'balance_formatted': "0.0000",
-                    'error': str(e)
+                    'error': "Balance not available yet"
                 })
         
+        if has_snapshots:
+            portfolio = getattr(wallets[0].user, 'portfolio_snapshot', None)
+        else:
+            # The totals changed when the missing snapshots were taken
+            portfolio = PortfolioSnapshot.objects.filter(user=request.user).first()
+        
         # Get recent transactions
         recent_transactions = Transaction.objects.filter(
             Q(from_wallet__in=wallets) | 
@@ -71,7 +96,8 @@ def wallet_dashboard(request):
         context = {
             'wallet_balances': wallet_balances,
             'recent_transactions': recent_transactions,
-            'eth_price': eth_price
+            'eth_price': eth_price,
+            'portfolio': portfolio
         }
         
         return render(request, 'banking/dashboard.html', context)
@@ -83,7 +109,7 @@ def wallet_dashboard(request):
 @login_required
 def create_wallet(request):
     if request.method == 'POST':
-        web3_client = Web3Client()
+        web3_client = get_web3_client()
         wallet = web3_client.create_wallet(request.user)
         messages.success(request, f"New wallet created: {wallet.address}")
     return redirect('wallet_dashboard')
@@ -94,7 +120,7 @@ def send_transaction(request):
         if request.method == 'POST':
             form = TransactionForm(request.POST)
             if form.is_valid():
-                web3_client = Web3Client()
+                web3_client = get_web3_client()
                 from_wallet = get_object_or_404(
                     Wallet,
                     user=request.user,
@@ -122,17 +148,18 @@ def send_transaction(request):
         
         wallets = Wallet.objects.filter(user=request.user)
         
-        # Get wallet balances
+        # Get wallet balances in a single batch request
         wallet_balances = []
-        web3_client = Web3Client()
+        web3_client = get_web3_client()
+        balances = web3_client.get_balances([wallet.address for wallet in wallets])
         for wallet in wallets:
-            try:
-                balance = web3_client.get_balance(wallet.address)
+            result = balances[wallet.address]
+            if result['error'] is None:
                 wallet_balances.append({
                     'address': wallet.address,
-                    'balance': f"{balance:.6f}"
+                    'balance': f"{result['balance']:.6f}"
                 })
-            except Exception as e:
+            else:
                 wallet_balances.append({
                     'address': wallet.address,
                     'balance': "Error fetching balance"
@@ -149,24 +176,99 @@ def send_transaction(request):
         return redirect('banking:wallet_dashboard')
 
 @login_required
+@replica_reads
 def transaction_history(request):
     wallets = Wallet.objects.filter(user=request.user)
-    transactions = Transaction.objects.filter(
-        Q(from_wallet__in=wallets) | Q(to_address__in=[w.address for w in wallets])
-    ).order_by('-created_at')
+    cursor = request.GET.get('cursor')
+    try:
+        transactions, next_cursor = history_page(wallets, cursor, settings.HISTORY_PAGE_SIZE)
+    except ValueError:
+        messages.error(request, "Invalid page, showing the latest transactions")
+        return redirect('banking:transaction_history')
     
     context = {
-        'transactions': transactions
+        'transactions': transactions,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor
     }
     return render(request, 'banking/transaction_history.html', context)
 
+@login_required
+@replica_reads
+def export_transactions(request):
+    """
+    Stream the user's transactions as CSV or JSON Lines, optionally for one wallet and date range
+    """
+    form = TransactionExportForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors.get_json_data()}, status=400)
+    
+    wallets = Wallet.objects.filter(user=request.user)
+    if form.cleaned_data['wallet']:
+        wallets = wallets.filter(address__iexact=form.cleaned_data['wallet'])
+        if not wallets.exists():
+            raise Http404("Wallet not found")
+    
+    # Whole days in the active time zone, end date included
+    start = end = None
+    if form.cleaned_data['start_date']:
+        start = timezone.make_aware(datetime.combine(form.cleaned_data['start_date'], time.min))
+    if form.cleaned_data['end_date']:
+        end = timezone.make_aware(
+            datetime.combine(form.cleaned_data['end_date'] + timedelta(days=1), time.min)
+        )
+    
+    rows = export_rows(wallets, start, end, settings.EXPORT_CHUNK_SIZE)
+    if form.cleaned_data['format'] == 'jsonl':
+        lines, content_type = jsonl_lines(rows), 'application/x-ndjson'
+    else:
+        lines, content_type = csv_lines(rows), 'text/csv'
+    if isinstance(request, ASGIRequest):
+        # Handed a sync iterator, the ASGI handler would read the whole export into memory first
+        lines = aiter_lines(lines, settings.EXPORT_CHUNK_SIZE)
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    filename = f"transactions-{timezone.now():%Y%m%d}.{form.cleaned_data['format']}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+@replica_reads
+def transaction_history_api(request):
+    """
+    Keyset-paginated transaction history as JSON, follow next_cursor for older pages
+    """
+    wallets = Wallet.objects.filter(user=request.user)
+    try:
+        limit = min(int(request.GET.get('limit', settings.HISTORY_PAGE_SIZE)), settings.HISTORY_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        transactions, next_cursor = history_page(wallets, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'transactions': [
+            {
+                'tx_hash': tx.tx_hash,
+                'from_address': tx.from_address,
+                'to_address': tx.to_address,
+                'amount': str(tx.amount),
+                'status': tx.status,
+                'created_at': tx.created_at.isoformat(),
+                'block_number': tx.block_number,
+            }
+            for tx in transactions
+        ],
+        'next_cursor': next_cursor,
+    })
+
 @login_required
 def create_multisig_transaction(request):
     if request.method == 'POST':
         form = TransactionForm(request.POST)
         if form.is_valid():
             try:
-                web3_client = Web3Client()
+                web3_client = get_web3_client()
                 multisig_manager = MultiSigManager(web3_client)
                 
                 from_wallet = Wallet.objects.get(
@@ -174,19 +276,28 @@ def create_multisig_transaction(request):
                     address=request.POST.get('from_wallet')
                 )
                 
-                tx = web3_client.send_transaction(
-                    from_wallet,
-                    form.cleaned_data['to_address'],
-                    form.cleaned_data['amount']
-                )
+                # Other users' wallets that may approve, comma or line separated
+                signer_addresses = [
+                    Web3.to_checksum_address(address)
+                    for address in request.POST.get('signers', '').replace(',', ' ').split()
+                ]
+                signers = list(Wallet.objects.filter(address__in=signer_addresses))
+                unknown = set(signer_addresses) - {wallet.address for wallet in signers}
+                if unknown:
+                    raise ValueError(f"Unknown signer wallet(s): {', '.join(sorted(unknown))}")
                 
+                # Sent by the executor once every signature is in
                 required_signatures = int(request.POST.get('required_signatures', 2))
                 multi_sig_tx = multisig_manager.create_multisig_transaction(
-                    tx, required_signatures
+                    from_wallet,
+                    form.cleaned_data['to_address'],
+                    form.cleaned_data['amount'],
+                    required_signatures,
+                    signers=signers
                 )
                 
                 messages.success(request, "Multi-signature transaction created")
-                return redirect('banking:multisig_detail', tx_hash=tx.tx_hash)
+                return redirect('banking:multisig_detail', reference=multi_sig_tx.reference)
             except Exception as e:
                 messages.error(request, f"Error creating transaction: {str(e)}")
     else:
@@ -200,6 +311,7 @@ def create_multisig_transaction(request):
     return render(request, 'banking/create_multisig.html', context)
 
 @login_required
+@replica_reads
 def transaction_detail(request, tx_hash):
     """
     Display detailed information about a specific transaction
@@ -211,32 +323,32 @@ def transaction_detail(request, tx_hash):
     # Get transaction
     transaction = get_object_or_404(
         Transaction,
-        tx_hash=tx_hash,
-        from_wallet__in=user_wallets
+        Q(from_wallet__in=user_wallets) | Q(to_address__in=user_addresses),
+        tx_hash=tx_hash
     )
     
     # Check if this is a multisig transaction
     try:
         multisig = transaction.multisigtransaction
-        return redirect('multisig_detail', tx_hash=tx_hash)
+        return redirect('banking:multisig_detail', reference=multisig.reference)
     except MultiSigTransaction.DoesNotExist:
         multisig = None
     
-    # Get transaction receipt from blockchain
-    web3_client = Web3Client()
+    # Settled transactions render from the database, only the ones the
+    # monitor hasn't settled yet ask the node for their receipt
+    web3_client = get_web3_client()
     try:
-        receipt = web3_client.w3.eth.get_transaction_receipt(tx_hash)
-        block_info = web3_client.w3.eth.get_block(receipt['blockNumber'])
+        if transaction.block_number is None:
+            receipt = web3_client.get_transaction_receipt(tx_hash)
+            block_info = web3_client.get_block(receipt['blockNumber'])
+            transaction.apply_receipt(receipt, block_info['timestamp'])
+            transaction.save(update_fields=[
+                'status', 'gas_used', 'block_number', 'block_timestamp', 'updated_at'
+            ])
         
         context = {
             'transaction': transaction,
-            'receipt': {
-                'block_number': receipt['blockNumber'],
-                'gas_used': receipt['gasUsed'],
-                'status': 'Success' if receipt['status'] == 1 else 'Failed',
-                'timestamp': block_info['timestamp'],
-                'confirmations': web3_client.w3.eth.block_number - receipt['blockNumber']
-            }
+            'receipt': transaction.receipt_summary(web3_client.get_latest_block_number())
         }
     except Exception as e:
         context = {
@@ -247,30 +359,33 @@ def transaction_detail(request, tx_hash):
     return render(request, 'banking/transaction_detail.html', context)
 
 @login_required
-def multisig_detail(request, tx_hash):
+@replica_reads
+def multisig_detail(request, reference):
     """
     Display details of a multi-signature transaction
     """
-    # Get user's wallets
-    user_wallets = Wallet.objects.filter(user=request.user)
-    
-    # Get transaction and multisig details
-    transaction = get_object_or_404(Transaction, tx_hash=tx_hash)
-    multisig = get_object_or_404(MultiSigTransaction, transaction=transaction)
+    # Transaction, multisig and the user's signing state in one query
+    multisig = get_object_or_404(multisig_for_signer(request.user, reference))
+    # Only the owner and the signers see it
+    if not (multisig.is_signer or multisig.has_signed):
+        raise Http404("No MultiSigTransaction matches the given query.")
     
     # Check if user can sign this transaction
     can_sign = (
-        user_wallets.exists() and
-        not TransactionSignature.objects.filter(
-            multi_sig_transaction=multisig,
-            signer__in=user_wallets
-        ).exists() and
-        multisig.current_signatures < multisig.required_signatures and
+        multisig.is_signer and
+        not multisig.has_signed and
+        multisig.status == MultiSigTransaction.OPEN and
         multisig.expires_at > timezone.now()
     )
     
+    try:
+        execution = multisig.execution
+    except MultiSigExecution.DoesNotExist:
+        execution = None
+    
     context = {
         'multisig': multisig,
+        'execution': execution,
         'can_sign': can_sign,
         'signatures': TransactionSignature.objects.filter(
             multi_sig_transaction=multisig
@@ -280,47 +395,75 @@ def multisig_detail(request, tx_hash):
     return render(request, 'banking/multisig_detail.html', context)
 
 @login_required
-def sign_multisig(request, tx_hash):
+@replica_reads
+def multisig_inbox(request):
+    """
+    Multi-signature transactions waiting for the user's signature
+    """
+    context = {
+        'multisigs': signable_multisigs(request.user)[:settings.MULTISIG_INBOX_SIZE]
+    }
+    return render(request, 'banking/multisig_inbox.html', context)
+
+@login_required
+@replica_reads
+def multisig_inbox_api(request):
+    """
+    Multi-signature transactions waiting for the user's signature, as JSON
+    """
+    multisigs = signable_multisigs(request.user)[:settings.MULTISIG_INBOX_SIZE]
+    return JsonResponse({
+        'multisigs': [
+            {
+                'reference': multisig.reference,
+                'tx_hash': multisig.transaction.tx_hash,
+                'from_address': multisig.transaction.from_address,
+                'to_address': multisig.transaction.to_address,
+                'amount': str(multisig.transaction.amount),
+                'current_signatures': multisig.current_signatures,
+                'required_signatures': multisig.required_signatures,
+                'remaining_signatures': multisig.remaining_signatures,
+                'expires_at': multisig.expires_at.isoformat(),
+            }
+            for multisig in multisigs
+        ]
+    })
+
+@login_required
+def sign_multisig(request, reference):
     """
     Sign a multi-signature transaction
     """
     if request.method != 'POST':
-        return redirect('multisig_detail', tx_hash=tx_hash)
+        return redirect('banking:multisig_detail', reference=reference)
     
     # Get transaction and multisig details
-    transaction = get_object_or_404(Transaction, tx_hash=tx_hash)
-    multisig = get_object_or_404(MultiSigTransaction, transaction=transaction)
+    multisig = get_object_or_404(
+        MultiSigTransaction.objects.select_related('transaction'),
+        reference=reference
+    )
     
-    # Get user's primary wallet
-    try:
-        signer_wallet = Wallet.objects.get(
-            user=request.user,
-            is_primary=True
-        )
-    except Wallet.DoesNotExist:
-        messages.error(request, "No primary wallet found")
-        return redirect('multisig_detail', tx_hash=tx_hash)
+    # The user's designated wallet signs, the owner signs with the sending wallet
+    signer_wallet = (
+        Wallet.objects.filter(user=request.user, designated_multisigs=multisig).first() or
+        Wallet.objects.filter(user=request.user, pk=multisig.transaction.from_wallet_id).first()
+    )
+    if signer_wallet is None:
+        messages.error(request, "You are not a signer of this transaction")
+        return redirect('banking:multisig_detail', reference=reference)
     
     # Check if transaction can be signed
-    if multisig.current_signatures >= multisig.required_signatures:
+    if multisig.status == MultiSigTransaction.APPROVED:
         messages.error(request, "Transaction already has required signatures")
-        return redirect('multisig_detail', tx_hash=tx_hash)
+        return redirect('banking:multisig_detail', reference=reference)
     
-    if multisig.expires_at <= timezone.now():
+    if multisig.status == MultiSigTransaction.EXPIRED or multisig.expires_at <= timezone.now():
         messages.error(request, "Transaction has expired")
-        return redirect('multisig_detail', tx_hash=tx_hash)
-    
-    # Check if user already signed
-    if TransactionSignature.objects.filter(
-        multi_sig_transaction=multisig,
-        signer=signer_wallet
-    ).exists():
-        messages.error(request, "You have already signed this transaction")
-        return redirect('multisig_detail', tx_hash=tx_hash)
+        return redirect('banking:multisig_detail', reference=reference)
     
     try:
         # Initialize Web3 client and MultiSig manager
-        web3_client = Web3Client()
+        web3_client = get_web3_client()
         multisig_manager = MultiSigManager(web3_client)
         
         # Add signature
@@ -329,7 +472,7 @@ def sign_multisig(request, tx_hash):
         if is_complete:
             messages.success(
                 request,
-                "Transaction signed and executed successfully!"
+                "Transaction signed and queued for execution!"
             )
         else:
             messages.success(
@@ -337,10 +480,13 @@ def sign_multisig(request, tx_hash):
                 "Transaction signed successfully. Awaiting more signatures."
             )
             
+    except ValueError as e:
+        # Already signed, expired or fully signed
+        messages.error(request, str(e))
     except Exception as e:
         messages.error(request, f"Error signing transaction: {str(e)}")
     
-    return redirect('multisig_detail', tx_hash=tx_hash)
+    return redirect('banking:multisig_detail', reference=reference)
 
 @login_required
 def generate_balance_proof(request):
@@ -359,7 +505,7 @@ def generate_balance_proof(request):
         )
         
         # Get current balance
-        web3_client = Web3Client()
+        web3_client = get_web3_client()
         balance = web3_client.get_balance(wallet.address)
         
         # Get threshold from form
@@ -392,4 +538,57 @@ def generate_balance_proof(request):
             })
         
         messages.error(request, f"Error generating proof: {str(e)}")
-        return render(request, 'banking/balance_proof.html')
\ No newline at end of file
+        return render(request, 'banking/balance_proof.html')
+
+@login_required
+def bulk_payout(request):
+    """
+    Send a CSV/JSON list of payouts from the user's wallets in one go
+
+    The payout runs in the background; the page polls its progress and
+    shows the per-row results once it is done.
+    """
+    if request.method == 'POST':
+        form = BulkPayoutForm(request.POST, request.FILES)
+        if form.is_valid():
+            job_id = form.cleaned_data['job_id']
+            service = BulkPayoutService(get_web3_client(), job_id=job_id)
+            service.start(request.user, form.cleaned_data['rows'])
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return JsonResponse({
+                    'job_id': job_id,
+                    'status_url': reverse('banking:bulk_payout_status', kwargs={'job_id': job_id})
+                }, status=202)
+            return redirect(f"{reverse('banking:bulk_payout')}?job={job_id}")
+    else:
+        form = BulkPayoutForm(initial={'job_id': uuid.uuid4().hex})
+
+    job_id = request.GET.get('job')
+    progress = BulkPayoutService.get_progress(request.user, job_id) if job_id else None
+    return render(request, 'banking/bulk_payout.html', {
+        'form': form,
+        'job_id': job_id,
+        'progress': progress,
+        'results': progress.get('results') if progress else None
+    })
+
+@login_required
+def bulk_payout_status(request, job_id):
+    """
+    Progress counters of one of the user's bulk payouts, with its results once done
+    """
+    progress = BulkPayoutService.get_progress(request.user, job_id)
+    if progress is None:
+        return JsonResponse({'error': 'Unknown payout job'}, status=404)
+    return JsonResponse(progress, json_dumps_params={'default': str})
+
+@staff_member_required
+def rpc_metrics(request):
+    """
+    Per-provider RPC latency/error counters of the worker serving this request
+    """
+    return JsonResponse({
+        'providers': get_web3_client().provider_metrics(),
+        'coalescing': get_web3_client().coalescing_stats(),
+        'balance_cache': balance_cache.stats(),
+    })
\ No newline at end of file